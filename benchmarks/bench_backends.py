@@ -0,0 +1,62 @@
+"""
+Message ingest and history read throughput of each storage backend.
+
+    python -m benchmarks.bench_backends --clients 100 --messages 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from uuid import UUID, uuid4
+
+from chatbox50 import AsyncSQLSession, Connection, Message, SegmentLogBackend, SentBy, StorageBackend
+
+
+async def run(label: str, backend: StorageBackend, clients: int, messages: int, batch: int) -> dict:
+    connections = [Connection(s1_id=uuid4(), s2_id=i) for i in range(clients)]
+    for cc in connections:
+        await backend.add_new_connection(cc)
+    pending = [Message(cc, SentBy(i % 2), f"message {i} of {cc.s1_id}")
+               for i in range(messages) for cc in connections]
+
+    t = time.perf_counter()
+    for i in range(0, len(pending), batch):
+        await backend.commit_message_batch(pending[i:i + batch])
+    write_sec = time.perf_counter() - t
+
+    t = time.perf_counter()
+    read = 0
+    for cc in connections:
+        before_id = None
+        while page := await backend.get_history(cc, 100, before_id):
+            read += len(page)
+            before_id = page[0].history_id
+    read_sec = time.perf_counter() - t
+    backend.close()
+    assert read == len(pending)
+    return {"backend": label,
+            "messages": len(pending),
+            "write_msg_per_sec": round(len(pending) / write_sec),
+            "read_msg_per_sec": round(read / read_sec)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=500, help="messages per client")
+    parser.add_argument("--batch", type=int, default=256)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {"sqlite": AsyncSQLSession(os.path.join(directory, "sqlite"), UUID, int, init=True),
+                    "sqlite_wal": AsyncSQLSession(os.path.join(directory, "sqlite_wal"), UUID, int, init=True,
+                                                  wal=True, readers=2),
+                    "segment_log": SegmentLogBackend(os.path.join(directory, "segment"), UUID, int)}
+        results = [await run(label, backend, args.clients, args.messages, args.batch)
+                   for label, backend in backends.items()]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
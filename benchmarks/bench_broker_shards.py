@@ -0,0 +1,61 @@
+"""
+End-to-end throughput of ChatBox by the number of broker shards.
+Service1 clients send messages, and the time until service2 has received all of them is measured.
+
+    python -m benchmarks.bench_broker_shards --connections 100 --messages 100 --shards 1 2 4 8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from chatbox50 import ChatBox, Message
+
+
+async def run(shards: int, connections: int, messages: int) -> dict:
+    cb = ChatBox(name=f"bench_shards_{shards}", s2_id_type=int, debug=True, broker_shards=shards)
+    worker1, worker2 = cb.get_worker1, cb.get_worker2
+    s2_ids = itertools.count()
+    worker2.set_create_callback(lambda _: next(s2_ids))
+    total = connections * messages
+    received = 0
+    done = asyncio.Event()
+
+    async def on_message(_: Message):
+        nonlocal received
+        received += 1
+        if received == total:
+            done.set()
+
+    worker2.set_received_message_callback(on_message)
+    tasks = cb.run()
+    senders = [worker1.get_msg_sender(await worker1.access_new_client()) for _ in range(connections)]
+
+    async def client(sender):
+        for i in range(messages):
+            await sender(f"message {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(sender) for sender in senders))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cb.close()
+    return {"shards": shards, "messages": total, "msg_per_sec": round(total / elapsed)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=100, help="messages per connection")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    results = [await run(shards, args.connections, args.messages) for shards in args.shards]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Delivery latency of ChatBox: the time from a service1 sender call until the service2 callback
+and the per-client queue of service2 have the message.
+
+    python -m benchmarks.bench_dispatch_latency --connections 10 --messages 500
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+
+from chatbox50 import ChatBox, Message
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(connections: int, messages: int, interval: float) -> dict:
+    cb = ChatBox(name="bench_dispatch", s2_id_type=int, debug=True)
+    worker1, worker2 = cb.get_worker1, cb.get_worker2
+    s2_ids = itertools.count()
+    worker2.set_create_callback(lambda _: next(s2_ids))
+    total = connections * messages
+    callback_latency: list[float] = []
+    queue_latency: list[float] = []
+    done = asyncio.Event()
+
+    async def on_message(msg: Message):
+        callback_latency.append(time.perf_counter_ns() - int(msg.content))
+
+    worker2.set_received_message_callback(on_message)
+    tasks = cb.run()
+    s1_ids = [await worker1.access_new_client() for _ in range(connections)]
+    senders = [worker1.get_msg_sender(s1_id) for s1_id in s1_ids]
+
+    async def reader(s2_id):
+        que = worker2.get_client_queue(s2_id)
+        for _ in range(messages):
+            msg = await que.get()
+            queue_latency.append(time.perf_counter_ns() - int(msg.content))
+        if len(queue_latency) == total:
+            done.set()
+
+    async def client(sender):
+        for _ in range(messages):
+            await sender(str(time.perf_counter_ns()))
+            await asyncio.sleep(interval)
+
+    readers = [asyncio.create_task(reader(worker1.get_connection(s1_id).s2_id)) for s1_id in s1_ids]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(sender) for sender in senders))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    for task in tasks + readers:
+        task.cancel()
+    await asyncio.gather(*tasks, *readers, return_exceptions=True)
+    cb.close()
+    callback_latency.sort()
+    queue_latency.sort()
+    return {"messages": total,
+            "msg_per_sec": round(total / elapsed),
+            "callback_p50_us": round(statistics.median(callback_latency) / 1000, 1),
+            "callback_p99_us": round(_percentile(callback_latency, 0.99) / 1000, 1),
+            "queue_p50_us": round(statistics.median(queue_latency) / 1000, 1),
+            "queue_p99_us": round(_percentile(queue_latency, 0.99) / 1000, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=500, help="messages per connection")
+    parser.add_argument("--interval", type=float, default=0.001,
+                        help="seconds each connection waits between messages, 0 for a burst")
+    args = parser.parse_args()
+    print(json.dumps(await run(args.connections, args.messages, args.interval), indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+"""
+End-to-end benchmark of ChatBox(debug=True) with fake service adapters: `FakeWebSocket` clients on service1,
+like websocket_router, and a `FakeDiscord` on service2, like DiscordServer.
+For each number of concurrent connections it measures:
+    setup: the cost of `access_new_client` for a new connection, which also runs the create callback of service2.
+    memory: bytes allocated per active connection (tracemalloc, in a separate ChatBox).
+    throughput: messages/sec until service2 has received every message.
+    latency: from the creation of a message until the service2 callback and until the client queue of service1.
+
+    python -m benchmarks.bench_end_to_end --connections 10 1000 10000 --output results.json
+    python -m benchmarks.bench_end_to_end --compare results.json    # compare with an earlier run
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from uuid import UUID
+
+from chatbox50 import ChatBox, Message, SentBy, ServiceWorker
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class FakeDiscord:
+    """
+    Service2 adapter. Creates a thread id for each new connection and records the latency of every message
+    from service1, as DiscordServer posts them to the thread.
+    """
+
+    def __init__(self, worker: ServiceWorker):
+        self.__thread_ids = itertools.count(1)
+        self.latency_ns: list[int] = []
+        self.received = 0
+        self.expected = 0
+        self.done = asyncio.Event()
+        worker.set_create_callback(self.create_thread)
+        worker.set_received_message_callback(self.on_message)
+
+    async def create_thread(self, _: UUID) -> int:
+        return next(self.__thread_ids)
+
+    async def on_message(self, msg: Message) -> None:
+        if msg.sent_by != SentBy.s1:
+            return
+        self.latency_ns.append(time.monotonic_ns() - msg.monotonic_ns)
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set()
+
+
+class FakeWebSocket:
+    """
+    Service1 adapter for one client. Sends through `get_msg_sender` and reads its client queue,
+    as websocket_router does.
+    """
+
+    def __init__(self, worker: ServiceWorker, s1_id: UUID):
+        self.__sender = worker.get_msg_sender(s1_id)
+        self.queue = worker.get_client_queue(s1_id)
+        self.latency_ns: list[int] = []
+
+    async def send(self, messages: int, interval: float) -> None:
+        for i in range(messages):
+            await self.__sender(f"message {i}")
+            if interval:
+                await asyncio.sleep(interval)
+
+    async def read(self) -> None:
+        # the client queue of service1 gets the messages of this client back, as the echo of the web page.
+        # Its overflow policy may drop some of them, so it reads until it is cancelled.
+        while True:
+            msg = await self.queue.get()
+            self.latency_ns.append(time.monotonic_ns() - msg.monotonic_ns)
+
+
+async def measure_memory(connections: int) -> float:
+    cb = ChatBox(name="bench_e2e_memory", s2_id_type=int, debug=True)
+    FakeDiscord(cb.get_worker2)
+    tasks = cb.run()
+    await cb.get_worker1.access_new_client()  # the first access creates lazily initialized objects
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(connections):
+        await cb.get_worker1.access_new_client()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cb.close()
+    return (after - before) / connections
+
+
+async def run(connections: int, messages: int, interval: float) -> dict:
+    cb = ChatBox(name="bench_e2e", s2_id_type=int, debug=True)
+    worker1 = cb.get_worker1
+    discord = FakeDiscord(cb.get_worker2)
+    tasks = cb.run()
+
+    setup_ns = []
+    s1_ids = []
+    for _ in range(connections):
+        start = time.perf_counter_ns()
+        s1_ids.append(await worker1.access_new_client())
+        setup_ns.append(time.perf_counter_ns() - start)
+    clients = [FakeWebSocket(worker1, s1_id) for s1_id in s1_ids]
+
+    per_client = max(1, messages // connections)
+    total = per_client * connections
+    discord.expected = total
+    readers = [asyncio.create_task(client.read()) for client in clients]
+    start = time.perf_counter()
+    await asyncio.gather(*(client.send(per_client, interval) for client in clients))
+    await discord.done.wait()
+    elapsed = time.perf_counter() - start
+    while any(not client.queue.empty() for client in clients):
+        await asyncio.sleep(0.01)
+    dropped = sum(stats["dropped"] for stats in cb.queue_stats() if stats["name"] == f"{worker1._name}.client")
+    for task in tasks + readers:
+        task.cancel()
+    await asyncio.gather(*tasks, *readers, return_exceptions=True)
+    cb.close()
+
+    setup_ns.sort()
+    callback_ns = sorted(discord.latency_ns)
+    queue_ns = sorted(ns for client in clients for ns in client.latency_ns)
+    return {"connections": connections,
+            "messages": total,
+            "msg_per_sec": round(total / elapsed),
+            "callback_p50_us": round(statistics.median(callback_ns) / 1000, 1),
+            "callback_p99_us": round(_percentile(callback_ns, 0.99) / 1000, 1),
+            "queue_p50_us": round(statistics.median(queue_ns) / 1000, 1),
+            "queue_p99_us": round(_percentile(queue_ns, 0.99) / 1000, 1),
+            "queue_dropped": dropped,
+            "setup_avg_us": round(statistics.fmean(setup_ns) / 1000, 1),
+            "setup_p99_us": round(_percentile(setup_ns, 0.99) / 1000, 1),
+            "bytes_per_connection": round(await measure_memory(connections))}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict) -> list[dict]:
+    """
+    Returns: list[dict]: the relative change of each metric, for the connection counts in both results.
+    """
+    old_results = {result["connections"]: result for result in old["results"]}
+    changes = []
+    for result in new["results"]:
+        previous = old_results.get(result["connections"])
+        if previous is None:
+            continue
+        change = {"connections": result["connections"]}
+        for key, value in result.items():
+            if key in ("connections", "messages") or not previous.get(key):
+                continue
+            change[key] = f"{(value - previous[key]) / previous[key] * 100:+.1f}%"
+        changes.append(change)
+    return changes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--messages", type=int, default=20000,
+                        help="messages in total, spread over the connections (at least 1 per connection)")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="seconds each connection waits between messages, 0 for a burst")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="JSON", help="print the change from the results in this JSON file")
+    args = parser.parse_args()
+    report = {"benchmark": "end_to_end",
+              "commit": _commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "messages": args.messages,
+              "interval": args.interval,
+              "results": [await run(connections, args.messages, args.interval) for connections in args.connections]}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print(json.dumps({"compared_with": old.get("commit"), "changes": compare(old, report)}, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
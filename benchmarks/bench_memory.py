@@ -0,0 +1,59 @@
+"""
+Heap cost of the records ChatBox keeps for each active connection and each in-flight message.
+Ids and contents are created before tracing, so only `Connection` and `Message` themselves are counted.
+
+    python -m benchmarks.bench_memory --connections 100000 --messages 100000
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+from uuid import uuid4
+
+from chatbox50 import Connection, Message, SentBy
+
+
+def _traced(build) -> tuple[int, object]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+
+def run(connections: int, messages: int) -> dict:
+    s1_ids = [uuid4() for _ in range(connections)]
+    uids = [uuid4() for _ in range(connections)]
+    connection_bytes, ccs = _traced(lambda: [Connection(s1_id=s1_id, s2_id=i, uid=uid)
+                                             for i, (s1_id, uid) in enumerate(zip(s1_ids, uids))])
+
+    cc = ccs[0]
+    contents = [f"message {i}" for i in range(messages)]
+    # the list which keeps them is allocated before tracing, as a queue or the history of a connection would be.
+    in_flight = [None] * messages
+
+    def build():
+        for i, content in enumerate(contents):
+            in_flight[i] = Message(cc, SentBy(i % 2), content)
+        return in_flight
+
+    message_bytes, _ = _traced(build)
+    return {"connections": connections,
+            "bytes_per_connection": round(connection_bytes / connections, 1),
+            "messages": messages,
+            "bytes_per_message": round(message_bytes / messages, 1),
+            "sizeof_connection": sys.getsizeof(cc),
+            "sizeof_message": sys.getsizeof(in_flight[0])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.connections, args.messages), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Throughput of sending with one `get_msg_sender` call per message against `ServiceWorker.send_many`.
+The time until service2 has received every message is measured.
+
+    python -m benchmarks.bench_send_many --connections 10 --messages 5000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from chatbox50 import ChatBox, Message, tracer
+
+
+async def run(mode: str, connections: int, messages: int, debug: bool) -> dict:
+    cb = ChatBox(name=f"bench_send_many_{mode}", s2_id_type=int, debug=debug)
+    worker1, worker2 = cb.get_worker1, cb.get_worker2
+    s2_ids = itertools.count()
+    worker2.set_create_callback(lambda _: next(s2_ids))
+    total = connections * messages
+    received = 0
+    done = asyncio.Event()
+
+    async def on_message(_: Message):
+        nonlocal received
+        received += 1
+        if received == total:
+            done.set()
+
+    worker2.set_received_message_callback(on_message)
+    tasks = cb.run()
+    s1_ids = [await worker1.access_new_client() for _ in range(connections)]
+
+    async def client(s1_id):
+        if mode == "send_many":
+            await worker1.send_many(s1_id, (f"message {i}" for i in range(messages)))
+        else:
+            sender = worker1.get_msg_sender(s1_id)
+            for i in range(messages):
+                await sender(f"message {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(s1_id) for s1_id in s1_ids))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cb.close()
+    return {"mode": mode, "messages": total, "msg_per_sec": round(total / elapsed)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5000, help="messages per connection")
+    parser.add_argument("--sqlite", action="store_true", help="write to SQLite files instead of debug mode")
+    parser.add_argument("--trace", type=float, default=None, metavar="RATE",
+                        help="enable tracing with this sample rate, and print the number of spans")
+    args = parser.parse_args()
+    if args.trace is not None:
+        tracer.enable(sample_rate=args.trace, max_spans=1_000_000)
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            results = [await run(mode, args.connections, args.messages, not args.sqlite)
+                       for mode in ("sender", "send_many")]
+        finally:
+            os.chdir(cwd)
+    if args.trace is not None:
+        results.append({"spans": len(tracer.spans()), "dropped": tracer.dropped})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Size and speed of the `history` table in the text and compact storage formats.
+
+    python -m benchmarks.bench_storage_format --clients 100 --messages 200
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+from chatbox50 import Connection, Message, SentBy, StorageFormat
+from chatbox50.db_session import SQLSession
+
+
+def _history_bytes(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name IN ('history', 'idx_history_client_id')"
+                            ).fetchone()[0]
+    except sqlite3.OperationalError:
+        # SQLite is built without dbstat.
+        return os.path.getsize(path)
+    finally:
+        conn.close()
+
+
+def run(storage_format: StorageFormat, clients: int, messages: int, batch: int, directory: str) -> dict:
+    name = os.path.join(directory, storage_format.value)
+    session = SQLSession(name, UUID, int, init=True, storage_format=storage_format)
+    connections = [Connection(s1_id=uuid4(), s2_id=i) for i in range(clients)]
+    for cc in connections:
+        session.add_new_connection(cc)
+    start = datetime.utcnow()
+    pending = [Message(cc, SentBy(i % 2), f"message {i} of {cc.s1_id}", created_at=start + timedelta(microseconds=i))
+               for i in range(messages) for cc in connections]
+
+    t = time.perf_counter()
+    for i in range(0, len(pending), batch):
+        session.commit_message_batch(pending[i:i + batch])
+    write_sec = time.perf_counter() - t
+
+    t = time.perf_counter()
+    read = sum(1 for cc in connections for _ in session.iter_history(cc, page_size=100))
+    read_sec = time.perf_counter() - t
+    session.close()
+    assert read == len(pending)
+    return {"format": storage_format.value,
+            "messages": len(pending),
+            "write_msg_per_sec": round(len(pending) / write_sec),
+            "read_msg_per_sec": round(read / read_sec),
+            "history_bytes": _history_bytes(name + ".db"),
+            "file_bytes": os.path.getsize(name + ".db")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=200, help="messages per client")
+    parser.add_argument("--batch", type=int, default=256)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run(f, args.clients, args.messages, args.batch, directory) for f in StorageFormat]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,16 @@
 from __future__ import annotations
 from chatbox50.message import Message, SentBy
+from chatbox50.codec import StorageFormat
 from chatbox50.connection import Connection
 from chatbox50.db_session import SQLSession
+from chatbox50.db_executor import AsyncSQLSession
+from chatbox50.backend import StorageBackend
+from chatbox50.segment_log import SegmentLogBackend
+from chatbox50.retention import RetentionPolicy
+from chatbox50.queues import OverflowPolicy, QueueConfig, QueueDisconnected, QueueLimits
+from chatbox50.tracing import Tracer, tracer
 from chatbox50.chatbox import ChatBox
 from chatbox50.service_worker import ServiceWorker
+from chatbox50.transport import TcpTransport, UnixTransport
+from chatbox50.remote import ChatBoxServer, RemoteChatBox
+from chatbox50.multiprocess import ShardSupervisor
@@ -0,0 +1,63 @@
+from typing import AsyncIterator, Protocol, runtime_checkable
+from uuid import UUID
+
+from chatbox50._utils import Immutable
+from chatbox50.connection import Connection
+from chatbox50.message import Message, SentBy
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """
+    The storage operations `ChatBox` uses. `AsyncSQLSession` (SQLite) and `SegmentLogBackend`
+    (append-only log files) implement it, and any object with these methods can be given to `ChatBox(backend=...)`.
+    """
+
+    async def get_connection(self, sent_by: SentBy, service_id: Immutable) -> None | Connection:
+        """
+        Returns: the saved connection whose service id of `sent_by` is `service_id`, or None.
+        """
+        ...
+
+    async def add_new_connection(self, cc: Connection) -> bool:
+        """
+        Returns: bool: False if a saved connection already has the uid or one of the service ids of `cc`.
+        """
+        ...
+
+    async def update_properties(self, items: list[tuple[Connection, str]]) -> list[bool]:
+        """
+        Replace the saved properties of connections. `PropertyFlusher` calls it with the connections which changed.
+        Args:
+            items: (connection, its properties as JSON)
+
+        Returns: list[bool]: whether each connection was updated, in the same order as `items`.
+        """
+        ...
+
+    def iter_client_ids(self, batch_size: int = 10000) -> AsyncIterator[list[tuple[UUID, str, str]]]:
+        """
+        Stream every saved connection as (uid, service1 id, service2 id) in batches, the ids converted with
+        `str_converter`. `ChatBox` builds its `IdIndex` from it at startup.
+        """
+        ...
+
+    async def commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        """
+        Persist messages as one unit.
+        Returns: list[bool]: whether each message was persisted, in the same order as `messages`.
+        """
+        ...
+
+    async def get_history(self, cc: Connection, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        """
+        Returns: list[Message]: up to `limit` messages whose `history_id` is smaller than `before_id`
+                 (the latest ones if None), in chronological order.
+        """
+        ...
+
+    def cache_stats(self) -> list[dict]:
+        ...
+
+    def close(self) -> None:
+        ...
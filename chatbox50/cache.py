@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the number of entries, with an optional time to live.
+    Counts hits, misses, evictions and expirations.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float | None = None, name: str = "cache"):
+        """
+
+        Args:
+            maxsize: the maximum number of entries. The least recently used entry is evicted when it is exceeded.
+            ttl: seconds an entry stays valid. If None, entries are valid until they are evicted or invalidated.
+            name: used as the label of `stats()`.
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be 1 or more, not {maxsize}")
+        self.name = name
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self.__data: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.__lock:
+            entry = self.__data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.__data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        expires_at = None if self._ttl is None else time.monotonic() + self._ttl
+        with self.__lock:
+            self.__data[key] = (value, expires_at)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self._maxsize:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self.__lock:
+            return self.__data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {"name": self.name,
+                    "size": len(self.__data),
+                    "maxsize": self._maxsize,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
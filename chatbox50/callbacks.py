@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger("chatbox.callbacks")
+logger.addHandler(logging.NullHandler())
+
+
+class Callback:
+    """
+    A user callback, classified as sync or async once when it is set.
+    Async callbacks are awaited on the event loop. Sync callbacks run on the thread pool of their `CallbackRunner`.
+    """
+
+    def __init__(self, func: Callable, name: str, runner: "CallbackRunner"):
+        if not callable(func):
+            raise TypeError(f"callback `{name}` must be callable, not `{type(func)}`")
+        self.func = func
+        self.name = name
+        self.is_async = asyncio.iscoroutinefunction(func)
+        self.__runner = runner
+        self.calls = 0
+        self.errors = 0
+        self.run_sec = 0.0
+        self.max_run_sec = 0.0
+        # seconds between the call and the start in a thread, only for sync callbacks.
+        self.queued_sec = 0.0
+        self.max_queued_sec = 0.0
+        # sync callbacks update the counters from several threads
+        self.__lock = threading.Lock()
+
+    async def __call__(self, *args) -> Any:
+        self.calls += 1
+        if self.is_async:
+            start = time.perf_counter()
+            try:
+                return await self.func(*args)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.__add_run(time.perf_counter() - start)
+        return await self.__runner.run_in_thread(self, args)
+
+    def _run_sync(self, called: float, args: tuple) -> Any:
+        start = time.perf_counter()
+        with self.__lock:
+            self.queued_sec += start - called
+            self.max_queued_sec = max(self.max_queued_sec, start - called)
+        try:
+            return self.func(*args)
+        except Exception:
+            with self.__lock:
+                self.errors += 1
+            raise
+        finally:
+            self.__add_run(time.perf_counter() - start)
+
+    def __add_run(self, sec: float):
+        with self.__lock:
+            self.run_sec += sec
+            self.max_run_sec = max(self.max_run_sec, sec)
+
+    def stats(self) -> dict:
+        return {"name": self.name,
+                "kind": "async" if self.is_async else "sync",
+                "calls": self.calls,
+                "errors": self.errors,
+                "avg_run_ms": round(self.run_sec / self.calls * 1000, 3) if self.calls else 0.0,
+                "max_run_ms": round(self.max_run_sec * 1000, 3),
+                "avg_queued_ms": round(self.queued_sec / self.calls * 1000, 3) if self.calls else 0.0,
+                "max_queued_ms": round(self.max_queued_sec * 1000, 3)}
+
+
+class CallbackRunner:
+    """
+    Runs the callbacks of one ServiceWorker. Sync callbacks run on its own named thread pool instead of the
+    default executor of the event loop, so a slow callback only delays the callbacks of the same worker.
+    """
+
+    def __init__(self, name: str, max_threads: int = 4, max_pending: int = 256):
+        """
+
+        Args:
+            name: prefix of the thread names.
+            max_threads: the size of the thread pool.
+            max_pending: the maximum number of sync calls waiting for or running in the pool.
+                         Callers wait when it is reached.
+        """
+        if max_threads < 1:
+            raise ValueError(f"max_threads must be 1 or more, not {max_threads}")
+        if max_pending < max_threads:
+            raise ValueError(f"max_pending must be max_threads ({max_threads}) or more, not {max_pending}")
+        self._name = name
+        self._max_threads = max_threads
+        self.__pending = asyncio.Semaphore(max_pending)
+        self.__executor: ThreadPoolExecutor | None = None
+        self.__callbacks: dict[str, Callback] = dict()
+
+    def wrap(self, func: Callable | None, name: str) -> Callback | None:
+        """
+        Returns: the classified callback, or None if `func` is None.
+        """
+        if func is None:
+            self.__callbacks.pop(name, None)
+            return None
+        callback = Callback(func, name, self)
+        self.__callbacks[name] = callback
+        return callback
+
+    async def run_in_thread(self, callback: Callback, args: tuple) -> Any:
+        called = time.perf_counter()
+        async with self.__pending:
+            if self.__executor is None:
+                # created on the first sync call, a worker with only async callbacks has no threads.
+                self.__executor = ThreadPoolExecutor(max_workers=self._max_threads,
+                                                     thread_name_prefix=f"{self._name}_callback")
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, callback._run_sync, called, args)
+
+    def stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: calls, errors, run time and time queued for a thread of each callback.
+        """
+        return [dict(callback.stats(), name=f"{self._name}.{callback.name}") for callback in self.__callbacks.values()]
+
+    def shutdown(self) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
@@ -1,13 +1,24 @@
 import asyncio
 import json
-from asyncio import CancelledError, Queue, Task, create_task
+import time
+from asyncio import CancelledError, Future, Queue, Task, create_task
 from uuid import UUID, uuid4
 
-from chatbox50._utils import ImmutableType, run_as_await_func, get_logger_with_nullhandler
-from chatbox50.db_session import SQLSession
-from chatbox50.connection import Connection
+from chatbox50._utils import ImmutableType, get_logger_with_nullhandler
+from chatbox50.backend import StorageBackend
+from chatbox50.codec import StorageFormat
+from chatbox50.db_executor import AsyncSQLSession
+from chatbox50.id_index import IdIndex
+from chatbox50.connection import DEFAULT_MESSAGE_WINDOW, Connection
 from chatbox50.service_worker import ServiceWorker
 from chatbox50.message import Message, SentBy
+from chatbox50.metrics import ACTIVE_CONNECTIONS, DB_COMMIT_FAILURES, DB_COMMITS, HIBERNATED_CONNECTIONS, \
+    MESSAGE_LATENCY, QUEUE_DEPTH, registry
+from chatbox50.property_flusher import PropertyFlusher
+from chatbox50.queues import BoundedQueue, QueueLimits, drain_batch
+from chatbox50.retention import HistoryRetention, RetentionPolicy
+from chatbox50.tracing import tracer
+from chatbox50.write_behind import WriteBehindBuffer
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,6 +37,26 @@ class ChatBox:
                  s1_id_type: ImmutableType = UUID,
                  s2_id_type: ImmutableType = UUID,
                  debug: bool = False,
+                 write_batch_size: int = 256,
+                 write_delay: float = 0.05,
+                 wal: bool = False,
+                 db_readers: int = 0,
+                 lookup_cache_size: int = 4096,
+                 lookup_cache_ttl: float | None = None,
+                 storage_format: StorageFormat | str = StorageFormat.text,
+                 backend: StorageBackend | None = None,
+                 retention: RetentionPolicy | None = None,
+                 broker_shards: int = 1,
+                 client_queues: bool = True,
+                 queue_limits: QueueLimits | None = None,
+                 callback_threads: int = 4,
+                 batch_limit: int = 256,
+                 message_window: int = DEFAULT_MESSAGE_WINDOW,
+                 properties_flush_interval: float = 1.0,
+                 idle_ttl: float | None = None,
+                 idle_tick: float = 1.0,
+                 id_index: bool = True,
+                 id_index_uids: bool = True,
                  _logger: logging.Logger = None):
         """
 
@@ -37,6 +68,49 @@ class ChatBox:
              s1_id_type(str, int, UUID, complex, float, bool, tuple, bytes):
              s2_id_type(str, int, UUID, complex, float, bool, tuple, bytes):
              debug: If True, SQLite files are not generated.
+             write_batch_size: Messages are committed to the database in groups of at most this size.
+             write_delay: Maximum seconds a message waits in the write buffer before its group is committed.
+             wal: If True, the SQLite file is opened in WAL mode.
+             db_readers: With `wal=True`, the number of read-only connections used for history and lookups.
+             lookup_cache_size: Maximum entries of the uid and service_id lookup caches of the database.
+             lookup_cache_ttl: Seconds a lookup cache entry stays valid. If None, until it is evicted.
+             storage_format: "text" or "compact". Compact stores UUIDs as 16-byte BLOBs and timestamps as
+             epoch microseconds. It can't be changed after the file is created, see `chatbox50.convert_db`.
+             backend: Storage of connections and messages. If None, `AsyncSQLSession` is created from the
+             arguments above. Give `SegmentLogBackend` or your own `StorageBackend` to replace SQLite.
+             retention: If set, messages older than `retention.days` are moved to gzip archive files by a background
+             task. They can still be read with `Connection.history()`.
+             broker_shards: Experimental. The number of broker workers. With more than 1, messages are routed to a
+             worker by `Connection.uid`, so messages of one connection stay in order. The workers share one event
+             loop, so this adds a queue hop without adding parallelism, and `benchmarks.bench_broker_shards` is
+             slower with every shard added. Keep the default of 1 and use `ShardSupervisor` to use more cores.
+             client_queues: If False, ServiceWorkers don't fill per-client queues. Use it when every service
+             receives messages only through `set_received_message_callback`.
+             queue_limits: Capacity and overflow policy (block, drop oldest, drop newest, disconnect) of each class
+             of queue. If None, the defaults of `QueueLimits`. See `queue_stats()` for the high-water marks.
+             By default each client queue keeps the newest 1024 messages and `receive_queue` the newest 10000,
+             older ones are dropped without an error and only counted in `dropped` of `queue_stats()`. Read them,
+             or set `client_queues=False` if only callbacks are used, or give a larger `QueueConfig`.
+             callback_threads: The thread pool size of each ServiceWorker for sync callbacks.
+             See `callback_stats()` for their timing.
+             batch_limit: The maximum number of messages the brokers and ServiceWorkers take from a queue per wakeup.
+             Messages taken together are committed to the database as one group.
+             message_window: The number of recent messages each active connection keeps in memory.
+             Older ones are read from storage, see `Connection.recent_messages()`.
+             properties_flush_interval: Seconds between two saves of the connection properties which changed.
+             idle_ttl: Seconds without messages or access after which each ServiceWorker hibernates a client.
+             Its client queue is freed, and it is restored on its next message or access. The messages of the
+             connection in memory are freed when neither service has it active.
+             A client whose queue is being read is never hibernated. If None, clients stay active.
+             idle_tick: The resolution in seconds of `idle_ttl`.
+             id_index: On by default. The service ids of every saved connection are loaded into an `IdIndex` by a
+             task of `run()`, and an access with an id which was never seen creates the connection without a
+             database lookup. Until the load finishes, accesses look up the database as before. The index assumes
+             this ChatBox is the only writer of the storage: set it False if another process adds connections to
+             the same storage, otherwise it may try to create a connection which already exists.
+             id_index_uids: If True, the index keeps the uid of each service id, about 100 bytes per id, and answers
+             exactly. If False, it keeps Bloom filters, about 10 bits per id, and their false positives go to the
+             database.
 
         Returns:
              object:
@@ -44,13 +118,26 @@ class ChatBox:
             ChatBox50 is multi-threaded and runs in the same event loop as the main function.
             If you want to run in multiple processes, create an event loop in each process.
             Add the event loop to the `loop` argument of ChatBox50. `Queue` is not shared.
-            As a way to solve that problem,
-            you can connect `multiprocessing.Queue` with `Queue` of `chatbox50.ServiceWorker`.
+            As a way to solve that problem, use `chatbox50.ShardSupervisor`, which runs ChatBoxes in shard processes
+            and forwards to them from `ServiceWorker` compatible proxies.
         """
         self._name = name
         self._uid = uuid4()
-        self._s1_que = Queue()
-        self._s2_que = Queue()
+        if queue_limits is None:
+            queue_limits = QueueLimits()
+        self._s1_que = BoundedQueue(queue_limits.upload, "s1_upload")
+        self._s2_que = BoundedQueue(queue_limits.upload, "s2_upload")
+        if broker_shards < 1:
+            raise ValueError(f"broker_shards must be 1 or more, not {broker_shards}")
+        self._broker_shards = broker_shards
+        if batch_limit < 1:
+            raise ValueError(f"batch_limit must be 1 or more, not {batch_limit}")
+        self._batch_limit = batch_limit
+        if message_window < 0:
+            raise ValueError(f"message_window must be 0 or more, not {message_window}")
+        self._message_window = message_window
+        self.__shard_ques: list[BoundedQueue[Message]] = [BoundedQueue(queue_limits.upload, f"broker_shard{i}")
+                                                          for i in range(broker_shards)] if broker_shards > 1 else []
         self._s1_id_type = s1_id_type
         self._s2_id_type = s2_id_type
         if _logger is None:
@@ -60,12 +147,38 @@ class ChatBox:
 
         self._service1 = ServiceWorker(name=s1_name, service_number=SentBy.s1, set_id_type=self._s1_id_type,
                                        upload_que=self._s1_que, new_access_callback=self.__access_from_service1,
-                                       deactivate_callback=self.__deactivate_processing, _logger=logger)
+                                       deactivate_callback=self.__deactivate_processing, _logger=logger,
+                                       client_queues=client_queues, queue_limits=queue_limits,
+                                       callback_threads=callback_threads, batch_limit=batch_limit,
+                                       idle_ttl=idle_ttl, idle_tick=idle_tick,
+                                       hibernate_callback=self.__hibernate_processing)
         self._service2 = ServiceWorker(name=s2_name, service_number=SentBy.s2, set_id_type=self._s2_id_type,
                                        upload_que=self._s2_que, new_access_callback=self.__access_from_service2,
-                                       deactivate_callback=self.__deactivate_processing, _logger=logger)
-        self.__db = SQLSession(file_name=self._name, init=True, debug=debug, s1_id_type=self._s1_id_type,
-                               s2_id_type=self._s2_id_type, logger=logger)
+                                       deactivate_callback=self.__deactivate_processing, _logger=logger,
+                                       client_queues=client_queues, queue_limits=queue_limits,
+                                       callback_threads=callback_threads, batch_limit=batch_limit,
+                                       idle_ttl=idle_ttl, idle_tick=idle_tick,
+                                       hibernate_callback=self.__hibernate_processing)
+        if backend is None:
+            backend = AsyncSQLSession(file_name=self._name, init=True, debug=debug, s1_id_type=self._s1_id_type,
+                                      s2_id_type=self._s2_id_type, logger=logger, wal=wal, readers=db_readers,
+                                      lookup_cache_size=lookup_cache_size, lookup_cache_ttl=lookup_cache_ttl,
+                                      storage_format=storage_format)
+        self.__db: StorageBackend = backend
+        self.__retention: HistoryRetention | None = None
+        if retention is not None:
+            self.__retention = HistoryRetention(retention, self.__db, self._name, _logger=logger)
+        self.__writer = WriteBehindBuffer(self.__db.commit_message_batch, max_batch=write_batch_size,
+                                          max_delay=write_delay, _logger=logger)
+        self.__id_index: IdIndex | None = IdIndex(keep_uids=id_index_uids) if id_index else None
+        self.__property_flusher = PropertyFlusher(self.__db.update_properties, properties_flush_interval,
+                                                  _logger=logger)
+        # latency children by the service which sent the message
+        self.__broker_latency = {num: MESSAGE_LATENCY.labels(stage="broker", service=service_name)
+                                 for num, service_name in ((SentBy.s1, s1_name), (SentBy.s2, s2_name))}
+        self.__commit_latency = {num: MESSAGE_LATENCY.labels(stage="commit", service=service_name)
+                                 for num, service_name in ((SentBy.s1, s1_name), (SentBy.s2, s2_name))}
+        registry.add_collector(self.__collect_metrics)
 
     @property
     def name(self) -> str:
@@ -94,8 +207,104 @@ class ChatBox:
         tasks.extend(self._service2.run())
         logger.info({"place": "cc_run", "action": "task_start", "object": "broker"})
         tasks.extend(self.__message_broker())
+        logger.info({"place": "cc_run", "action": "task_start", "object": "write_behind"})
+        tasks.append(self.__writer.run())
+        if self.__id_index is not None:
+            logger.info({"place": "cc_run", "action": "task_start", "object": "id_index"})
+            tasks.append(create_task(self.__load_id_index(), name="id_index"))
+        logger.info({"place": "cc_run", "action": "task_start", "object": "property_flusher"})
+        tasks.append(self.__property_flusher.run())
+        if self.__retention is not None:
+            logger.info({"place": "cc_run", "action": "task_start", "object": "retention"})
+            tasks.append(self.__retention.run())
         return tasks
 
+    def close(self):
+        """
+        Close the database session and the callback thread pools.
+        Call it after the tasks returned by `run()` are finished.
+        """
+        self.__db.close()
+        self._service1.close()
+        self._service2.close()
+        registry.remove_collector(self.__collect_metrics)
+
+    def __collect_metrics(self):
+        for worker in (self._service1, self._service2):
+            ACTIVE_CONNECTIONS.labels(service=worker._name).set(len(worker._active_ids))
+            HIBERNATED_CONNECTIONS.labels(service=worker._name).set(len(worker._hibernated))
+        for stats in self.queue_stats():
+            QUEUE_DEPTH.labels(queue=stats["name"]).set(stats["depth"])
+
+    async def __load_id_index(self):
+        # Accesses before it is ready look up the database as usual.
+        start = time.perf_counter()
+        rows = 0
+        try:
+            # about 13 µs per row on the event loop, so small batches keep it responsive
+            async for batch in self.__db.iter_client_ids(2000):
+                rows += self.__id_index.load(batch)
+        except CancelledError:
+            return
+        except Exception as e:
+            logger.error({"place": "id_index", "action": "load", "status": "error", "rows": rows, "msg": repr(e)})
+            return
+        self.__id_index.ready = True
+        logger.info({"place": "id_index", "action": "load", "status": "success", "rows": rows,
+                     "sec": round(time.perf_counter() - start, 3)})
+
+    def id_index_stats(self) -> dict | None:
+        """
+        Returns: dict | None: the ids loaded, the size of the Bloom filters, and the accesses answered as new without
+                 the database. None if `id_index` is False.
+        """
+        return None if self.__id_index is None else self.__id_index.stats()
+
+    def cache_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: size, hits, misses, evictions and expirations of each database lookup cache.
+        """
+        return self.__db.cache_stats()
+
+    def callback_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: calls, errors, run time and time queued for a thread of each callback of both workers.
+        """
+        return self._service1.callback_stats() + self._service2.callback_stats()
+
+    def queue_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: capacity, policy, depth, high-water mark, puts, dropped messages and disconnects of each
+                 queue.
+        """
+        return ([que.stats.stats() for que in (self._s1_que, self._s2_que, *self.__shard_ques)]
+                + self._service1.queue_stats() + self._service2.queue_stats())
+
+    async def search(self, query: str, limit: int = 20, offset: int = 0, uid: UUID | None = None) -> list[Message]:
+        """
+        Search the saved history by content.
+        Args:
+            query: FTS5 query, e.g. `hello`, `"hello world"`, `hel*`, `hello AND world`.
+            limit: the maximum number of messages.
+            offset: the number of messages to skip, for pagination.
+            uid: If set, only messages of this connection are searched.
+
+        Returns: list[Message]: the best match first.
+        """
+        search = getattr(self.__db, "search", None)
+        if search is None:
+            raise NotImplementedError(f"{type(self.__db).__name__} doesn't support search")
+        return await search(query, limit, offset, uid)
+
+    async def find_connection(self, sent_by: SentBy, service_id: ImmutableType) -> Connection | None:
+        """
+        Look up a saved connection without activating or creating it.
+        Returns: the connection whose service id of `sent_by` is `service_id`, or None.
+        """
+        if self.__id_index is not None and not self.__id_index.might_exist(sent_by, service_id):
+            return None
+        return await self.__db.get_connection(sent_by, service_id)
+
     def get_uid_from_service_id(self, sent_by: SentBy, service_id: ImmutableType) -> UUID:
         if sent_by == SentBy.s1:
             uid: UUID | None = self._service1.get_uid_from_service_id(service_id)
@@ -106,28 +315,32 @@ class ChatBox:
         return uid
 
     async def __access_from_service1(self, service1_id: ImmutableType, create_client_if_no_exist=True,
-                                     queue_in_previous_message=False) -> Connection:
+                                     queue_in_previous_message=False, uid: UUID | None = None) -> Connection:
         #  New access 2nd step
         sent_by = SentBy.s1
-        cc = await self.__access_processing(sent_by, service1_id, create_client_if_no_exist)
-        await run_as_await_func(self._service2.access_callback_from_other_worker, cc)
+        cc = await self.__access_processing(sent_by, service1_id, create_client_if_no_exist, uid)
+        await self._service2.access_callback_from_other_worker(cc)
         return cc
 
     async def __access_from_service2(self, service2_id: ImmutableType,
-                                     create_client_if_no_exist=True) -> Connection:
+                                     create_client_if_no_exist=True, uid: UUID | None = None) -> Connection:
         #  New access 2nd step
         sent_by = SentBy.s2
-        cc = await self.__access_processing(sent_by, service2_id, create_client_if_no_exist)
-        await run_as_await_func(self._service1.access_callback_from_other_worker, cc)
+        cc = await self.__access_processing(sent_by, service2_id, create_client_if_no_exist, uid)
+        await self._service1.access_callback_from_other_worker(cc)
         return cc
 
     # This function is called __new_access_service1 or __new_access_service2
-    async def __access_processing(self, sent_by: SentBy, service_id: ImmutableType, create_client_if_no_exist: bool) \
-            -> Connection:
+    async def __access_processing(self, sent_by: SentBy, service_id: ImmutableType, create_client_if_no_exist: bool,
+                                  uid: UUID | None = None) -> Connection:
         # New access 3rd step
-        cc: Connection | None = self.__db.get_connection(sent_by, service_id)
+        cc: Connection | None = await self.find_connection(sent_by, service_id)
         if cc is None and create_client_if_no_exist:
-            cc = await self.__create_new_client(sent_by, service_id)
+            cc = await self.__create_new_client(sent_by, service_id, uid)
+        if cc is not None:
+            cc.set_message_window(self._message_window)
+            cc.set_properties_listener(self.__property_flusher.mark)
+            cc.set_history_loader(self.__db.get_history if self.__retention is None else self.__retention.get_history)
         await asyncio.sleep(0)
         return cc
 
@@ -137,51 +350,97 @@ class ChatBox:
         if sent_by == SentBy.s2:
             self._service1.deactivate_client(cc.s1_id, True)
 
+    def __hibernate_processing(self, cc: Connection, sent_by: SentBy):
+        # the connection is shared, keep its messages while the other service still serves it
+        if sent_by == SentBy.s1:
+            other_active = cc.s2_id in self._service2._active_ids
+        else:
+            other_active = cc.s1_id in self._service1._active_ids
+        if not other_active:
+            cc.clear_messages()
+
     def __message_broker(self):
+        if self._broker_shards > 1:
+            return self.__sharded_message_broker()
         logger.info({"action": "task_start", "object": "broker_s1"})
-        self.__task_broker1 = create_task(self.__broker_service1(), name="broker_service1")
+        self.__task_broker1 = create_task(self.__broker(self._s1_que, "broker_s1"), name="broker_service1")
         logger.info({"action": "task_start", "object": "broker_s2"})
-        self.__task_broker2 = create_task(self.__broker_service2(), name="broker_service2")
+        self.__task_broker2 = create_task(self.__broker(self._s2_que, "broker_s2"), name="broker_service2")
         return [self.__task_broker1, self.__task_broker2]
 
-    async def __broker_service1(self):  # service1 upload _s1_que -> service2 _rv_que
+    async def __broker(self, que: Queue, place: str):  # upload que or shard que -> dispatch
         try:
-            logger.debug({"action": "start", "object": "broker_s1"})
+            logger.debug({"place": place, "action": "start"})
             while True:
-                msg: Message = await self._s1_que.get()
-                logger.debug({"action": "receive", "object": "broker_s1", "content": msg.content})
-                if self.__db.commit_message(msg):
-                    logger.debug({"action": "commit", "object": "broker_s1", "content": msg.content,
-                                  "status": "success"})
-                else:
-                    logger.debug({"action": "commit", "object": "broker_s1", "content": msg.content,
-                                  "status": "success",
-                                  "info": {"uid": str(msg.uid),
-                                           "content": msg.content}.__str__()})
-                await self._service1.rv_que.put(msg)
-                await self._service2.rv_que.put(msg)
+                batch = drain_batch(await que.get(), que, self._batch_limit)
+                await self.__dispatch(batch, place)
         except CancelledError:
             return
 
-    async def __broker_service2(self):  # service2 upload _s2_que -> service1 _rv_que
+    async def __dispatch(self, batch: list[Message], place: str):
+        # The only place where a message is persisted, so it is submitted at most once.
+        # If its group fails to commit, it isn't retried, `__on_committed` logs it.
+        now = time.monotonic_ns()
+        for msg in batch:
+            self.__broker_latency[msg.sent_by].observe((now - msg.monotonic_ns) / 1e9)
+            # before it's submitted, so that `mark_saved` follows it
+            msg.chat_client.add_message(msg)
+        if tracer.enabled:
+            for msg in batch:
+                if msg.trace_id is not None:
+                    tracer.mark(msg, "upload_queue", place=place)
+        self.__writer.submit_batch(batch).add_done_callback(
+            lambda future, _batch=batch: self.__on_committed(future, place, _batch))
+        for msg in batch:
+            await self._service1.deliver(msg)
+            await self._service2.deliver(msg)
+
+    def __sharded_message_broker(self):
+        """
+        Experimental, see `broker_shards`. Two routers and `broker_shards` workers replace the two brokers.
+        """
+        tasks = []
+        for i, que in enumerate(self.__shard_ques):
+            logger.info({"action": "task_start", "object": f"broker_shard{i}"})
+            tasks.append(create_task(self.__broker(que, f"broker_shard{i}"), name=f"broker_shard{i}"))
+        logger.info({"action": "task_start", "object": "broker_router"})
+        tasks.append(create_task(self.__broker_router(self._s1_que), name="broker_router_s1"))
+        tasks.append(create_task(self.__broker_router(self._s2_que), name="broker_router_s2"))
+        return tasks
+
+    async def __broker_router(self, upload_que: Queue):  # upload_que -> shard que selected by uid
         try:
-            logger.debug({"place": "broker_s2", "action": "start"})
             while True:
-                msg: Message = await self._s2_que.get()
-                logger.debug({"place": "broker_s2", "action": "receive", "status": "success"})
-                if self.__db.commit_message(msg):
-                    logger.debug({"place": "broker_s2", "action": "commit", "status": "success"})
-                else:
-                    logger.error({"place": "broker_s2", "action": "commit", "status": "error",
-                                  "info": {"uid": str(msg.uid),
-                                           "content": msg.content}.__str__()})
-                await self._service1.rv_que.put(msg)
-                await self._service2.rv_que.put(msg)
-                self.__db.commit_message(msg)
-                await self._service1._rv_que.put(msg)
+                item: Message | list[Message] = await upload_que.get()
+                if not isinstance(item, list):
+                    await self.__shard_ques[item.uid.int % self._broker_shards].put(item)
+                    continue
+                # a batch may have messages of several connections, each keeps its order in its shard.
+                by_shard: dict[int, list[Message]] = dict()
+                for msg in item:
+                    by_shard.setdefault(msg.uid.int % self._broker_shards, []).append(msg)
+                for shard, batch in by_shard.items():
+                    await self.__shard_ques[shard].put(batch)
         except CancelledError:
             return
 
+    def __on_committed(self, future: Future, place: str, batch: list[Message]):
+        now = time.monotonic_ns()
+        committed = 0
+        for msg, result in zip(batch, future.result()):
+            msg.chat_client.mark_saved()
+            if not result:
+                logger.error({"place": place, "action": "commit", "status": "error",
+                              "info": {"uid": str(msg.uid),
+                                       "content": msg.content}.__str__()})
+                continue
+            committed += 1
+            self.__commit_latency[msg.sent_by].observe((now - msg.monotonic_ns) / 1e9)
+            if msg.trace_id is not None:
+                tracer.mark(msg, "commit", place=place)
+        DB_COMMITS.inc(committed)
+        DB_COMMIT_FAILURES.inc(len(batch) - committed)
+
     # deprecated
     # async def subscribe(self, client_id, client_queue):
     #     user_id = self.__db.get_user_id_from_client_id(client_id)
@@ -190,15 +449,26 @@ class ChatBox:
     #     else:
     #         self.create_exist_client(client_queue)
 
-    async def __create_new_client(self, sent_by: SentBy, service_id: ImmutableType) -> Connection:
+    @staticmethod
+    async def __run_create_callback(worker: ServiceWorker, service_id: ImmutableType) -> ImmutableType:
+        callback = worker.create_callback_from_other_worker
+        if callback is None:
+            raise AttributeError(f"the create callback of `{worker._name}` isn't set")
+        return await callback(service_id)
+
+    async def __create_new_client(self, sent_by: SentBy, service_id: ImmutableType, uid: UUID | None = None) \
+            -> Connection:
         """
         New access 4th step
         Args:
             sent_by:
             service_id:
+            uid: the uid of the new connection. If None, a random one.
 
         Returns:
-
+            Connection: the new connection, or the saved one if a concurrent access saved `service_id` first.
+        Raises:
+            ValueError: the storage rejected it, and no saved connection has `service_id`.
         """
         log_dict = {"place": "cc_create_new_client", "action": "create", "status": "start",
                     "sent_by": sent_by, "service_id": str(service_id)}
@@ -207,14 +477,12 @@ class ChatBox:
         if sent_by == SentBy.s1:
             log_dict["object"] = "s2_create_callback_from_other_worker"
             logger.debug(log_dict)
-            service2_id = await run_as_await_func(self._service2.create_callback_from_other_worker, service_id,
-                                                  raise_error=True)
+            service2_id = await self.__run_create_callback(self._service2, service_id)
             service1_id = service_id
         elif sent_by == SentBy.s2:
             log_dict["object"] = "s1_create_callback_from_other_worker"
             logger.debug(log_dict)
-            service1_id = await run_as_await_func(self._service1.create_callback_from_other_worker, service_id,
-                                                  raise_error=True)
+            service1_id = await self.__run_create_callback(self._service1, service_id)
             service2_id = service_id
         else:
             log_dict["status"] = "error"
@@ -223,7 +491,17 @@ class ChatBox:
         log_dict["status"] = "success"
         log_dict["service1_id"], log_dict["service2_id"] = service1_id, service2_id
         logger.debug(log_dict)
-        cc = Connection(s1_id=service1_id, s2_id=service2_id)
-        self.__db.add_new_connection(cc)
+        cc = Connection(s1_id=service1_id, s2_id=service2_id, uid=uid)
+        if not await self.__db.add_new_connection(cc):
+            # a concurrent access saved the same service id first, or one of the ids or the uid is already used
+            saved: Connection | None = await self.__db.get_connection(sent_by, service_id)
+            log_dict["action"], log_dict["status"] = "add_new_connection", "duplicate"
+            logger.warning(log_dict)
+            if saved is None:
+                raise ValueError(f"cc_create_new_client: the connection of {sent_by.name} id `{service_id}` "
+                                 f"can't be saved, the uid or the service id of the other side is already used")
+            return saved
+        if self.__id_index is not None:
+            self.__id_index.add(cc.uid, cc.s1_id, cc.s2_id)
 
         return cc
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from uuid import UUID
+
+from chatbox50._utils import Immutable, ImmutableType, str_converter
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class StorageFormat(str, Enum):
+    """
+    How ids and timestamps are stored in the database.
+    text: ids are strings and timestamps are `'%Y-%m-%d %H:%M:%S'`. It's the original format.
+    compact: UUIDs are 16-byte BLOBs and timestamps are integer epoch microseconds (UTC).
+    """
+    text = "text"
+    compact = "compact"
+
+
+class TextCodec:
+    format = StorageFormat.text
+
+    @staticmethod
+    def encode_uid(uid: UUID) -> str:
+        return str_converter(uid)
+
+    @staticmethod
+    def decode_uid(value: str) -> UUID:
+        return UUID(value)
+
+    @staticmethod
+    def encode_id(value: Immutable) -> str:
+        return str_converter(value)
+
+    @staticmethod
+    def decode_id(value: str, id_type: ImmutableType) -> Immutable:
+        return id_type(value)
+
+    @staticmethod
+    def encode_time(value: datetime) -> str:
+        return str(value.strftime(DATETIME_FORMAT))
+
+    @staticmethod
+    def decode_time(value: str) -> datetime:
+        return datetime.strptime(value, DATETIME_FORMAT)
+
+
+class CompactCodec:
+    format = StorageFormat.compact
+
+    @staticmethod
+    def encode_uid(uid: UUID) -> bytes:
+        return uid.bytes
+
+    @staticmethod
+    def decode_uid(value: bytes) -> UUID:
+        return UUID(bytes=value)
+
+    @staticmethod
+    def encode_id(value: Immutable) -> bytes | str:
+        if isinstance(value, UUID):
+            return value.bytes
+        return str_converter(value)
+
+    @staticmethod
+    def decode_id(value: bytes | str, id_type: ImmutableType) -> Immutable:
+        if id_type is UUID:
+            return UUID(bytes=value)
+        return id_type(value)
+
+    @staticmethod
+    def encode_time(value: datetime) -> int:
+        # naive datetimes are regarded as UTC, the same as `Message.created_at`.
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (value - EPOCH) // _MICROSECOND
+
+    @staticmethod
+    def decode_time(value: int) -> datetime:
+        return EPOCH + timedelta(microseconds=value)
+
+
+Codec = TextCodec | CompactCodec
+
+
+def get_codec(storage_format: StorageFormat | str) -> type[Codec]:
+    storage_format = StorageFormat(storage_format)
+    if storage_format == StorageFormat.compact:
+        return CompactCodec
+    return TextCodec
@@ -1,5 +1,9 @@
+from __future__ import annotations
+
 import json
-import pickle
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Sequence
 from uuid import UUID, uuid4
 
 from chatbox50._utils import Immutable
@@ -8,29 +12,70 @@ import logging
 
 logger = logging.getLogger("chatbox.client")
 
+HistoryLoader = Callable[["Connection", int, "int | None"], Awaitable[list[Message]]]
+PropertiesListener = Callable[["Connection"], None]
+# the number of recent messages a connection keeps in memory
+DEFAULT_MESSAGE_WINDOW = 100
+
 
 class Connection:
+    __slots__ = ("__messages", "__window", "__unsaved", "_s1_id", "_s2_id", "__another_property",
+                 "__properties_dirty", "__properties_listener", "__history_loader", "__uid", "__seq")
+
     def __init__(self,
                  s1_id: Immutable,
                  s2_id: Immutable,
-                 uid: UUID = uuid4(),
+                 uid: UUID | None = None,
+                 message_window: int = DEFAULT_MESSAGE_WINDOW,
+                 properties: dict | None = None,
                  ):
-        self.__messages: list[Message] = []
+        """
+
+        Args:
+            message_window: the number of recent messages kept in memory. Older ones are read from storage.
+            properties: the saved properties, when the connection is loaded from storage.
+        """
+        # A ring buffer of the recent messages, and the messages which are not committed yet, oldest first.
+        # ChatBox commits them in this order. An empty deque takes about 600 bytes, so they are `()` until needed.
+        self.__messages: deque[Message] | tuple = ()
+        self.__window = message_window
+        self.__unsaved: deque[Message] | tuple = ()
         self._s1_id = s1_id
         self._s2_id = s2_id
-        self.__another_property = dict()
-        self.number_of_saved_messages = 0
+        self.__another_property = dict() if properties is None else properties
+        # True while a change isn't persisted. The listener is told when it becomes True.
+        self.__properties_dirty = False
+        self.__properties_listener: PropertiesListener | None = None
+        self.__history_loader: HistoryLoader | None = None
+        self.__seq = 0
+        if uid is None:
+            uid = uuid4()
         if isinstance(uid, UUID):
             self.__uid = uid
         else:
             raise AttributeError(f"the type of `uid` must be `UUID` or unique `str` not `{type(uid)}`")
 
-    def __setitem__(self, key, value):
+    def __setitem__(self, key: str, value):
+        """
+        Properties are saved as JSON, so `key` must be `str` and `value` must be serializable with `json`.
+        Raises:
+            TypeError: `key` isn't `str`, or `value` can't be serialized.
+            ValueError: `value` can't be serialized, e.g. it refers to itself.
+        """
+        if not isinstance(key, str):
+            raise TypeError(f"the type of a property key must be `str` not `{type(key)}`")
+        # fails here, rather than later when the properties are saved
+        json.dumps(value, ensure_ascii=False)
         self.__another_property[key] = value
+        self.mark_properties_dirty()
 
     def __getitem__(self, item):
         return self.__another_property[item]
 
+    def __delitem__(self, key: str):
+        del self.__another_property[key]
+        self.mark_properties_dirty()
+
     def __dict__(self):
         return json.dumps({"uid": str(self.__uid), "s1_id": str(self._s1_id), "s2_id": str(self._s2_id), "properties":
             self.__another_property})
@@ -52,14 +97,157 @@ class Connection:
         return self.__another_property
 
     @property
-    def unsaved_messages(self) -> list[Message]:
-        return self.__messages[self.number_of_saved_messages:]
+    def messages(self) -> Sequence[Message]:
+        """
+        Returns: Sequence[Message]: the recent messages in memory, oldest first. Don't modify it.
+        """
+        return self.__messages
+
+    @property
+    def unsaved_messages(self) -> Sequence[Message]:
+        """
+        Returns: Sequence[Message]: the messages which are not committed yet, oldest first. Don't modify it.
+        """
+        return self.__unsaved
+
+    @property
+    def number_of_saved_messages(self) -> int:
+        """
+        Returns: int: the number of committed messages in memory.
+        """
+        return max(0, len(self.__messages) - len(self.__unsaved))
+
+    @property
+    def message_window(self) -> int:
+        return self.__window
+
+    def set_message_window(self, size: int) -> None:
+        """
+        Change the number of recent messages kept in memory. If it's smaller, the oldest ones are dropped.
+        """
+        if size < 0:
+            raise ValueError(f"the message window must be 0 or more, not {size}")
+        if size != self.__window:
+            self.__window = size
+            if self.__messages:
+                self.__messages = deque(self.__messages, maxlen=size)
 
-    def add_message(self, message):
+    def next_seq(self) -> int:
+        """
+        Returns: int: the sequence number of a new message of this connection, from 1.
+        """
+        self.__seq += 1
+        return self.__seq
+
+    def clear_messages(self) -> None:
+        """
+        Free the recent messages kept in memory, they can still be read from storage.
+        The unsaved ones stay until they are committed.
+        """
+        self.__messages = ()
+
+    def add_message(self, message: Message, saved: bool = False) -> None:
+        """
+        Args:
+            saved: True if the message is already in storage. Otherwise, it's unsaved until `mark_saved`.
+        """
         if isinstance(message, Message) and message.uid == self.__uid:
+            if not self.__messages:
+                self.__messages = deque(maxlen=self.__window)
             self.__messages.append(message)
+            if not saved:
+                if not self.__unsaved:
+                    self.__unsaved = deque()
+                self.__unsaved.append(message)
         else:
             raise AttributeError()
 
-    def pickle_properties(self) -> bytes:
-        return pickle.dumps(self.__another_property)
+    def mark_saved(self, count: int = 1) -> None:
+        """
+        The oldest `count` unsaved messages left the write buffer. ChatBox calls it when their group is committed,
+        a message which failed is logged and isn't retried.
+        """
+        if count >= len(self.__unsaved):
+            self.__unsaved = ()
+            return
+        for _ in range(count):
+            self.__unsaved.popleft()
+
+    def set_history_loader(self, loader: HistoryLoader) -> None:
+        """
+        Set the function which reads one page of the saved history. ChatBox sets it when the connection is accessed.
+        """
+        self.__history_loader = loader
+
+    async def history(self, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        """
+        Get one page of the saved history from storage.
+        Args:
+            limit: the maximum number of messages.
+            before_id: only messages older than this `Message.history_id` are returned. If None, the latest ones.
+
+        Returns: list[Message]: in chronological order.
+        """
+        if self.__history_loader is None:
+            return []
+        return await self.__history_loader(self, limit, before_id)
+
+    async def recent_messages(self, limit: int = 50) -> list[Message]:
+        """
+        Get the latest messages. They are taken from memory if the window has enough of them,
+        otherwise the committed ones are read from storage and the unsaved ones are added after them.
+        A message committed while storage is read may be returned twice.
+        Returns: list[Message]: in chronological order.
+        """
+        if limit <= len(self.__messages) or self.__history_loader is None:
+            return list(islice(self.__messages, max(0, len(self.__messages) - limit), None))
+        unsaved = list(islice(self.__unsaved, max(0, len(self.__unsaved) - limit), None))
+        saved = await self.history(limit - len(unsaved)) if len(unsaved) < limit else []
+        return saved + unsaved
+
+    async def iter_history(self, page_size: int = 50) -> AsyncIterator[Message]:
+        """
+        Iterate the saved history from the newest message to the oldest. Pages are read on demand.
+        """
+        before_id = None
+        while True:
+            page = await self.history(page_size, before_id)
+            for message in reversed(page):
+                yield message
+            if len(page) < page_size:
+                return
+            before_id = page[0].history_id
+
+    @property
+    def properties_dirty(self) -> bool:
+        return self.__properties_dirty
+
+    def mark_properties_dirty(self) -> None:
+        """
+        Schedule the properties to be saved. Setting or deleting a property calls it,
+        call it yourself after changing a value in place, e.g. appending to a list.
+        """
+        if self.__properties_dirty:
+            return
+        self.__properties_dirty = True
+        if self.__properties_listener is not None:
+            self.__properties_listener(self)
+
+    def set_properties_listener(self, listener: PropertiesListener | None) -> None:
+        """
+        Set the function which is called when the properties become dirty. ChatBox sets it when the connection is
+        accessed, and saves the dirty connections in batches.
+        """
+        self.__properties_listener = listener
+        if self.__properties_dirty and listener is not None:
+            listener(self)
+
+    def dump_properties(self) -> str:
+        """
+        Returns: str: the properties as JSON. They are regarded as saved from now on.
+        Raises:
+            TypeError, ValueError: a value was changed in place into one JSON can't hold. They stay dirty.
+        """
+        properties = json.dumps(self.__another_property, ensure_ascii=False, separators=(",", ":"))
+        self.__properties_dirty = False
+        return properties
@@ -0,0 +1,115 @@
+"""
+Convert a ChatBox50 database file to another storage format.
+
+    python -m chatbox50.convert_db chatbox50 chatbox50_compact --s2-id-type int --to compact
+
+Names are given without `.db`, the same as `ChatBox(name=...)`. The source is not modified, a copy of it is
+migrated to the latest schema next to the destination and removed afterwards.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+from uuid import UUID
+
+from chatbox50._utils import ImmutableType
+from chatbox50.codec import StorageFormat, get_codec
+from chatbox50.db_session import SQLSession
+from chatbox50.migrations import migrate
+
+_logger = logging.getLogger("chatbox.db.convert")
+_logger.addHandler(logging.NullHandler())
+
+ID_TYPES: dict[str, ImmutableType] = {"uuid": UUID, "int": int, "str": str}
+
+
+def _strip_suffix(name: str) -> str:
+    return name[:-3] if name.endswith(".db") else name
+
+
+def get_storage_format(conn: sqlite3.Connection) -> StorageFormat:
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key='storage_format'").fetchone()
+    except sqlite3.OperationalError:
+        # created before the `meta` table existed.
+        return StorageFormat.text
+    return StorageFormat.text if row is None else StorageFormat(row[0])
+
+
+def convert_database(src_name: str, dst_name: str, s1_id_type: ImmutableType = UUID,
+                     s2_id_type: ImmutableType = UUID, to: StorageFormat | str = StorageFormat.compact,
+                     chunk_size: int = 10000) -> dict:
+    """
+    Copy every client and message of `src_name` into a new database `dst_name` stored in the format `to`.
+    Row ids are kept, so `Message.history_id` cursors stay valid. The destination has the latest schema, so the
+    rows are read from a migrated copy of the source, `dst_name + ".src.db"`.
+    Returns:
+        dict: the formats and the number of copied rows.
+    """
+    src_name, dst_name = _strip_suffix(src_name), _strip_suffix(dst_name)
+    if not os.path.exists(src_name + ".db"):
+        raise FileNotFoundError(src_name + ".db")
+    if os.path.exists(dst_name + ".db"):
+        raise FileExistsError(dst_name + ".db")
+    copy_name = dst_name + ".src.db"
+    if os.path.exists(copy_name):
+        raise FileExistsError(copy_name)
+    to = StorageFormat(to)
+    # Create the schema of the destination.
+    SQLSession(dst_name, s1_id_type, s2_id_type, init=True, storage_format=to).close()
+
+    # A source written by an older version may have pickled properties, duplicate uids or an older history table.
+    original = sqlite3.connect(f"file:{src_name}.db?mode=ro", uri=True)
+    src = sqlite3.connect(copy_name)
+    dst = sqlite3.connect(dst_name + ".db")
+    try:
+        try:
+            original.backup(src)
+        finally:
+            original.close()
+        migrate(src, _logger)
+        src_format = get_storage_format(src)
+        src_codec, dst_codec = get_codec(src_format), get_codec(to)
+        result = {"from": src_format.value, "to": to.value, "client": 0, "history": 0}
+        _logger.info({"place": "convert_db", "action": "convert", "status": "start", **result})
+        with dst:
+            cur = src.execute("SELECT id, created_at, uid, service1_id, service2_id, properties FROM client")
+            while rows := cur.fetchmany(chunk_size):
+                dst.executemany("INSERT INTO client (id, created_at, uid, service1_id, service2_id, properties) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                [(row[0], row[1],
+                                  dst_codec.encode_uid(src_codec.decode_uid(row[2])),
+                                  dst_codec.encode_id(src_codec.decode_id(row[3], s1_id_type)),
+                                  dst_codec.encode_id(src_codec.decode_id(row[4], s2_id_type)),
+                                  row[5]) for row in rows])
+                result["client"] += len(rows)
+            cur = src.execute("SELECT id, created_at, client_id, content, sent_by FROM history ORDER BY id")
+            while rows := cur.fetchmany(chunk_size):
+                dst.executemany("INSERT INTO history (id, created_at, client_id, content, sent_by) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                [(row[0],
+                                  None if row[1] is None else dst_codec.encode_time(src_codec.decode_time(row[1])),
+                                  *row[2:])
+                                 for row in rows])
+                result["history"] += len(rows)
+    finally:
+        src.close()
+        dst.close()
+        os.remove(copy_name)
+    _logger.info({"place": "convert_db", "action": "convert", "status": "success", **result})
+    return result
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Convert a ChatBox50 database to another storage format.")
+    parser.add_argument("src", help="name of the source database, without `.db`")
+    parser.add_argument("dst", help="name of the new database, without `.db`. It must not exist.")
+    parser.add_argument("--s1-id-type", choices=ID_TYPES, default="uuid")
+    parser.add_argument("--s2-id-type", choices=ID_TYPES, default="uuid")
+    parser.add_argument("--to", choices=[f.value for f in StorageFormat], default=StorageFormat.compact.value)
+    args = parser.parse_args(argv)
+    print(convert_database(args.src, args.dst, ID_TYPES[args.s1_id_type], ID_TYPES[args.s2_id_type], args.to))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import AsyncIterator
+from uuid import UUID
+
+from chatbox50._utils import Immutable, ImmutableType
+from chatbox50.codec import StorageFormat
+from chatbox50.connection import Connection
+from chatbox50.db_session import SQLSession
+from chatbox50.message import Message, SentBy
+
+
+class AsyncSQLSession:
+    """
+    Awaitable facade of `SQLSession`.
+    Every write runs on one dedicated thread which owns the `sqlite3` connection,
+    so the event loop is never blocked by a query or a commit.
+    With `wal=True` and `readers > 0`, history and lookup queries run on a separate pool of reader threads
+    and never wait for the writer.
+    """
+
+    def __init__(self, file_name: str, s1_id_type: ImmutableType, s2_id_type: ImmutableType, init: bool = False,
+                 debug: bool = False, logger: logging.Logger = None, wal: bool = False, readers: int = 0,
+                 lookup_cache_size: int = 4096, lookup_cache_ttl: float | None = None,
+                 storage_format: StorageFormat | str = StorageFormat.text):
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{file_name}-db")
+        # SQLSession must be created on the writer thread, sqlite3 objects can only be used in the thread
+        # that created them.
+        self.__session: SQLSession = self.__executor.submit(
+            partial(SQLSession, file_name, s1_id_type, s2_id_type, init, debug, logger, wal, readers,
+                    lookup_cache_size=lookup_cache_size, lookup_cache_ttl=lookup_cache_ttl,
+                    storage_format=storage_format)).result()
+        self.__read_executor = self.__executor
+        if self.__session.readers > 0:
+            self.__read_executor = ThreadPoolExecutor(max_workers=self.__session.readers,
+                                                      thread_name_prefix=f"{file_name}-db-reader")
+        self.__closed = False
+
+    async def __run(self, func, *args):
+        if self.__closed:
+            raise RuntimeError("AsyncSQLSession is already closed")
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(func, *args))
+
+    async def __read(self, func, *args):
+        if self.__closed:
+            raise RuntimeError("AsyncSQLSession is already closed")
+        return await asyncio.get_running_loop().run_in_executor(self.__read_executor, partial(func, *args))
+
+    async def __call__(self, sql: str, *parameter):
+        return await self.__run(self.__session, sql, *parameter)
+
+    async def add_new_connection(self, cc: Connection) -> bool:
+        return await self.__run(self.__session.add_new_connection, cc)
+
+    async def get_connection(self, sent_by: SentBy, service_id: Immutable) -> None | Connection:
+        return await self.__read(self.__session.get_connection, sent_by, service_id)
+
+    async def update_properties(self, items: list[tuple[Connection, str]]) -> list[bool]:
+        return await self.__run(self.__session.update_properties, items)
+
+    async def iter_client_ids(self, batch_size: int = 10000) -> AsyncIterator[list[tuple[UUID, str, str]]]:
+        """
+        The batches of `SQLSession.iter_client_ids`. Each one is read on a database thread,
+        which is free for other queries while the batch is consumed.
+        """
+        batches = self.__session.iter_client_ids(batch_size)
+        try:
+            while True:
+                batch = await self.__read(next, batches, None)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            # it holds no connection between pages
+            batches.close()
+
+    async def get_client_id_from_uid(self, uid: UUID) -> str | None:
+        return await self.__read(self.__session._get_client_id_from_uid, uid)
+
+    async def commit_message(self, message: Message) -> bool:
+        return await self.__run(self.__session.commit_message, message)
+
+    async def commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        return await self.__run(self.__session.commit_message_batch, messages)
+
+    async def get_history(self, cc: Connection, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        return await self.__read(self.__session.get_history, cc, limit, before_id)
+
+    async def iter_history(self, cc: Connection, page_size: int = 50,
+                           before_id: int | None = None) -> AsyncIterator[Message]:
+        """
+        Iterate history from the newest message to the oldest. Each page is read on the database thread
+        only when the previous one is consumed.
+        """
+        while True:
+            page = await self.get_history(cc, page_size, before_id)
+            for message in reversed(page):
+                yield message
+            if len(page) < page_size:
+                return
+            before_id = page[0].history_id
+
+    async def search(self, query: str, limit: int = 20, offset: int = 0, uid: UUID | None = None) -> list[Message]:
+        return await self.__read(self.__session.search, query, limit, offset, uid)
+
+    async def get_history_before(self, cutoff: datetime, limit: int) -> list[tuple[int, UUID, datetime, str, int]]:
+        return await self.__run(self.__session.get_history_before, cutoff, limit)
+
+    async def delete_history(self, ids: list[int]) -> int:
+        return await self.__run(self.__session.delete_history, ids)
+
+    async def insert_history_to_chat_client(self, cc: Connection) -> bool:
+        return await self.__run(self.__session.insert_history_to_chat_client, cc)
+
+    def cache_stats(self) -> list[dict]:
+        """
+        Counters of the lookup caches. The caches are thread-safe, so this doesn't go through the database thread.
+        """
+        return self.__session.cache_stats()
+
+    def close(self):
+        """
+        Commit and close the connection on the writer thread, then stop the thread.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__read_executor is not self.__executor:
+            self.__read_executor.shutdown(wait=True)
+        self.__executor.submit(self.__session.close).result()
+        self.__executor.shutdown(wait=True)
@@ -1,29 +1,110 @@
 import json
 import sqlite3
 import logging
+from contextlib import contextmanager
+from queue import Queue
+from urllib.parse import quote
 from uuid import UUID
 from datetime import datetime
-from functools import cache
+from typing import Iterator
 
-from chatbox50._utils import Immutable, ImmutableType, str_converter
+from chatbox50._utils import Immutable, ImmutableType
+from chatbox50.codec import StorageFormat, get_codec
+from chatbox50.cache import LRUCache
 from chatbox50.message import Message, SentBy
 from chatbox50.connection import Connection
+from chatbox50.migrations import migrate
+from chatbox50.tracing import tracer
 
-DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 _logger = logging.getLogger("chatbox.db")
 _logger.addHandler(logging.NullHandler())
 
 
 class SQLSession:
     def __init__(self, file_name: str, s1_id_type: ImmutableType, s2_id_type: ImmutableType, init: bool = False,
-                 debug: bool = False, logger: logging.Logger = None):
-        self._logger = logger if logger is None else logger.getChild("sql")
+                 debug: bool = False, logger: logging.Logger = None, wal: bool = False, readers: int = 0,
+                 cache_size_kib: int = 8192, lookup_cache_size: int = 4096, lookup_cache_ttl: float | None = None,
+                 storage_format: StorageFormat | str = StorageFormat.text):
+        """
+
+        Args:
+            wal: If True, the database is opened in WAL mode with `synchronous=NORMAL`.
+                 Ignored in debug mode because an in-memory database has no journal file.
+            readers: the number of read-only connections for history and lookup queries.
+                     Only used with `wal=True`. If 0, the writer connection also serves reads.
+            cache_size_kib: page cache size of each connection.
+            lookup_cache_size: the maximum number of entries of each lookup cache
+                               (uid -> client_id and service_id -> client row).
+            lookup_cache_ttl: seconds a lookup cache entry stays valid. If None, until it is evicted.
+            storage_format: how ids and timestamps are stored. It is fixed when the database is created,
+                            use `chatbox50.convert_db` to change the format of an existing database.
+        """
+        self._logger = _logger if logger is None else logger.getChild("sql")
         self._s1_id_type = s1_id_type
         self._s2_id_type = s2_id_type
+        self._codec = get_codec(storage_format)
+        self.__file_name = file_name + ".db"
         # if debug mode is True, sqlite works in memory.
-        self.__conn = sqlite3.connect(file_name + ".db" if not debug else ":memory:")
+        self.__conn = sqlite3.connect(self.__file_name if not debug else ":memory:")
+        self.__closed = False
+        self.__readers: Queue[sqlite3.Connection] | None = None
+        # Misses are never cached, a client which is created later must be found.
+        self.__client_id_cache = LRUCache(lookup_cache_size, lookup_cache_ttl, name="client_id")
+        self.__client_cache = LRUCache(lookup_cache_size, lookup_cache_ttl, name="client")
+        self._wal = wal and not debug
+        self.__conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+        if self._wal:
+            self.__conn.execute("PRAGMA journal_mode = WAL")
+            self.__conn.execute("PRAGMA synchronous = NORMAL")
         if init:
             self.__init_db()
+            self.__check_storage_format()
+        if self._wal and readers > 0:
+            self.__open_readers(readers, cache_size_kib)
+
+    @property
+    def storage_format(self) -> StorageFormat:
+        return self._codec.format
+
+    def __check_storage_format(self):
+        row = self.__conn.execute("SELECT value FROM meta WHERE key='storage_format'").fetchone()
+        if row is None:
+            # A database created by this session. The format of existing data was written by the migration.
+            with self.__conn:
+                self.__conn.execute("INSERT INTO meta (key, value) VALUES ('storage_format', ?)",
+                                    (self._codec.format.value,))
+        elif row[0] != self._codec.format.value:
+            raise ValueError(f"{self.__file_name} is stored in `{row[0]}` format, not `{self._codec.format.value}`. "
+                             f"Convert it with `python -m chatbox50.convert_db`.")
+
+    @property
+    def readers(self) -> int:
+        """the number of read-only connections. 0 means reads use the writer connection."""
+        return 0 if self.__readers is None else self.__readers.maxsize
+
+    def __open_readers(self, readers: int, cache_size_kib: int):
+        self.__readers = Queue(maxsize=readers)
+        for _ in range(readers):
+            conn = sqlite3.connect(f"file:{quote(self.__file_name)}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+            conn.execute("PRAGMA query_only = ON")
+            self.__readers.put_nowait(conn)
+        self._logger.debug({"place": "db_open_readers", "action": "open", "status": "success", "readers": readers})
+
+    @contextmanager
+    def __read_connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a read-only connection from the pool. Without the pool, the writer connection is returned,
+        and then the caller must be on the writer thread.
+        """
+        if self.__readers is None:
+            yield self.__conn
+            return
+        conn = self.__readers.get()
+        try:
+            yield conn
+        finally:
+            self.__readers.put_nowait(conn)
 
     def __call__(self, sql: str, *parameter):
         cur = self.__conn.cursor()
@@ -36,22 +117,27 @@ class SQLSession:
         Args:
             cc:
         """
-        self._logger.debug({"place": "db_new_client", "action": "insert", "status": "start", "info": cc.__dict__()})
+        start = tracer.begin() if tracer.enabled else None
         cur = self.__conn.cursor()
-        str_uid = str_converter(cc.uid)
-        str_s1 = str_converter(cc.s1_id)
-        str_s2 = str_converter(cc.s2_id)
-        cur.execute(
-            "INSERT INTO client (uid, service1_id, service2_id, properties) VALUES (?, ?, ?, ?)",
-            (str_uid, str_s1, str_s2, cc.pickle_properties())
-            # TODO: chatclient might be updated.
-        )
+        str_uid = self._codec.encode_uid(cc.uid)
+        str_s1 = self._codec.encode_id(cc.s1_id)
+        str_s2 = self._codec.encode_id(cc.s2_id)
+        try:
+            cur.execute(
+                "INSERT INTO client (uid, service1_id, service2_id, properties) VALUES (?, ?, ?, ?)",
+                (str_uid, str_s1, str_s2, cc.dump_properties())
+            )
+        except sqlite3.IntegrityError as e:
+            self.__conn.rollback()
+            self._logger.error({"place": "db_new_client", "action": "insert", "status": "error",
+                                "info": {"uid": str(cc.uid), "s1_id": str(cc.s1_id), "s2_id": str(cc.s2_id)},
+                                "msg": repr(e)})
+            return False
         self.__conn.commit()
-        self._logger.debug({"place": "db_new_client",
-                            "action": "insert", "status": "success",
-                            "str_uid": str_uid,
-                            "str_s1": str_s1,
-                            "str_s2": str_s2})
+        self.__invalidate_client(str_uid, str_s1, str_s2)
+        self.__client_id_cache.put(str_uid, cur.lastrowid)
+        if start is not None:
+            tracer.end("db.add_new_connection", start, uid=str(cc.uid))
         return True
 
     def get_connection(self, sent_by: SentBy, service_id: Immutable) -> None | Connection:
@@ -64,68 +150,116 @@ class SQLSession:
         Returns:
 
         """
-        service_id: str = str_converter(service_id)
-        log_dict = {"place": "db_get_cc",
-                    "action": "get_from_db",
-                    "status": "start",
-                    "info": {"sent_by": sent_by,
-                             "service_id": service_id}}
-        self._logger.debug(json.dumps(log_dict))
-        cur = self.__conn.cursor()
+        start = tracer.begin() if tracer.enabled else None
+        service_id: str | bytes = self._codec.encode_id(service_id)
         if sent_by == SentBy.s1:
-            cur.execute("SELECT id, uid, service1_id, service2_id, properties FROM client WHERE service1_id = ?",
-                        (service_id,))
+            sql = "SELECT id, uid, service1_id, service2_id, properties FROM client WHERE service1_id = ?"
         elif sent_by == SentBy.s2:
-            cur.execute("SELECT id, uid, service1_id, service2_id, properties FROM client WHERE service2_id = ?",
-                        (service_id,))
+            sql = "SELECT id, uid, service1_id, service2_id, properties FROM client WHERE service2_id = ?"
         else:
             raise AttributeError()
-
-        client = cur.fetchone()
+        client = self.__client_cache.get((sent_by, service_id))
         if client is None:
-            log_dict["status"] = "not_found"
-            log_dict["msg"] = "can't find cc from db. returned None"
-            self._logger.debug(json.dumps(log_dict))
-            return None
-        cc: Connection = Connection(uid=UUID(client[1]), s1_id=self._s1_id_type(client[2]), s2_id=self._s2_id_type(
-            client[3]))
-        log_dict["status"] = "success"
-        log_dict["info"]["result"] = str(client)
-        self._logger.debug(json.dumps(log_dict))
-        self.insert_history_to_chat_client(cc)
-        # client_id: str = client[0]
-        # cur = self.__conn.cursor()
-        # cur.execute("SELECT sent_by, content, created_at FROM history WHERE client_id=?", (client_id,))
-        # message_count = 0
-        # for row in cur.fetchall():
-        #     cc.add_message(Message(chat_client=cc, sent_by=SentBy(int(row[0])), content=row[1],
-        #                            created_at=datetime.strptime(row[2], DATETIME_FORMAT)))
-        #     message_count += 1
-        # cc.number_of_saved_messages = message_count
+            with self.__read_connection() as conn:
+                client = conn.execute(sql, (service_id,)).fetchone()
+            if client is None:
+                if start is not None:
+                    tracer.end("db.get_connection", start, sent_by=int(sent_by), found=False)
+                return None
+            self.__client_cache.put((sent_by, service_id), client)
+            self.__client_id_cache.put(client[1], client[0])
+        cc: Connection = Connection(uid=self._codec.decode_uid(client[1]),
+                                    s1_id=self._codec.decode_id(client[2], self._s1_id_type),
+                                    s2_id=self._codec.decode_id(client[3], self._s2_id_type),
+                                    properties=None if client[4] == "{}" else json.loads(client[4]))
+        if start is not None:
+            tracer.end("db.get_connection", start, sent_by=int(sent_by), found=True)
+        # History is not loaded here. Use `get_history` or `iter_history` when it is needed.
         return cc
 
-    @cache
+    def update_properties(self, items: list[tuple[Connection, str]]) -> list[bool]:
+        """
+        Save the properties of connections in one transaction.
+        Args:
+            items: (connection, its properties as JSON)
+
+        Returns: list[bool]: whether each connection was found and updated, in the same order as `items`.
+        """
+        start = tracer.begin() if tracer.enabled else None
+        results = []
+        try:
+            with self.__conn:
+                for cc, properties in items:
+                    cur = self.__conn.execute("UPDATE client SET properties=? WHERE uid=?",
+                                              (properties, self._codec.encode_uid(cc.uid)))
+                    results.append(cur.rowcount == 1)
+        except sqlite3.Error as e:
+            self._logger.error({"place": "update_properties", "action": "update", "status": "error",
+                                "size": len(items), "msg": repr(e)})
+            return [False] * len(items)
+        for cc, _ in items:
+            # the cached rows have the old properties
+            self.__client_cache.invalidate((SentBy.s1, self._codec.encode_id(cc.s1_id)))
+            self.__client_cache.invalidate((SentBy.s2, self._codec.encode_id(cc.s2_id)))
+        if start is not None:
+            tracer.end("db.update_properties", start, size=len(items))
+        return results
+
+    def iter_client_ids(self, batch_size: int = 10000) -> Iterator[list[tuple[UUID, str, str]]]:
+        """
+        Page through the client table by id, so that it is never loaded at once.
+        Each page borrows a read connection and gives it back before the page is yielded,
+        so a slow consumer never keeps one from the pool.
+        Returns: batches of (uid, service1 id, service2 id), the ids converted with `str_converter`.
+        """
+        last_id = 0
+        while True:
+            with self.__read_connection() as conn:
+                rows = conn.execute("SELECT id, uid, service1_id, service2_id FROM client WHERE id > ? "
+                                    "ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [(self._codec.decode_uid(uid), self.__id_key(s1), self.__id_key(s2)) for _, uid, s1, s2 in rows]
+            if len(rows) < batch_size:
+                return
+
+    @staticmethod
+    def __id_key(value: str | bytes) -> str:
+        # the compact format stores UUID ids as 16 bytes, everything else is stored as `str_converter` makes it
+        return str(UUID(bytes=value)) if isinstance(value, bytes) else value
+
     def _get_client_id_from_uid(self, uid: UUID) -> str | None:
-        uid = str_converter(uid)
-        self._logger.debug({"action": "get_client_id_from_uid", "uid": uid})
-        cur = self.__conn.cursor()
-        cur.execute("SELECT id FROM client WHERE uid=?", (uid,))
-        client_id: tuple | None = cur.fetchone()
+        str_uid = self._codec.encode_uid(uid)
+        client_id = self.__client_id_cache.get(str_uid)
+        if client_id is not None:
+            return client_id
+        start = tracer.begin() if tracer.enabled else None
+        with self.__read_connection() as conn:
+            client_id: tuple | None = conn.execute("SELECT id FROM client WHERE uid=?", (str_uid,)).fetchone()
         if client_id is None:
             self._logger.error({"place": "get_client_id_from_uid",
                                 "action": "get_from_db",
                                 "status": "error",
                                 "msg": "Can't find uid from db",
-                                "info": {"uid": uid}}.__str__())
+                                "info": {"uid": str(uid)}}.__str__())
             return None
-
-        self._logger.debug({"place": "get_client_id_from_uid",
-                            "action": "get_from_db",
-                            "status": "success",
-                            "info": {"uid": str(uid),
-                                     "client_id": client_id}}.__str__())
+        if start is not None:
+            tracer.end("db.get_client_id", start)
+        self.__client_id_cache.put(str_uid, client_id[0])
         return client_id[0]
 
+    def __invalidate_client(self, str_uid: str | bytes, str_s1: str | bytes, str_s2: str | bytes):
+        self.__client_id_cache.invalidate(str_uid)
+        self.__client_cache.invalidate((SentBy.s1, str_s1))
+        self.__client_cache.invalidate((SentBy.s2, str_s2))
+
+    def cache_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: size, hits, misses, evictions and expirations of each lookup cache.
+        """
+        return [self.__client_id_cache.stats(), self.__client_cache.stats()]
+
     def commit_messages(self, messages: list[Message]) -> bool:
         """
         メッセージは随時DBに保存するように変更されました．この関数は使いません．
@@ -143,7 +277,7 @@ class SQLSession:
         cur = self.__conn.cursor()
         cur.executemany("INSERT INTO history (client_id, created_at, content, sent_by) VALUES (?, ?, ?, ?)",
                         [(client_id,
-                          str(message.created_at.strftime(DATETIME_FORMAT)),
+                          self._codec.encode_time(message.created_at),
                           message.content,
                           message.sent_by) for message in messages])
         self.__conn.commit()
@@ -170,20 +304,167 @@ class SQLSession:
         cur = self.__conn.cursor()
         cur.execute("INSERT INTO history (client_id, created_at, content, sent_by) VALUES (?, ?, ?, ?)",
                     (client_id,
-                     str(message.created_at.strftime(DATETIME_FORMAT)),
+                     self._codec.encode_time(message.created_at),
                      message.content,
                      message.sent_by))
         self.__conn.commit()
-        self._logger.debug({"place": "commit_msg",
-                            "action": "commit",
-                            "status": "success",
-                            "info": {"uid": str(message.uid),
-                                     "content": message.content},
-                            "msg": "Can't commit message because client_id is None"})
         return True
 
+    def commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        """
+        Commit messages with one `executemany` and one transaction.
+        Args:
+            messages:
+
+        Returns: list[bool]: whether each message was persisted, in the same order as `messages`.
+
+        """
+        start = tracer.begin() if tracer.enabled else None
+        results = []
+        rows = []
+        for message in messages:
+            client_id: str | None = self._get_client_id_from_uid(message.uid)
+            results.append(client_id is not None)
+            if client_id is None:
+                self._logger.error({"place": "commit_msg_batch",
+                                    "action": "commit",
+                                    "status": "error",
+                                    "info": {"uid": str(message.uid),
+                                             "content": message.content},
+                                    "msg": "Can't commit message because client_id is None"})
+                continue
+            rows.append((client_id,
+                         self._codec.encode_time(message.created_at),
+                         message.content,
+                         message.sent_by))
+        if not rows:
+            return results
+        try:
+            with self.__conn:
+                self.__conn.executemany(
+                    "INSERT INTO history (client_id, created_at, content, sent_by) VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            self._logger.error({"place": "commit_msg_batch", "action": "commit", "status": "error",
+                                "size": len(rows), "msg": repr(e)})
+            return [False] * len(messages)
+        if start is not None:
+            tracer.end("db.commit_batch", start, size=len(rows))
+        return results
+
+    def get_history(self, cc: Connection, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        """
+        Get one page of history.
+        Args:
+            cc:
+            limit: the maximum number of messages.
+            before_id: only messages whose `history_id` is smaller than this are returned.
+                       If None, the latest messages are returned.
+
+        Returns: list[Message]: in chronological order, the newest message is the last.
+
+        """
+        client_id: str | None = self._get_client_id_from_uid(cc.uid)
+        if client_id is None:
+            self._logger.error({"place": "get_history", "action": "get_id", "status": "error",
+                                "info": {"uid": str(cc.uid)},
+                                "msg": "Can't get history because client_id is None."})
+            return []
+        with self.__read_connection() as conn:
+            if before_id is None:
+                rows = conn.execute("SELECT id, content, created_at, sent_by FROM history WHERE client_id=? "
+                                    "ORDER BY id DESC LIMIT ?", (client_id, limit)).fetchall()
+            else:
+                rows = conn.execute("SELECT id, content, created_at, sent_by FROM history WHERE client_id=? AND id<? "
+                                    "ORDER BY id DESC LIMIT ?", (client_id, before_id, limit)).fetchall()
+        return [Message(chat_client=cc,
+                        content=row[1],
+                        created_at=self._codec.decode_time(row[2]),
+                        sent_by=SentBy(int(row[3])),
+                        history_id=row[0]) for row in reversed(rows)]
+
+    def iter_history(self, cc: Connection, page_size: int = 50, before_id: int | None = None) -> Iterator[Message]:
+        """
+        Iterate history from the newest message to the oldest. Pages of `page_size` are read on demand.
+        """
+        while True:
+            page = self.get_history(cc, page_size, before_id)
+            yield from reversed(page)
+            if len(page) < page_size:
+                return
+            before_id = page[0].history_id
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, uid: UUID | None = None) -> list[Message]:
+        """
+        Full-text search of the history with FTS5. Archived messages are not searched.
+        Args:
+            query: FTS5 query, e.g. `hello`, `"hello world"`, `hel*`, `hello AND world`.
+            limit: the maximum number of messages.
+            offset: the number of messages to skip, for pagination.
+            uid: If set, only messages of this connection are searched.
+
+        Returns: list[Message]: the best match first.
+
+        """
+        sql = ("SELECT history.id, history.content, history.created_at, history.sent_by, "
+               "client.uid, client.service1_id, client.service2_id "
+               "FROM history_fts JOIN history ON history.id = history_fts.rowid "
+               "JOIN client ON client.id = history.client_id WHERE history_fts MATCH ?")
+        parameter = [query]
+        if uid is not None:
+            sql += " AND client.uid = ?"
+            parameter.append(self._codec.encode_uid(uid))
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        parameter.extend((limit, offset))
+        try:
+            with self.__read_connection() as conn:
+                rows = conn.execute(sql, parameter).fetchall()
+        except sqlite3.OperationalError as e:
+            self._logger.error({"place": "search", "action": "search", "status": "error", "query": query,
+                                "msg": repr(e)})
+            raise ValueError(f"can't search `{query}`: {e}") from e
+        connections: dict[str | bytes, Connection] = dict()
+        messages = []
+        for row in rows:
+            cc = connections.get(row[4])
+            if cc is None:
+                cc = Connection(uid=self._codec.decode_uid(row[4]),
+                                s1_id=self._codec.decode_id(row[5], self._s1_id_type),
+                                s2_id=self._codec.decode_id(row[6], self._s2_id_type))
+                connections[row[4]] = cc
+            messages.append(Message(chat_client=cc,
+                                    content=row[1],
+                                    created_at=self._codec.decode_time(row[2]),
+                                    sent_by=SentBy(int(row[3])),
+                                    history_id=row[0]))
+        return messages
+
+    def get_history_before(self, cutoff: datetime, limit: int) -> list[tuple[int, UUID, datetime, str, int]]:
+        """
+        Get the oldest messages created before `cutoff`, for archiving.
+        Returns: list of (history id, uid, created_at, content, sent_by) in ascending id order.
+        """
+        with self.__read_connection() as conn:
+            rows = conn.execute("SELECT history.id, client.uid, history.created_at, history.content, history.sent_by "
+                                "FROM history JOIN client ON client.id = history.client_id "
+                                "WHERE history.created_at < ? ORDER BY history.id LIMIT ?",
+                                (self._codec.encode_time(cutoff), limit)).fetchall()
+        return [(row[0], self._codec.decode_uid(row[1]), self._codec.decode_time(row[2]), row[3], row[4])
+                for row in rows]
+
+    def delete_history(self, ids: list[int]) -> int:
+        """
+        Returns: int: the number of deleted messages.
+        """
+        with self.__conn:
+            cur = self.__conn.executemany("DELETE FROM history WHERE id = ?", [(i,) for i in ids])
+        self._logger.debug({"place": "delete_history", "action": "delete", "status": "success",
+                            "size": cur.rowcount})
+        return cur.rowcount
+
     def insert_history_to_chat_client(self, cc: Connection) -> bool:
         """
+        全ての履歴を読み込むため，`get_history`もしくは`iter_history`を使ってください．
+        ** DEPRECATED **
         Args:
             cc:
 
@@ -199,42 +480,38 @@ class SQLSession:
             self._logger.error(log_dict)
             return False
         cur = self.__conn.cursor()
-        cur.execute("SELECT content, created_at, sent_by FROM history WHERE history.client_id=?", (client_id,))
-        count = 0
+        cur.execute("SELECT id, content, created_at, sent_by FROM history WHERE history.client_id=? ORDER BY id",
+                    (client_id,))
         for row in cur.fetchall():
             cc.add_message(Message(chat_client=cc,
-                                   content=row[0],
-                                   created_at=datetime.strptime(row[1], DATETIME_FORMAT),
-                                   sent_by=SentBy(int(row[2]))))
-            count += 1
-        cc.number_of_saved_messages = count
+                                   content=row[1],
+                                   created_at=self._codec.decode_time(row[2]),
+                                   sent_by=SentBy(int(row[3])),
+                                   history_id=row[0]), saved=True)
         return True
 
     def __init_db(self):
         log_dict = {"place": "init_db", "action": "init"}
         self._logger.debug(log_dict)
-        cur = self.__conn.cursor()
         self.__conn.execute("PRAGMA foreign_keys = ON")
-        cur.execute("CREATE TABLE IF NOT EXISTS client("
-                    "id         INTEGER PRIMARY KEY AUTOINCREMENT, "
-                    "created_at TEXT DEFAULT CURRENT_TIMESTAMP,"
-                    "uid    VARCHAR(127) NOT NULL,"
-                    "service1_id  VARCHAR(127) NOT NULL,"
-                    "service2_id  VARCHAR(127) NOT NULL,"
-                    "properties   BLOB NOT NULL)")
-        cur.execute("CREATE TABLE IF NOT EXISTS history("
-                    "id         INTEGER PRIMARY KEY AUTOINCREMENT, "
-                    "created_at TEXT,"
-                    "client_id  INTEGER NOT NULL, "
-                    "content    TEXT NOT NULL,"
-                    "sent_by    INTEGER NOT NULL,"  # 0:client 1:server
-                    "FOREIGN KEY (client_id) REFERENCES client(id))")
         log_dict["status"] = "success"
-        log_dict["content"] = cur.fetchall()
+        log_dict["schema_version"] = migrate(self.__conn, self._logger)
         self._logger.debug(log_dict)
-        cur.close()
         return
 
-    def __del__(self):
+    def close(self):
+        if self.__closed:
+            return
+        if self.__readers is not None:
+            while not self.__readers.empty():
+                self.__readers.get_nowait().close()
         self.__conn.commit()
         self.__conn.close()
+        self.__closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except sqlite3.ProgrammingError:
+            # Garbage collected on another thread than the owner. sqlite3 closes the connection by itself.
+            pass
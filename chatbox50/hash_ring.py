@@ -0,0 +1,66 @@
+import bisect
+import hashlib
+from typing import Generic, Hashable, TypeVar
+from uuid import UUID
+
+Node = TypeVar("Node", bound=Hashable)
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HashRing(Generic[Node]):
+    """
+    Consistent hashing of uids onto nodes. Each node has `vnodes` points on the ring, and a uid belongs to the
+    first point after its hash. Adding or removing a node moves only the uids of that node.
+    """
+
+    def __init__(self, nodes: list[Node] | None = None, vnodes: int = 128):
+        if vnodes < 1:
+            raise ValueError(f"vnodes must be 1 or more, not {vnodes}")
+        self._vnodes = vnodes
+        self.__points: list[int] = []
+        self.__owners: list[Node] = []
+        self.__nodes: set[Node] = set()
+        for node in nodes or []:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def __contains__(self, node: Node) -> bool:
+        return node in self.__nodes
+
+    @property
+    def nodes(self) -> set[Node]:
+        return set(self.__nodes)
+
+    def add(self, node: Node) -> None:
+        if node in self.__nodes:
+            return
+        self.__nodes.add(node)
+        for i in range(self._vnodes):
+            point = _hash(f"{node}#{i}".encode("utf-8"))
+            index = bisect.bisect(self.__points, point)
+            self.__points.insert(index, point)
+            self.__owners.insert(index, node)
+
+    def remove(self, node: Node) -> None:
+        if node not in self.__nodes:
+            return
+        self.__nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self.__points, self.__owners) if owner != node]
+        self.__points = [point for point, _ in kept]
+        self.__owners = [owner for _, owner in kept]
+
+    def get(self, uid: UUID) -> Node:
+        """
+        Returns: the node of `uid`.
+        Raises:
+            LookupError: the ring has no node.
+        """
+        if not self.__points:
+            raise LookupError("the hash ring has no node")
+        index = bisect.bisect(self.__points, _hash(uid.bytes))
+        return self.__owners[index % len(self.__owners)]
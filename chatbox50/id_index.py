@@ -0,0 +1,159 @@
+import logging
+import math
+from hashlib import blake2b
+from typing import Iterable
+from uuid import UUID
+
+from chatbox50._utils import Immutable, str_converter
+from chatbox50.message import SentBy
+
+logger = logging.getLogger("chatbox.id_index")
+logger.addHandler(logging.NullHandler())
+
+
+class BloomFilter:
+    """
+    Set membership with no false negatives. The `k` bit positions of a key come from one blake2b digest by double
+    hashing: h1 + i * h2.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+
+        Args:
+            capacity: the number of keys it is sized for. The error rate grows when more are added.
+            error_rate: the false positive rate at `capacity` keys.
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be 1 or more, not {capacity}")
+        if not 0 < error_rate < 1:
+            raise ValueError(f"error_rate must be between 0 and 1, not {error_rate}")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.__bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @staticmethod
+    def hash(key: bytes) -> tuple[int, int]:
+        """
+        Returns: (h1, h2) of `key`. Give them to `add_hash` and `contains_hash` of several filters to hash once.
+        """
+        digest = blake2b(key, digest_size=16).digest()
+        # h2 is odd, so that the positions don't repeat when `size` is even
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def add_hash(self, h1: int, h2: int) -> None:
+        bits, size = self.__bits, self.size
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def contains_hash(self, h1: int, h2: int) -> bool:
+        bits, size = self.__bits, self.size
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: bytes) -> None:
+        self.add_hash(*self.hash(key))
+
+    def __contains__(self, key: bytes) -> bool:
+        return self.contains_hash(*self.hash(key))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.__bits)
+
+
+class IdIndex:
+    """
+    The service ids of every saved connection, kept in memory so that an id which was never seen can be told apart
+    without a database query.
+
+    With `keep_uids`, the service id -> uid mapping of each service is kept. It is exact and costs about 100 bytes
+    per id. Otherwise each service has a chain of Bloom filters, about 10 bits per id: when the last one reaches its
+    capacity, a new one twice as large and with half the error rate is added, so the error rate stays under
+    `2 * error_rate` however many connections are created.
+
+    It is filled by `load` from `StorageBackend.iter_client_ids` and by `add` for each new connection.
+    Until `ready` is set, every id may exist. It assumes this process is the only one which adds connections to
+    the storage.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01, keep_uids: bool = True):
+        self._keep_uids = keep_uids
+        # the mapping answers exactly, so the filters are only built without it
+        self.__filters: dict[SentBy, list[BloomFilter]] = {SentBy.s1: [], SentBy.s2: []} if keep_uids else \
+            {SentBy.s1: [BloomFilter(capacity, error_rate)], SentBy.s2: [BloomFilter(capacity, error_rate)]}
+        self.__uids: dict[SentBy, dict[str, UUID]] = {SentBy.s1: dict(), SentBy.s2: dict()}
+        self.ready = False
+        # lookups answered "new" without storage, and lookups which had to go to storage
+        self.definitely_new = 0
+        self.maybe_saved = 0
+
+    def __add_key(self, sent_by: SentBy, key: str, uid: UUID):
+        if self._keep_uids:
+            self.__uids[sent_by][key] = uid
+            return
+        filters = self.__filters[sent_by]
+        last = filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * 2, last.error_rate / 2)
+            filters.append(last)
+        last.add(key.encode("utf-8"))
+
+    def add(self, uid: UUID, s1_id: Immutable, s2_id: Immutable) -> None:
+        self.__add_key(SentBy.s1, str_converter(s1_id), uid)
+        self.__add_key(SentBy.s2, str_converter(s2_id), uid)
+
+    def load(self, rows: Iterable[tuple[UUID, str, str]]) -> int:
+        """
+        Args:
+            rows: (uid, service1 id, service2 id), the ids converted with `str_converter`.
+        Returns:
+            int: the number of rows.
+        """
+        count = 0
+        for uid, s1_key, s2_key in rows:
+            self.__add_key(SentBy.s1, s1_key, uid)
+            self.__add_key(SentBy.s2, s2_key, uid)
+            count += 1
+        return count
+
+    def might_exist(self, sent_by: SentBy, service_id: Immutable) -> bool:
+        """
+        Returns: bool: False if no saved connection has `service_id`. True if one may have it.
+        """
+        if not self.ready:
+            return True
+        key = str_converter(service_id)
+        if self._keep_uids:
+            found = key in self.__uids[sent_by]
+        else:
+            h1, h2 = BloomFilter.hash(key.encode("utf-8"))
+            found = any(bloom.contains_hash(h1, h2) for bloom in self.__filters[sent_by])
+        if found:
+            self.maybe_saved += 1
+        else:
+            self.definitely_new += 1
+        return found
+
+    def get_uid(self, sent_by: SentBy, service_id: Immutable) -> UUID | None:
+        """
+        Returns: the uid of the saved connection which has `service_id`, or None. Always None without `keep_uids`.
+        """
+        return self.__uids[sent_by].get(str_converter(service_id))
+
+    def stats(self) -> dict:
+        return {"ready": self.ready,
+                "ids": sum(bloom.count for bloom in self.__filters[SentBy.s1]) + len(self.__uids[SentBy.s1]),
+                "uids": len(self.__uids[SentBy.s1]),
+                "filters": len(self.__filters[SentBy.s1]),
+                "filter_bytes": sum(bloom.nbytes for filters in self.__filters.values() for bloom in filters),
+                "definitely_new": self.definitely_new,
+                "maybe_saved": self.maybe_saved}
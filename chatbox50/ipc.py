@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import json
+import logging
+import struct
+from asyncio import CancelledError, Future, StreamReader, StreamWriter, Task, create_task
+from typing import Any, Awaitable, Callable
+from uuid import UUID
+
+from chatbox50._utils import Immutable, ImmutableType, str_converter
+from chatbox50.codec import CompactCodec
+from chatbox50.connection import Connection
+from chatbox50.message import Message, SentBy
+
+logger = logging.getLogger("chatbox.ipc")
+logger.addHandler(logging.NullHandler())
+
+# every frame is a 4-byte big-endian length followed by a UTF-8 JSON object.
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+RequestHandler = Callable[[str, dict], Awaitable[Any]]
+NotificationHandler = Callable[[str, dict], Awaitable[None]]
+
+
+class IpcError(Exception):
+    """
+    The peer failed to handle a request, or the connection to the peer was lost.
+    """
+
+
+async def read_frame(reader: StreamReader) -> dict | None:
+    """
+    Returns: the next frame, or None at the end of the stream.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise IpcError(f"frame of {size} bytes exceeds MAX_FRAME_SIZE")
+    return json.loads(await reader.readexactly(size))
+
+
+def encode_frame(frame: dict) -> bytes:
+    payload = json.dumps(frame, ensure_ascii=False).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_connection(cc: Connection) -> dict:
+    return {"uid": str(cc.uid), "s1": str_converter(cc.s1_id), "s2": str_converter(cc.s2_id)}
+
+
+def decode_connection(data: dict, s1_id_type: ImmutableType, s2_id_type: ImmutableType) -> Connection:
+    return Connection(uid=UUID(data["uid"]), s1_id=s1_id_type(data["s1"]), s2_id=s2_id_type(data["s2"]))
+
+
+def encode_message(msg: Message) -> dict:
+    return {"uid": str(msg.uid), "sent_by": int(msg.sent_by), "content": msg.content,
+            "created_at": msg.created_ns // 1000, "history_id": msg.history_id,
+            "seq": msg.seq, "trace_id": msg.trace_id}
+
+
+def decode_message(data: dict, cc: Connection) -> Message:
+    return Message(chat_client=cc,
+                   sent_by=SentBy(data["sent_by"]),
+                   content=data["content"],
+                   created_at=CompactCodec.decode_time(data["created_at"]),
+                   history_id=data["history_id"],
+                   trace_id=data.get("trace_id"),
+                   seq=data.get("seq"))
+
+
+def encode_id(service_id: Immutable) -> str:
+    return str_converter(service_id)
+
+
+class IpcPeer:
+    """
+    One end of a framed JSON stream between two processes. Both ends can send requests, which are answered,
+    and notifications, which are not. Requests are handled concurrently, so a handler may itself send a request
+    to the other end. Notifications are handled one by one in the order they were sent.
+    """
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter, name: str,
+                 request_handler: RequestHandler | None = None,
+                 notification_handler: NotificationHandler | None = None,
+                 _logger: logging.Logger = None):
+        self.__reader = reader
+        self.__writer = writer
+        self._name = name
+        self.request_handler = request_handler
+        self.notification_handler = notification_handler
+        self.__ids = itertools.count(1)
+        self.__pending: dict[int, Future] = dict()
+        self.__handlers: set[Task] = set()
+        self.task: Task | None = None
+        global logger
+        if _logger is not None:
+            logger = _logger.getChild("ipc")
+
+    def run(self) -> Task:
+        logger.info({"place": self._name, "action": "task_start", "object": "ipc_reader"})
+        self.task = create_task(self.__read_task(), name=f"{self._name}_ipc_reader")
+        return self.task
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def closed(self) -> bool:
+        return self.task is not None and self.task.done()
+
+    async def request(self, method: str, **params) -> Any:
+        """
+        Send a request and wait for its result.
+        Raises:
+            IpcError: the handler of the peer raised an exception, or the connection was lost.
+        """
+        if self.closed:
+            raise IpcError(f"{self._name}: the connection is closed")
+        req = next(self.__ids)
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[req] = future
+        try:
+            self.__write({"req": req, "method": method, "params": params})
+            return await future
+        finally:
+            self.__pending.pop(req, None)
+
+    def notify(self, method: str, **params) -> None:
+        """
+        Send a notification. It doesn't wait for the peer.
+        """
+        if self.closed:
+            raise IpcError(f"{self._name}: the connection is closed")
+        self.__write({"method": method, "params": params})
+
+    async def drain(self) -> None:
+        await self.__writer.drain()
+
+    def __write(self, frame: dict) -> None:
+        # StreamWriter.write never blocks and keeps frames whole, so frames of concurrent tasks don't interleave.
+        self.__writer.write(encode_frame(frame))
+
+    async def __read_task(self):
+        try:
+            while True:
+                frame = await read_frame(self.__reader)
+                if frame is None:
+                    break
+                if "reply" in frame:
+                    future = self.__pending.get(frame["reply"])
+                    if future is None or future.done():
+                        continue
+                    if "error" in frame:
+                        future.set_exception(IpcError(frame["error"]))
+                    else:
+                        future.set_result(frame.get("result"))
+                elif "req" in frame:
+                    task = create_task(self.__handle_request(frame))
+                    self.__handlers.add(task)
+                    task.add_done_callback(self.__handlers.discard)
+                elif self.notification_handler is not None:
+                    try:
+                        await self.notification_handler(frame["method"], frame["params"])
+                    except Exception as e:
+                        logger.error({"place": self._name, "action": "notification", "status": "error",
+                                      "method": frame["method"], "msg": repr(e)})
+        except CancelledError:
+            pass
+        except Exception as e:
+            logger.error({"place": self._name, "action": "read", "status": "error", "msg": repr(e)})
+        finally:
+            for future in self.__pending.values():
+                if not future.done():
+                    future.set_exception(IpcError(f"{self._name}: the connection was lost"))
+            for task in list(self.__handlers):
+                task.cancel()
+            self.__writer.close()
+            logger.info({"place": self._name, "action": "task_end", "object": "ipc_reader"})
+
+    async def __handle_request(self, frame: dict):
+        reply = {"reply": frame["req"]}
+        try:
+            if self.request_handler is None:
+                raise IpcError(f"{self._name} doesn't handle requests")
+            reply["result"] = await self.request_handler(frame["method"], frame["params"])
+        except CancelledError:
+            return
+        except Exception as e:
+            logger.error({"place": self._name, "action": "request", "status": "error",
+                          "method": frame["method"], "msg": repr(e)})
+            reply["error"] = repr(e)
+        if not self.closed:
+            self.__write(reply)
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        else:
+            self.__writer.close()
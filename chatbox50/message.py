@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from enum import IntEnum
 from uuid import UUID
 
@@ -10,25 +11,71 @@ if TYPE_CHECKING:
     from chatbox50.connection import Connection
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def _to_epoch_ns(value: datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
 class SentBy(IntEnum):
     s1 = 0
     s2 = 1
 
 
 class Message:
+    __slots__ = ("__chat_client", "history_id", "created_ns", "content", "sent_by", "seq", "monotonic_ns",
+                 "trace_id", "trace_ns")
+
     def __init__(self,
                  chat_client: Connection,
                  sent_by: SentBy,
                  content: str,
-                 created_at: datetime = datetime.utcnow()):
+                 created_at: datetime | None = None,
+                 history_id: int | None = None,
+                 trace_id: int | None = None,
+                 seq: int | None = None):
+        """
+
+        Args:
+            created_at: when the message was sent, naive UTC or aware. If None, now.
+            history_id: the row id in the history. It is set only when the message is loaded from the database.
+            trace_id: set by `chatbox50.tracing.tracer` when the message is traced.
+            seq: the sequence number in the connection. If None, the next one of `chat_client` for a new message,
+                 and 0 for a message loaded from storage, which has `history_id`. Sequence numbers aren't saved.
+        """
         self.__chat_client = chat_client
-        self.created_at = created_at
+        self.history_id = history_id
+        # epoch ns (UTC) when the message was sent
+        self.created_ns = time.time_ns() if created_at is None else _to_epoch_ns(created_at)
         self.content = content
         self.sent_by = sent_by
+        if seq is None:
+            seq = 0 if history_id is not None else chat_client.next_seq()
+        self.seq = seq
+        # monotonic ns when the message was created, for the latency metrics
+        self.monotonic_ns = time.monotonic_ns()
+        self.trace_id = trace_id
+        # monotonic ns of the last span of a traced message
+        self.trace_ns = 0
+
+    @property
+    def created_at(self) -> datetime:
+        """
+        Returns: datetime: naive UTC, at microsecond precision.
+        """
+        return EPOCH + timedelta(microseconds=self.created_ns // 1000)
 
     def __getitem__(self, item):
         return self.__chat_client[item]
 
+    @property
+    def chat_client(self) -> Connection:
+        return self.__chat_client
+
     @property
     def uid(self) -> UUID:
         return self.__chat_client.uid
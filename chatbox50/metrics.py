@@ -0,0 +1,238 @@
+import logging
+import math
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+logger = logging.getLogger("chatbox.metrics")
+logger.addHandler(logging.NullHandler())
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from 100 µs to 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = dict()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """
+        Returns: the child of the label values. Keep it to update the metric without looking it up again.
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} has the labels {self.labelnames}, not {tuple(labels)}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> Iterable[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, values, value in self._samples():
+            lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        # not checked for a negative amount, it is called for every message.
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield self.name, self.labelnames, values, child.value
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield self.name, self.labelnames, values, child.value
+
+
+class _HistogramChild:
+    __slots__ = ("_upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: tuple[float, ...]):
+        self._upper_bounds = upper_bounds
+        # the last one counts the values over every bound
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self._upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self._upper_bounds = tuple(sorted(buckets))
+        if not self._upper_bounds:
+            raise ValueError(f"{name} needs 1 or more buckets")
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self._upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self):
+        names = self.labelnames + ("le",)
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self._upper_bounds + (math.inf,), child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", names, values + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", self.labelnames, values, child.sum
+            yield f"{self.name}_count", self.labelnames, values, cumulative
+
+
+Collector = Callable[[], None]
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text format.
+    Metrics are updated from the event loop without locks.
+    Collectors run before each rendering, to set gauges which are cheaper to read when they are scraped,
+    like queue depths.
+    """
+
+    def __init__(self):
+        self.__metrics: dict[str, _Metric] = dict()
+        self.__collectors: list[Collector] = []
+
+    def __register(self, metric: _Metric) -> _Metric:
+        found = self.__metrics.get(metric.name)
+        if found is not None:
+            if type(found) is not type(metric) or found.labelnames != metric.labelnames:
+                raise ValueError(f"{metric.name} is already registered as another metric")
+            return found
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.__register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.__register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Collector) -> None:
+        self.__collectors.append(collector)
+
+    def remove_collector(self, collector: Collector) -> None:
+        if collector in self.__collectors:
+            self.__collectors.remove(collector)
+
+    def render(self) -> str:
+        """
+        Returns: str: every metric in the Prometheus text exposition format. Serve it with `CONTENT_TYPE`.
+        """
+        for collector in list(self.__collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.error({"place": "metrics", "action": "collect", "status": "error", "msg": repr(e)})
+        lines = []
+        for metric in self.__metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# The registry of the process.
+registry = MetricsRegistry()
+
+MESSAGES_IN = registry.counter("chatbox_messages_in_total", "Messages sent by each service into ChatBox.",
+                               ["service"])
+MESSAGES_OUT = registry.counter("chatbox_messages_out_total", "Messages delivered to each service.", ["service"])
+DB_COMMITS = registry.counter("chatbox_db_commits_total", "Messages committed to storage.")
+DB_COMMIT_FAILURES = registry.counter("chatbox_db_commit_failures_total", "Messages which failed to be committed.")
+ACTIVE_CONNECTIONS = registry.gauge("chatbox_active_connections", "Active connections of each service.",
+                                    ["service"])
+HIBERNATED_CONNECTIONS = registry.gauge("chatbox_hibernated_connections",
+                                        "Idle connections of each service whose queue and messages are freed.",
+                                        ["service"])
+QUEUE_DEPTH = registry.gauge("chatbox_queue_depth", "Messages waiting in each queue, client queues are summed.",
+                             ["queue"])
+MESSAGE_LATENCY = registry.histogram("chatbox_message_latency_seconds",
+                                     "Seconds from when a message was sent by a service until each stage: "
+                                     "broker, commit, client_queue and send.", ["stage", "service"])
@@ -0,0 +1,168 @@
+import json
+import logging
+import pickle
+import sqlite3
+from typing import Callable
+from uuid import uuid4
+
+_logger = logging.getLogger("chatbox.db.migrations")
+_logger.addHandler(logging.NullHandler())
+
+Step = str | Callable[[sqlite3.Cursor], None]
+
+
+def _give_duplicate_uids_new_values(cur: sqlite3.Cursor):
+    # The uid default of Connection was evaluated once at import, so every client created by one process shared a uid.
+    # A uid was resolved to its first client row, which got the history of all of them. That row keeps the uid,
+    # the others get new ones, and any history row pointing at them is moved to the row which keeps it.
+    duplicates = cur.execute("SELECT uid, MIN(id) FROM client GROUP BY uid HAVING COUNT(*) > 1").fetchall()
+    for uid, kept_id in duplicates:
+        renamed = [row[0] for row in cur.execute("SELECT id FROM client WHERE uid=? AND id<>?", (uid, kept_id))]
+        for client_id in renamed:
+            cur.execute("UPDATE client SET uid=? WHERE id=?", (str(uuid4()), client_id))
+            cur.execute("UPDATE history SET client_id=? WHERE client_id=?", (kept_id, client_id))
+        _logger.warning({"place": "migrate", "action": "give_duplicate_uids_new_values", "status": "success",
+                         "uid": uid, "kept_client_id": kept_id, "renamed_client_ids": renamed})
+
+
+def _record_text_format_of_existing_data(cur: sqlite3.Cursor):
+    # Everything written before `meta` existed is in the text format.
+    # A new database is left empty here and SQLSession records the format it is opened with.
+    if cur.execute("SELECT EXISTS(SELECT 1 FROM client)").fetchone()[0]:
+        cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('storage_format', 'text')")
+
+
+def _create_history_fts(cur: sqlite3.Cursor):
+    # Full-text index of history.content, kept up to date by triggers and backfilled with 'rebuild'.
+    try:
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts "
+                    "USING fts5(content, content='history', content_rowid='id')")
+    except sqlite3.OperationalError as e:
+        _logger.warning({"place": "migrate", "action": "create_history_fts", "status": "skip",
+                         "msg": f"SQLite is built without FTS5, search is disabled. {e!r}"})
+        return
+    cur.execute("CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN "
+                "INSERT INTO history_fts (rowid, content) VALUES (new.id, new.content); END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN "
+                "INSERT INTO history_fts (history_fts, rowid, content) VALUES ('delete', old.id, old.content); END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS history_fts_update AFTER UPDATE OF content ON history BEGIN "
+                "INSERT INTO history_fts (history_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+                "INSERT INTO history_fts (rowid, content) VALUES (new.id, new.content); END")
+    cur.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+
+
+def _properties_from_pickle_to_json(cur: sqlite3.Cursor):
+    # Properties were pickled BLOBs. They are JSON text from now on, values which JSON can't hold become `str`.
+    # Unpickling is only done here, for rows this library wrote itself.
+    rows = cur.execute("SELECT id, properties FROM client WHERE typeof(properties) = 'blob'").fetchall()
+    for client_id, blob in rows:
+        try:
+            properties = pickle.loads(blob)
+        except Exception as e:
+            _logger.error({"place": "migrate", "action": "unpickle_properties", "status": "error",
+                           "client_id": client_id, "msg": repr(e)})
+            properties = dict()
+        cur.execute("UPDATE client SET properties=? WHERE id=?",
+                    (json.dumps({str(key): value for key, value in properties.items()}, ensure_ascii=False,
+                                separators=(",", ":"), default=str), client_id))
+
+
+# (version, steps). A step is a SQL statement or a function which receives a cursor.
+# Append new migrations to the end. Never edit a migration which is already released,
+# databases which have applied it will not run it again.
+MIGRATIONS: list[tuple[int, tuple[Step, ...]]] = [
+    (1, (
+        "CREATE TABLE IF NOT EXISTS client("
+        "id         INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "created_at TEXT DEFAULT CURRENT_TIMESTAMP,"
+        "uid    VARCHAR(127) NOT NULL,"
+        "service1_id  VARCHAR(127) NOT NULL,"
+        "service2_id  VARCHAR(127) NOT NULL,"
+        "properties   BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS history("
+        "id         INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "created_at TEXT,"
+        "client_id  INTEGER NOT NULL, "
+        "content    TEXT NOT NULL,"
+        "sent_by    INTEGER NOT NULL,"  # 0:client 1:server
+        "FOREIGN KEY (client_id) REFERENCES client(id))",
+    )),
+    (2, (
+        _give_duplicate_uids_new_values,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_client_uid ON client(uid)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_client_service1_id ON client(service1_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_client_service2_id ON client(service2_id)",
+        "CREATE INDEX IF NOT EXISTS idx_history_client_id ON history(client_id, id)",
+    )),
+    (3, (
+        "CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        _record_text_format_of_existing_data,
+        # `created_at` loses the TEXT affinity, so that the compact format can store integers.
+        "CREATE TABLE history_v3("
+        "id         INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "created_at,"
+        "client_id  INTEGER NOT NULL, "
+        "content    TEXT NOT NULL,"
+        "sent_by    INTEGER NOT NULL,"  # 0:client 1:server
+        "FOREIGN KEY (client_id) REFERENCES client(id))",
+        "INSERT INTO history_v3 (id, created_at, client_id, content, sent_by) "
+        "SELECT id, created_at, client_id, content, sent_by FROM history",
+        "DROP TABLE history",
+        "ALTER TABLE history_v3 RENAME TO history",
+        "CREATE INDEX IF NOT EXISTS idx_history_client_id ON history(client_id, id)",
+    )),
+    (4, (
+        _create_history_fts,
+    )),
+    (5, (
+        _properties_from_pickle_to_json,
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """
+    Returns:
+        int: 0 if the database has never been migrated. Databases created before `schema_version` existed
+             are also 0, and version 1 is written so that it can be applied to them as is.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return 0 if row[0] is None else row[0]
+
+
+def migrate(conn: sqlite3.Connection, logger: logging.Logger = None) -> int:
+    """
+    Apply every migration newer than the version of the database. Each migration runs in its own transaction.
+    Returns:
+        int: the schema version after migration.
+    """
+    logger = _logger if logger is None else logger.getChild("migrations")
+    version = get_schema_version(conn)
+    for target, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        log_dict = {"place": "migrate", "action": "migrate", "from": version, "to": target}
+        logger.info(log_dict)
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")
+            for step in steps:
+                if isinstance(step, str):
+                    cur.execute(step)
+                else:
+                    step(cur)
+            cur.execute("INSERT INTO schema_version (version) VALUES (?)", (target,))
+            cur.execute("COMMIT")
+        except sqlite3.Error as e:
+            cur.execute("ROLLBACK")
+            log_dict["status"] = "error"
+            log_dict["msg"] = repr(e)
+            logger.critical(log_dict)
+            raise
+        finally:
+            cur.close()
+        version = target
+    return version
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+from asyncio import StreamReader, StreamWriter, Task
+from uuid import UUID
+
+from chatbox50._utils import ImmutableType
+from chatbox50.chatbox import ChatBox
+from chatbox50.queues import QueueLimits
+from chatbox50.remote import ChatBoxServer, Cluster
+
+logger = logging.getLogger("chatbox.multiprocess")
+logger.addHandler(logging.NullHandler())
+
+
+async def _serve_shard(sock: socket.socket, name: str, token: str, chatbox_kwargs: dict):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    cb = ChatBox(name=name, client_queues=False, **chatbox_kwargs)
+    tasks = cb.run()
+    # The shard stops when the supervisor closes the socket.
+    await ChatBoxServer(cb, token).serve(reader, writer, name)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cb.close()
+
+
+def _shard_main(sock: socket.socket, name: str, token: str, chatbox_kwargs: dict):
+    asyncio.run(_serve_shard(sock, name, token, chatbox_kwargs))
+
+
+class ShardSupervisor(Cluster):
+    """
+    Runs `shards` ChatBox processes, each with its own event loop and its own SQLite file `<name>-shard<i>`,
+    and exposes two `RemoteServiceWorker`s which forward to them over Unix socket pairs.
+    Broker, write-behind and database work of different connections run on different cores.
+
+    Service ids must be `int`, `str` or `UUID`, because they are sent between processes as text.
+    """
+
+    def __init__(self,
+                 name: str = "ChatBox50",
+                 shards: int | None = None,
+                 s1_name: str = "server_1",
+                 s2_name: str = "server_2",
+                 s1_id_type: ImmutableType = UUID,
+                 s2_id_type: ImmutableType = UUID,
+                 client_queues: bool = True,
+                 queue_limits: QueueLimits | None = None,
+                 _logger: logging.Logger = None,
+                 **chatbox_kwargs):
+        """
+
+        Args:
+            shards: the number of processes. If None, `os.cpu_count()`.
+            client_queues: the same as `ChatBox(client_queues=...)` for the proxies.
+            queue_limits: used by the proxies and by every shard.
+            **chatbox_kwargs: given to the `ChatBox` of every shard, e.g. `debug`, `wal`, `write_batch_size`.
+                              They must be picklable, so `backend` can't be given.
+        """
+        if shards is None:
+            shards = os.cpu_count() or 1
+        if shards < 1:
+            raise ValueError(f"shards must be 1 or more, not {shards}")
+        if "backend" in chatbox_kwargs:
+            raise TypeError("ShardSupervisor doesn't support `backend`, every shard opens its own storage")
+        # the socket pairs are private to the processes, the token is checked anyway
+        token = secrets.token_hex(16)
+        super().__init__(name, [f"{name}-shard{i}" for i in range(shards)], s1_name, s2_name, s1_id_type,
+                         s2_id_type, client_queues=client_queues, queue_limits=queue_limits, token=token,
+                         _logger=_logger)
+        self.__token = token
+        self._shards = shards
+        self.__chatbox_kwargs = dict(chatbox_kwargs, s1_name=s1_name, s2_name=s2_name, s1_id_type=s1_id_type,
+                                     s2_id_type=s2_id_type, queue_limits=queue_limits)
+        global logger
+        logger = self._logger
+        self.__processes: list[multiprocessing.Process] = []
+        # the supervisor end of the socket pair of each shard, until it is opened.
+        self.__socks: dict[int, socket.socket] = dict()
+
+    async def start(self) -> list[Task]:
+        """
+        Start the shard processes.
+        Returns: list[Task]: the tasks which read from each shard. A task finishes when its shard stops.
+        """
+        context = multiprocessing.get_context("spawn")
+        for i, shard_name in enumerate(self._node_keys):
+            parent_sock, child_sock = socket.socketpair()
+            process = context.Process(target=_shard_main, name=shard_name, daemon=True,
+                                      args=(child_sock, shard_name, self.__token, self.__chatbox_kwargs))
+            process.start()
+            child_sock.close()
+            self.__processes.append(process)
+            self.__socks[i] = parent_sock
+            logger.info({"place": "supervisor_start", "action": "process_start", "object": process.name,
+                         "pid": process.pid})
+        return await super().start()
+
+    async def _open(self, node: int) -> tuple[StreamReader, StreamWriter]:
+        sock = self.__socks.pop(node, None)
+        if sock is None:
+            raise ConnectionError(f"{self._node_keys[node]} has stopped")
+        return await asyncio.open_connection(sock=sock)
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Stop the shard processes. Each shard commits its buffered messages before it exits.
+        """
+        await super().close()
+        for process in self.__processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.error({"place": "supervisor_close", "action": "process_stop", "status": "error",
+                              "object": process.name, "msg": "killed after timeout"})
+                process.kill()
+        self.__processes.clear()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from asyncio import CancelledError, Task, create_task
+from typing import Awaitable, Callable
+from uuid import UUID
+
+from chatbox50.connection import Connection
+from chatbox50.tracing import tracer
+
+logger = logging.getLogger("chatbox.property_flusher")
+logger.addHandler(logging.NullHandler())
+
+# receives (connection, properties as JSON) and returns whether each one was saved
+UpdateFunc = Callable[[list[tuple[Connection, str]]], Awaitable[list[bool]]]
+
+
+class PropertyFlusher:
+    """
+    Saves the properties of the connections which changed since they were last saved.
+    A connection is marked by `Connection.mark_properties_dirty`, so any number of changes between two flushes
+    costs one write. The dirty connections are written together every `interval` seconds.
+    """
+
+    def __init__(self, update_func: UpdateFunc, interval: float = 1.0, _logger: logging.Logger = None):
+        """
+
+        Args:
+            update_func: `StorageBackend.update_properties`.
+            interval: seconds between two flushes.
+        """
+        if interval <= 0:
+            raise ValueError(f"interval must be more than 0, not {interval}")
+        self.__update_func = update_func
+        self._interval = interval
+        # uid -> the latest Connection object of it
+        self.__dirty: dict[UUID, Connection] = dict()
+        self.task: Task | None = None
+        global logger
+        if _logger is not None:
+            logger = _logger.getChild("property_flusher")
+
+    def __len__(self):
+        return len(self.__dirty)
+
+    def mark(self, cc: Connection) -> None:
+        """
+        The listener of `Connection.set_properties_listener`.
+        """
+        self.__dirty[cc.uid] = cc
+
+    def run(self) -> Task:
+        logger.info({"place": "pf_run", "action": "task_start", "object": "property_flusher"})
+        self.task = create_task(self.__flush_task(), name="property_flusher")
+        return self.task
+
+    async def __flush_task(self):
+        try:
+            while True:
+                await asyncio.sleep(self._interval)
+                if self.__dirty:
+                    await self.flush()
+        except CancelledError:
+            await self.flush()
+            return
+
+    async def flush(self) -> int:
+        """
+        Save every dirty connection. The ones which failed are marked dirty again and retried on the next flush.
+        Returns:
+            int: the number of connections saved.
+        """
+        if not self.__dirty:
+            return 0
+        connections = list(self.__dirty.values())
+        self.__dirty.clear()
+        # serialized on the event loop, so that nothing changes them while they are written
+        items = []
+        for cc in connections:
+            try:
+                items.append((cc, cc.dump_properties()))
+            except (TypeError, ValueError) as e:
+                logger.error({"place": "pf_flush", "action": "dump", "status": "error", "uid": str(cc.uid),
+                              "msg": repr(e)})
+                # still dirty, so the listener won't add it again
+                self.mark(cc)
+        flush_start = tracer.begin() if tracer.enabled else None
+        try:
+            results = await self.__update_func(items)
+        except Exception as e:
+            logger.error({"place": "pf_flush", "action": "update", "status": "error", "size": len(items),
+                          "msg": repr(e)})
+            results = [False] * len(items)
+        for (cc, _), result in zip(items, results):
+            if not result:
+                # the listener adds it again
+                cc.mark_properties_dirty()
+        if flush_start is not None:
+            tracer.end("properties.flush", flush_start, size=len(items))
+        return sum(map(bool, results))
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import weakref
+from enum import Enum
+from typing import Callable
+
+logger = logging.getLogger("chatbox.queues")
+logger.addHandler(logging.NullHandler())
+
+
+class OverflowPolicy(str, Enum):
+    """
+    What a full `BoundedQueue` does with a new item.
+    """
+    block = "block"  # the producer waits until there is space.
+    drop_oldest = "drop_oldest"  # the oldest item is removed to make space.
+    drop_newest = "drop_newest"  # the new item is discarded.
+    disconnect = "disconnect"  # the queue is emptied and its consumer is disconnected.
+
+
+class QueueDisconnected(Exception):
+    """
+    Raised by `BoundedQueue.get` after the queue was disconnected by `OverflowPolicy.disconnect`.
+    """
+
+
+class QueueConfig:
+    def __init__(self, maxsize: int = 0, policy: OverflowPolicy | str = OverflowPolicy.block):
+        """
+
+        Args:
+            maxsize: the capacity. If 0, the queue is unbounded and the policy is never used.
+            policy: what to do when the queue is full.
+        """
+        if maxsize < 0:
+            raise ValueError(f"maxsize must be 0 or more, not {maxsize}")
+        self.maxsize = maxsize
+        self.policy = OverflowPolicy(policy)
+
+    def __repr__(self):
+        return f"QueueConfig(maxsize={self.maxsize}, policy={self.policy.value})"
+
+
+class QueueLimits:
+    """
+    Capacities and overflow policies of each class of queue in the pipeline.
+    Only the queues which belong to one connection can be disconnected.
+    """
+
+    def __init__(self,
+                 upload: QueueConfig = QueueConfig(10000),
+                 send: QueueConfig = QueueConfig(10000),
+                 receive: QueueConfig = QueueConfig(10000),
+                 receive_message: QueueConfig = QueueConfig(10000, OverflowPolicy.drop_oldest),
+                 client: QueueConfig = QueueConfig(1024, OverflowPolicy.drop_oldest)):
+        """
+
+        Args:
+            upload: `ChatBox` queues from the ServiceWorkers to the brokers.
+            send: `ServiceWorker.send_queue`, messages sent by the service.
+            receive: `ServiceWorker.rv_que`, messages from the brokers.
+            receive_message: `ServiceWorker.receive_queue`, every message the service received.
+                             By default the oldest messages are dropped when nobody reads it.
+            client: each queue of `ServiceWorker.get_client_queue`. By default the oldest messages are dropped when
+                    the client reads slower than it receives.
+        """
+        for name, config in (("upload", upload), ("send", send), ("receive", receive),
+                             ("receive_message", receive_message)):
+            if config.policy == OverflowPolicy.disconnect:
+                raise ValueError(f"`{name}` queue is shared by every connection and can't be disconnected")
+        self.upload = upload
+        self.send = send
+        self.receive = receive
+        self.receive_message = receive_message
+        self.client = client
+
+
+class QueueStats:
+    """
+    Counters of one queue, or of a group of queues which share them.
+    """
+
+    def __init__(self, name: str, config: QueueConfig):
+        self.name = name
+        self.config = config
+        self.queues = 0
+        self.high_water = 0
+        self.puts = 0
+        self.dropped = 0
+        self.disconnects = 0
+        # read only when the stats are collected, so puts and gets don't count the depth.
+        self._members: "weakref.WeakSet[BoundedQueue]" = weakref.WeakSet()
+
+    @property
+    def depth(self) -> int:
+        """
+        Items waiting in the queues now.
+        """
+        return sum(que.depth for que in list(self._members))
+
+    def stats(self) -> dict:
+        return {"name": self.name, "maxsize": self.config.maxsize, "policy": self.config.policy.value,
+                "queues": self.queues, "depth": self.depth, "high_water": self.high_water, "puts": self.puts,
+                "dropped": self.dropped, "disconnects": self.disconnects}
+
+
+_DISCONNECTED = object()
+
+
+def drain_batch(first, que: asyncio.Queue, limit: int) -> list:
+    """
+    Take what is already in `que`, up to `limit` messages, without waiting.
+    Items may be a message or a list of messages, lists are flattened.
+    Args:
+        first: the item which was awaited.
+
+    Returns: list: the messages in queue order.
+    """
+    batch = list(first) if isinstance(first, list) else [first]
+    while len(batch) < limit and not que.empty():
+        item = que.get_nowait()
+        if isinstance(item, list):
+            batch.extend(item)
+        else:
+            batch.append(item)
+    return batch
+
+
+class BoundedQueue(asyncio.Queue):
+    """
+    `asyncio.Queue` with an overflow policy and high-water-mark counters.
+    """
+
+    def __init__(self, config: QueueConfig, name: str = "queue", stats: QueueStats | None = None,
+                 on_disconnect: Callable[[], None] | None = None):
+        """
+
+        Args:
+            stats: counters to update. Give the same object to several queues to count them as a group.
+            on_disconnect: called when the queue is disconnected by `OverflowPolicy.disconnect`.
+        """
+        super().__init__(config.maxsize)
+        self._config = config
+        self._name = name
+        self._stats = QueueStats(name, config) if stats is None else stats
+        self._stats.queues += 1
+        self._stats._members.add(self)
+        self.__on_disconnect = on_disconnect
+        self.__disconnected = False
+
+    @property
+    def stats(self) -> QueueStats:
+        return self._stats
+
+    @property
+    def disconnected(self) -> bool:
+        return self.__disconnected
+
+    @property
+    def depth(self) -> int:
+        # a disconnected queue only holds the marker which wakes its consumers.
+        return 0 if self.__disconnected else self.qsize()
+
+    @property
+    def waiting_getters(self) -> int:
+        """the number of consumers waiting in `get`."""
+        return sum(1 for getter in self._getters if not getter.done())
+
+    async def put(self, item) -> None:
+        if self._config.policy == OverflowPolicy.block:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
+
+    def put_nowait(self, item) -> None:
+        if self.__disconnected:
+            self._stats.dropped += 1
+            return
+        if self.full():
+            policy = self._config.policy
+            if policy == OverflowPolicy.drop_oldest:
+                super().get_nowait()
+                self.task_done()
+                self._stats.dropped += 1
+            elif policy == OverflowPolicy.drop_newest:
+                self._stats.dropped += 1
+                return
+            elif policy == OverflowPolicy.disconnect:
+                self._stats.dropped += 1
+                self.disconnect()
+                return
+        super().put_nowait(item)
+
+    def _put(self, item):
+        super()._put(item)
+        self._stats.puts += 1
+        if self.qsize() > self._stats.high_water:
+            self._stats.high_water = self.qsize()
+
+    async def get(self):
+        if self.__disconnected:
+            raise QueueDisconnected(self._name)
+        # `asyncio.Queue.get` returns through `get_nowait`, which raises for the consumers woken by `disconnect`.
+        return await super().get()
+
+    def get_nowait(self):
+        if self.__disconnected:
+            raise QueueDisconnected(self._name)
+        return super().get_nowait()
+
+    def disconnect(self) -> None:
+        """
+        Discard every item and make the consumer's `get` raise `QueueDisconnected`.
+        """
+        if self.__disconnected:
+            return
+        self.__disconnected = True
+        self._stats.dropped += self.qsize()
+        self._stats.disconnects += 1
+        while not self.empty():
+            super().get_nowait()
+            self.task_done()
+        # wake the waiting consumers. The marker bypasses the counters, it isn't a message.
+        super()._put(_DISCONNECTED)
+        while self._getters:
+            self._wakeup_next(self._getters)
+        logger.warning({"place": self._name, "action": "disconnect", "status": "overflow",
+                        "maxsize": self._config.maxsize})
+        if self.__on_disconnect is not None:
+            self.__on_disconnect()
+
+    def release(self) -> None:
+        """
+        Remove the queue from the group counted by its stats.
+        """
+        self._stats.queues -= 1
+        self._stats._members.discard(self)
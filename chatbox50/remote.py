@@ -0,0 +1,690 @@
+import asyncio
+import hmac
+import logging
+import time
+from asyncio import AbstractServer, Queue, StreamReader, StreamWriter, Task
+from typing import Any, Callable, Coroutine, Hashable, Iterable
+from uuid import UUID, uuid4
+
+from chatbox50._utils import Immutable, ImmutableType, get_logger_with_nullhandler
+from chatbox50.callbacks import Callback, CallbackRunner
+from chatbox50.chatbox import ChatBox
+from chatbox50.connection import Connection
+from chatbox50.hash_ring import HashRing
+from chatbox50.ipc import IpcError, IpcPeer, decode_connection, decode_message, encode_connection, encode_id, \
+    encode_message
+from chatbox50.message import Message, SentBy
+from chatbox50.metrics import MESSAGE_LATENCY, MESSAGES_IN, MESSAGES_OUT
+from chatbox50.queues import BoundedQueue, QueueLimits, QueueStats
+from chatbox50.service_worker import ServiceWorker
+from chatbox50.transport import TcpTransport, Transport
+
+logger = logging.getLogger("chatbox.remote")
+logger.addHandler(logging.NullHandler())
+
+
+class ChatBoxServer:
+    """
+    Serves a ChatBox to `RemoteServiceWorker`s of other processes or hosts. A remote worker attaches to one
+    service of the ChatBox, and then the callbacks of that local ServiceWorker are forwarded to it.
+    Run the tasks of the ChatBox with `ChatBox.run()` as usual. The ChatBox should be created with
+    `client_queues=False`, because the clients read the queues of the remote workers.
+
+    A peer must send the shared `token` in an `auth` request before anything else, otherwise it is disconnected.
+    One peer at a time can attach to each service. The token is sent as is, so listen only on a trusted network
+    or behind TLS.
+    """
+
+    def __init__(self, cb: ChatBox, token: str, transport: Transport | None = None, _logger: logging.Logger = None):
+        """
+
+        Args:
+            token: the secret every `Cluster` which connects must give, e.g. `secrets.token_hex(16)`.
+            transport: `TcpTransport()` if None.
+        """
+        if not token:
+            raise ValueError("ChatBoxServer needs a token")
+        self.__cb = cb
+        self.__token = token.encode("utf-8")
+        self.__transport = TcpTransport() if transport is None else transport
+        self.__workers: dict[SentBy, ServiceWorker] = {SentBy.s1: cb.get_worker1, SentBy.s2: cb.get_worker2}
+        self.__id_types = {SentBy.s1: cb.get_worker1._id_type, SentBy.s2: cb.get_worker2._id_type}
+        # the peer attached to each service
+        self.__attached: dict[SentBy, IpcPeer] = dict()
+        self.__peers: set[IpcPeer] = set()
+        # the peers which gave the token
+        self.__authenticated: set[IpcPeer] = set()
+        self.__server: AbstractServer | None = None
+        global logger
+        if _logger is not None:
+            logger = _logger.getChild("remote")
+
+    async def start(self, address: Any) -> AbstractServer:
+        """
+        Listen on `address` of the transport, e.g. `("127.0.0.1", 8765)` for `TcpTransport`.
+        """
+        self.__server = await self.__transport.serve(self.__on_connect, address)
+        logger.info({"place": "chatbox_server", "action": "listen", "status": "success",
+                     "object": self.__cb.name, "address": str(address)})
+        return self.__server
+
+    async def __on_connect(self, reader: StreamReader, writer: StreamWriter):
+        await self.serve(reader, writer, f"{self.__cb.name}-{writer.get_extra_info('peername')}")
+
+    def serve(self, reader: StreamReader, writer: StreamWriter, name: str) -> Task:
+        """
+        Serve one connected stream.
+        Returns: Task: it finishes when the stream is closed.
+        """
+        peer = IpcPeer(reader, writer, name, _logger=logger)
+        peer.request_handler = self.__request_handler(peer)
+        peer.notification_handler = self.__notification_handler(peer)
+        self.__peers.add(peer)
+        task = peer.run()
+        task.add_done_callback(lambda _: self.__detach(peer))
+        return task
+
+    def __reject(self, peer: IpcPeer, method: str) -> PermissionError:
+        logger.warning({"place": "chatbox_server", "action": method, "status": "rejected", "object": peer.name,
+                        "msg": "not authenticated, disconnected"})
+        # after the error reply is written
+        asyncio.get_running_loop().call_soon(peer.close)
+        return PermissionError(f"{method}: not authenticated")
+
+    def __authenticate(self, peer: IpcPeer, token: Any) -> None:
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode("utf-8"), self.__token):
+            raise self.__reject(peer, "auth")
+        self.__authenticated.add(peer)
+        logger.info({"place": "chatbox_server", "action": "auth", "status": "success", "object": peer.name})
+
+    def __attach(self, num: SentBy, peer: IpcPeer):
+        attached = self.__attached.get(num)
+        if attached is not None and attached is not peer and not attached.closed:
+            logger.warning({"place": "chatbox_server", "action": "attach", "status": "rejected",
+                            "object": self.__workers[num]._name, "msg": f"already attached by {attached.name}"})
+            raise RuntimeError(f"{self.__workers[num]._name} is already attached")
+        self.__attached[num] = peer
+        worker = self.__workers[num]
+        worker.set_create_callback(self.__create_callback(num, peer))
+        worker.set_new_access_callback(self.__access_callback(num, peer))
+        worker.set_received_message_callback(self.__message_callback(num, peer))
+        worker.set_deactivated_callback(self.__deactivated_callback(num, peer))
+
+    def __detach(self, peer: IpcPeer):
+        self.__peers.discard(peer)
+        self.__authenticated.discard(peer)
+        for num in [num for num, attached in self.__attached.items() if attached is peer]:
+            del self.__attached[num]
+            worker = self.__workers[num]
+            worker.set_create_callback(None)
+            worker.set_new_access_callback(None)
+            worker.set_received_message_callback(None)
+            worker.set_deactivated_callback(None)
+            logger.info({"place": "chatbox_server", "action": "detach", "status": "success", "object": worker._name})
+
+    def __create_callback(self, num: SentBy, peer: IpcPeer):
+        async def _create(other_id: Immutable) -> Immutable:
+            service_id = await peer.request("create", service=num, other_id=encode_id(other_id))
+            return self.__id_types[num](service_id)
+
+        return _create
+
+    def __access_callback(self, num: SentBy, peer: IpcPeer):
+        async def _accessed(service_id: Immutable) -> None:
+            cc = self.__workers[num].get_connection(service_id)
+            peer.notify("accessed", service=num, connection=encode_connection(cc))
+
+        return _accessed
+
+    @staticmethod
+    def __message_callback(num: SentBy, peer: IpcPeer):
+        async def _received(msg: Message) -> None:
+            peer.notify("message", service=num, id=encode_id(msg.get_id(num)), message=encode_message(msg))
+            await peer.drain()
+
+        return _received
+
+    @staticmethod
+    def __deactivated_callback(num: SentBy, peer: IpcPeer):
+        async def _deactivated(service_id: Immutable) -> None:
+            peer.notify("deactivated", service=num, id=encode_id(service_id))
+
+        return _deactivated
+
+    def __request_handler(self, peer: IpcPeer):
+        async def _handle(method: str, params: dict) -> Any:
+            if method == "auth":
+                self.__authenticate(peer, params.get("token"))
+                return {"name": self.__cb.name}
+            if peer not in self.__authenticated:
+                raise self.__reject(peer, method)
+            if method == "attach":
+                self.__attach(SentBy(params["service"]), peer)
+                return {"name": self.__cb.name}
+            return await self.handle_request(method, params)
+
+        return _handle
+
+    def __notification_handler(self, peer: IpcPeer):
+        async def _handle(method: str, params: dict) -> None:
+            if peer not in self.__authenticated:
+                self.__reject(peer, method)
+                return
+            await self.handle_notification(method, params)
+
+        return _handle
+
+    async def handle_request(self, method: str, params: dict) -> Any:
+        if method == "queue_stats":
+            return self.__cb.queue_stats()
+        num = SentBy(params["service"])
+        worker = self.__workers[num]
+        service_id = self.__id_types[num](params["id"])
+        if method == "find":
+            cc = await self.__cb.find_connection(num, service_id)
+            return None if cc is None else encode_connection(cc)
+        if method == "access":
+            uid = params.get("uid")
+            service_id = await worker.access_new_client(service_id, params["create"],
+                                                        uid=None if uid is None else UUID(uid))
+            return None if service_id is None else encode_connection(worker.get_connection(service_id))
+        if method == "history":
+            cc = worker.get_connection(service_id)
+            if cc is None:
+                return []
+            return [encode_message(msg) for msg in await cc.history(params["limit"], params["before_id"])]
+        raise ValueError(f"unknown method `{method}`")
+
+    async def handle_notification(self, method: str, params: dict) -> None:
+        num = SentBy(params["service"])
+        worker = self.__workers[num]
+        service_id = self.__id_types[num](params["id"])
+        if method == "send":
+            if worker.get_connection(service_id) is None:
+                logger.error({"place": "chatbox_server", "action": "send", "status": "error",
+                              "info": {"service_id": str(service_id)}, "msg": "not active"})
+                return
+            await worker.get_msg_sender(service_id)(params["content"])
+        elif method == "send_many":
+            if worker.get_connection(service_id) is None:
+                logger.error({"place": "chatbox_server", "action": "send_many", "status": "error",
+                              "info": {"service_id": str(service_id)}, "msg": "not active"})
+                return
+            await worker.send_many(service_id, params["contents"])
+        elif method == "deactivate":
+            if worker.get_connection(service_id) is not None:
+                worker.deactivate_client(service_id)
+        else:
+            raise ValueError(f"unknown method `{method}`")
+
+    async def close(self) -> None:
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        for peer in list(self.__peers):
+            peer.close()
+
+
+class RemoteServiceWorker:
+    """
+    `ServiceWorker` compatible proxy of one service of the ChatBoxes of a `Cluster`. Each active connection lives
+    in one node, and calls are forwarded to that node. Messages from the nodes are delivered to the callbacks
+    and queues of this object.
+    """
+
+    def __init__(self, cluster: "Cluster", name: str, service_number: SentBy, set_id_type: ImmutableType,
+                 _logger: logging.Logger, client_queues: bool = True, queue_limits: QueueLimits | None = None):
+        self._name = name
+        self._num = service_number
+        self._id_type = set_id_type
+        self.__cluster = cluster
+        self.__logger = _logger.getChild(name)
+        if queue_limits is None:
+            queue_limits = QueueLimits()
+        self._queue_limits = queue_limits
+        self._receive_msg_que: BoundedQueue[Message] = BoundedQueue(queue_limits.receive_message,
+                                                                    f"{name}.receive_message")
+        self.__client_queue_stats = QueueStats(f"{name}.client", queue_limits.client)
+        self.__callbacks = CallbackRunner(name)
+        self.__messages_in = MESSAGES_IN.labels(service=name)
+        self.__messages_out = MESSAGES_OUT.labels(service=name)
+        self.__sent_latency = MESSAGE_LATENCY.labels(stage="send", service=name)
+        self._access_callback: Callback | None = None
+        self._create_callback: Callback | None = None
+        self._received_message_callback: Callback | None = None
+        self._deactivated_callback: Callback | None = None
+        self._active_ids: dict[Immutable, Connection] = dict()
+        # service id -> index of the node which has the connection
+        self._routes: dict[Immutable, int] = dict()
+        self._queue_dict: dict[Immutable, BoundedQueue] = dict()
+        self._client_queues = client_queues
+
+    @property
+    def receive_queue(self) -> Queue[Message]:
+        return self._receive_msg_que
+
+    def callback_stats(self) -> list[dict]:
+        return self.__callbacks.stats()
+
+    def close(self) -> None:
+        self.__callbacks.shutdown()
+
+    def queue_stats(self) -> list[dict]:
+        return [self._receive_msg_que.stats.stats(), self.__client_queue_stats.stats()]
+
+    def set_new_access_callback(self, callback: Callable[[Immutable], ...]) -> None:
+        self._access_callback = self.__callbacks.wrap(callback, "access")
+
+    def set_create_callback(self, callback: Callable[[Immutable], Immutable] |
+                                            Callable[[Immutable], Coroutine[Any, Any, Immutable]]):
+        self._create_callback = self.__callbacks.wrap(callback, "create")
+
+    def set_received_message_callback(self, callback: Callable[[Message], None]):
+        self._received_message_callback = self.__callbacks.wrap(callback, "received_message")
+
+    def set_deactivated_callback(self, callback: Callable[[Immutable], None]):
+        self._deactivated_callback = self.__callbacks.wrap(callback, "deactivated")
+
+    async def access_new_client(self, service_id: Immutable = None, create_client_if_no_exist=True) -> Immutable:
+        """
+        The same as `ServiceWorker.access_new_client`. The node of an unknown service id is found by asking every
+        node. A new connection gets a random uid, and is created in the node of that uid on the hash ring.
+        """
+        if service_id is None and self._id_type == UUID:
+            service_id = uuid4()
+        elif not isinstance(service_id, self._id_type):
+            raise TypeError(f"{self._name}.access_new_client: service_id must be `{self._id_type}` not `"
+                            f"{type(service_id)}`")
+        uid = None
+        node = self._routes.get(service_id)
+        if node is None:
+            node = await self.__cluster.find(self._num, service_id)
+        if node is None:
+            if not create_client_if_no_exist:
+                self.__logger.error({"place": self._name, "action": "access", "status": "not_found",
+                                     "info": {"service_id": str(service_id)}})
+                return None
+            uid = uuid4()
+            node = self.__cluster.place(uid)
+        peer = await self.__cluster.peer(node)
+        data = await peer.request("access", service=self._num, id=encode_id(service_id),
+                                  create=create_client_if_no_exist, uid=None if uid is None else str(uid))
+        if data is None:
+            self.__logger.error({"place": self._name, "action": "access", "status": "not_found",
+                                 "info": {"service_id": str(service_id), "node": node}})
+            return None
+        return self._activate(decode_connection(data, *self.__cluster.id_types), node)
+
+    def _activate(self, cc: Connection, node: int) -> Immutable:
+        service_id = cc.s1_id if self._num == SentBy.s1 else cc.s2_id
+        self._active_ids[service_id] = cc
+        self._routes[service_id] = node
+        if self._client_queues and service_id not in self._queue_dict:
+            self._queue_dict[service_id] = BoundedQueue(self._queue_limits.client, f"{self._name}.client",
+                                                        self.__client_queue_stats,
+                                                        on_disconnect=lambda: self.deactivate_client(service_id))
+
+        async def _load_history(_cc: Connection, limit: int, before_id: int | None) -> list[Message]:
+            peer = await self.__cluster.peer(node)
+            records = await peer.request("history", service=self._num, id=encode_id(service_id), limit=limit,
+                                         before_id=before_id)
+            return [decode_message(record, _cc) for record in records]
+
+        cc.set_history_loader(_load_history)
+        return service_id
+
+    def deactivate_client(self, service_id: Immutable, called_by_chat_box=False):
+        """
+        The same as `ServiceWorker.deactivate_client`. The node deactivates the other service of the connection,
+        and tells it to the worker attached to that service.
+        """
+        self._active_ids.pop(service_id)
+        node = self._routes.pop(service_id)
+        client_queue = self._queue_dict.pop(service_id, None)
+        if client_queue is not None:
+            client_queue.release()
+        if called_by_chat_box:
+            return
+        peer = self.__cluster.connected_peer(node)
+        if peer is not None:
+            peer.notify("deactivate", service=self._num, id=encode_id(service_id))
+
+    def get_msg_sender(self, service_id: Immutable) -> Callable[[str], Coroutine[Any, Any, None]]:
+        node = self._routes[service_id]
+        str_id = encode_id(service_id)
+        messages_in = self.__messages_in
+
+        async def _msg_sender(content: str) -> None:
+            messages_in.inc()
+            peer = await self.__cluster.peer(node)
+            peer.notify("send", service=self._num, id=str_id, content=content)
+            await peer.drain()
+
+        return _msg_sender
+
+    async def send_many(self, service_id: Immutable, contents: Iterable[str]) -> int:
+        """
+        The same as `ServiceWorker.send_many`. The contents are sent to the node in one frame.
+        """
+        if service_id not in self._active_ids:
+            raise KeyError(f"{self._name}: service_id:{service_id} didn't find in active_ids.")
+        peer = await self.__cluster.peer(self._routes[service_id])
+        contents = list(contents)
+        peer.notify("send_many", service=self._num, id=encode_id(service_id), contents=contents)
+        self.__messages_in.inc(len(contents))
+        await peer.drain()
+        return len(contents)
+
+    def get_connection(self, service_id: Immutable) -> Connection | None:
+        return self._active_ids.get(service_id)
+
+    def get_uid_from_service_id(self, service_id: Immutable) -> UUID | None:
+        cc = self._active_ids.get(service_id)
+        if cc is None:
+            return None
+        return cc.uid
+
+    def get_client_queue(self, service_id: Immutable) -> Queue | None:
+        return self._queue_dict.get(service_id)
+
+    def observe_sent(self, msg: Message) -> None:
+        """
+        The same as `ServiceWorker.observe_sent`, but measured from when the message reached this process.
+        """
+        self.__sent_latency.observe((time.monotonic_ns() - msg.monotonic_ns) / 1e9)
+
+    def _drop_node(self, node: int) -> None:
+        # the connection to the node was lost, its connections are inactive until they are accessed again.
+        for service_id in [service_id for service_id, routed in self._routes.items() if routed == node]:
+            self.deactivate_client(service_id, True)
+
+    async def _on_create(self, other_id: Immutable) -> str:
+        if self._create_callback is None:
+            raise AttributeError(f"the create callback of `{self._name}` isn't set")
+        service_id = await self._create_callback(other_id)
+        return encode_id(service_id)
+
+    async def _on_accessed(self, data: dict, node: int) -> None:
+        service_id = self._activate(decode_connection(data, *self.__cluster.id_types), node)
+        if self._access_callback is not None:
+            await self._access_callback(service_id)
+
+    async def _on_deactivated(self, str_id: str) -> None:
+        service_id = self._id_type(str_id)
+        if service_id not in self._active_ids:
+            return
+        self.deactivate_client(service_id, True)
+        if self._deactivated_callback is not None:
+            await self._deactivated_callback(service_id)
+
+    async def _on_message(self, str_id: str, data: dict) -> None:
+        cc = self._active_ids.get(self._id_type(str_id))
+        if cc is None:
+            self.__logger.error({"place": self._name, "action": "get_cc", "status": "error",
+                                 "info": {"service_id": str_id}})
+            return
+        msg = decode_message(data, cc)
+        # the node commits it
+        cc.add_message(msg, saved=True)
+        if self._received_message_callback is not None:
+            await self._received_message_callback(msg)
+        client_queue = self._queue_dict.get(self._id_type(str_id))
+        if client_queue is not None:
+            await client_queue.put(msg)
+        await self._receive_msg_que.put(msg)
+        self.__messages_out.inc()
+
+
+class Cluster:
+    """
+    The front of several ChatBox nodes, each served by a `ChatBoxServer`. It keeps one connection per node, which
+    every worker and every call shares. New connections are placed on the nodes by consistent hashing of
+    `Connection.uid`. Subclasses open the streams to the nodes, and each stream is authenticated with `token`.
+
+    Service ids must be `int`, `str` or `UUID`, because they are sent between processes as text.
+    """
+
+    def __init__(self,
+                 name: str,
+                 node_keys: list[Hashable],
+                 s1_name: str = "server_1",
+                 s2_name: str = "server_2",
+                 s1_id_type: ImmutableType = UUID,
+                 s2_id_type: ImmutableType = UUID,
+                 services: Iterable[SentBy] = (SentBy.s1, SentBy.s2),
+                 client_queues: bool = True,
+                 queue_limits: QueueLimits | None = None,
+                 token: str = "",
+                 _logger: logging.Logger = None):
+        """
+
+        Args:
+            node_keys: a stable key of each node, e.g. its address. Placement depends only on the keys, so every
+                       process using the same nodes places a uid on the same node.
+            token: the token of the `ChatBoxServer`s.
+            services: the services which this process attaches to. The other one may be attached by another
+                      process, e.g. the web front end attaches service1 and a Discord bot attaches service2.
+            client_queues: the same as `ChatBox(client_queues=...)` for the proxies.
+            queue_limits: used by the proxies.
+        """
+        if not node_keys:
+            raise ValueError("a cluster needs 1 or more nodes")
+        self._name = name
+        self._node_keys = list(node_keys)
+        self.__ring: HashRing[str] = HashRing()
+        self.__nodes_of_key = {str(key): i for i, key in enumerate(self._node_keys)}
+        for key in self.__nodes_of_key:
+            self.__ring.add(key)
+        self.id_types = (s1_id_type, s2_id_type)
+        if _logger is None:
+            _logger = get_logger_with_nullhandler(self._name)
+        self._logger = _logger.getChild(name)
+        self.__workers: dict[SentBy, RemoteServiceWorker] = dict()
+        for num in services:
+            num = SentBy(num)
+            self.__workers[num] = RemoteServiceWorker(self, s1_name if num == SentBy.s1 else s2_name, num,
+                                                      self.id_types[num], self._logger, client_queues, queue_limits)
+        self.__token = token
+        self.__peers: list[IpcPeer | None] = [None] * len(self._node_keys)
+        self.__connecting: dict[int, asyncio.Future] = dict()
+        self.__tasks: set[Task] = set()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __worker(self, num: SentBy) -> RemoteServiceWorker:
+        worker = self.__workers.get(num)
+        if worker is None:
+            raise AttributeError(f"{self._name} doesn't attach to service{num + 1}")
+        return worker
+
+    @property
+    def get_worker1(self) -> RemoteServiceWorker:
+        return self.__worker(SentBy.s1)
+
+    @property
+    def get_worker2(self) -> RemoteServiceWorker:
+        return self.__worker(SentBy.s2)
+
+    async def _open(self, node: int) -> tuple[StreamReader, StreamWriter]:
+        raise NotImplementedError
+
+    async def start(self) -> list[Task]:
+        """
+        Connect to every node.
+        Returns: list[Task]: the tasks which read from each node. A task finishes when its connection is closed.
+        """
+        for node in range(len(self._node_keys)):
+            await self.peer(node)
+        return list(self.__tasks)
+
+    def place(self, uid: UUID) -> int:
+        """
+        Returns: the node of `uid` on the hash ring.
+        """
+        return self.__nodes_of_key[self.__ring.get(uid)]
+
+    def connected_peer(self, node: int) -> IpcPeer | None:
+        peer = self.__peers[node]
+        if peer is None or peer.closed:
+            return None
+        return peer
+
+    async def peer(self, node: int) -> IpcPeer:
+        """
+        Returns: the connection to `node`. It is opened and attached again if it was lost.
+        """
+        peer = self.connected_peer(node)
+        if peer is not None:
+            return peer
+        if node in self.__connecting:
+            return await asyncio.shield(self.__connecting[node])
+        future = asyncio.get_running_loop().create_future()
+        self.__connecting[node] = future
+        try:
+            peer = await self.__connect(node)
+            future.set_result(peer)
+            return peer
+        except Exception as e:
+            future.set_exception(e)
+            # the waiters get it, it is not an unhandled error of the future.
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self.__connecting[node]
+
+    async def __connect(self, node: int) -> IpcPeer:
+        reader, writer = await self._open(node)
+        peer = IpcPeer(reader, writer, f"{self._name}-{self._node_keys[node]}", _logger=self._logger)
+        peer.request_handler = self.__request_handler(node)
+        peer.notification_handler = self.__notification_handler(node)
+        task = peer.run()
+        self.__tasks.add(task)
+        task.add_done_callback(lambda _: self.__on_closed(node, task))
+        self.__peers[node] = peer
+        await peer.request("auth", token=self.__token)
+        for num in self.__workers:
+            await peer.request("attach", service=num)
+        self._logger.info({"place": "cluster", "action": "connect", "status": "success",
+                           "object": str(self._node_keys[node])})
+        return peer
+
+    def __on_closed(self, node: int, task: Task):
+        self.__tasks.discard(task)
+        self._logger.warning({"place": "cluster", "action": "disconnect", "object": str(self._node_keys[node])})
+        for worker in self.__workers.values():
+            worker._drop_node(node)
+
+    def __request_handler(self, node: int):
+        async def _handle(method: str, params: dict) -> Any:
+            if method == "create":
+                num = SentBy(params["service"])
+                # the id of the service which accessed, the other one of `num`
+                other_id = self.id_types[1 - num](params["other_id"])
+                return await self.__worker(num)._on_create(other_id)
+            raise ValueError(f"unknown method `{method}`")
+
+        return _handle
+
+    def __notification_handler(self, node: int):
+        async def _handle(method: str, params: dict) -> None:
+            worker = self.__worker(SentBy(params["service"]))
+            if method == "accessed":
+                await worker._on_accessed(params["connection"], node)
+            elif method == "message":
+                await worker._on_message(params["id"], params["message"])
+            elif method == "deactivated":
+                await worker._on_deactivated(params["id"])
+            else:
+                raise ValueError(f"unknown method `{method}`")
+
+        return _handle
+
+    async def find(self, sent_by: SentBy, service_id: Immutable) -> int | None:
+        """
+        Returns: the node whose database has the connection, or None.
+        """
+        peers = [await self.peer(node) for node in range(len(self._node_keys))]
+        found = await asyncio.gather(*(peer.request("find", service=sent_by, id=encode_id(service_id))
+                                       for peer in peers))
+        for node, data in enumerate(found):
+            if data is not None:
+                return node
+        return None
+
+    async def queue_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: the queue stats of the proxies and of every node. Names of node queues are prefixed
+                 with the node key.
+        """
+        found = []
+        for worker in self.__workers.values():
+            found += worker.queue_stats()
+        for node, key in enumerate(self._node_keys):
+            try:
+                for stats in await (await self.peer(node)).request("queue_stats"):
+                    stats["name"] = f"{key}.{stats['name']}"
+                    found.append(stats)
+            except (IpcError, OSError) as e:
+                self._logger.error({"place": "cluster", "action": "queue_stats", "status": "error",
+                                    "object": str(key), "msg": repr(e)})
+        return found
+
+    async def close(self) -> None:
+        for peer in self.__peers:
+            if peer is not None:
+                peer.close()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__peers = [None] * len(self._node_keys)
+        for worker in self.__workers.values():
+            worker.close()
+
+
+class RemoteChatBox(Cluster):
+    """
+    A ChatBox whose connections live in `ChatBoxServer`s on other processes or hosts.
+
+    ```python
+    token = os.environ["CHATBOX_TOKEN"]
+    # on each node, e.g. the second one on port 8766
+    cb = ChatBox(client_queues=False)
+    tasks = cb.run()
+    await ChatBoxServer(cb, token).start(("127.0.0.1", 8765))
+
+    # on the front end
+    remote = RemoteChatBox([("127.0.0.1", 8765), ("127.0.0.1", 8766)], token, services=[SentBy.s1])
+    await remote.start()
+    s1_id = await remote.get_worker1.access_new_client()
+    ```
+    """
+
+    def __init__(self,
+                 nodes: list[Any],
+                 token: str,
+                 name: str = "ChatBox50",
+                 transport: Transport | None = None,
+                 s1_name: str = "server_1",
+                 s2_name: str = "server_2",
+                 s1_id_type: ImmutableType = UUID,
+                 s2_id_type: ImmutableType = UUID,
+                 services: Iterable[SentBy] = (SentBy.s1, SentBy.s2),
+                 client_queues: bool = True,
+                 queue_limits: QueueLimits | None = None,
+                 _logger: logging.Logger = None):
+        """
+
+        Args:
+            nodes: the addresses of the nodes for `transport`. Every process must list the same nodes.
+            token: the token of the `ChatBoxServer`s.
+            transport: `TcpTransport()` if None.
+        """
+        super().__init__(name, nodes, s1_name, s2_name, s1_id_type, s2_id_type, services, client_queues,
+                         queue_limits, token, _logger)
+        self.__transport = TcpTransport() if transport is None else transport
+
+    async def _open(self, node: int) -> tuple[StreamReader, StreamWriter]:
+        return await self.__transport.connect(self._node_keys[node])
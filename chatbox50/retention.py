@@ -0,0 +1,220 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from asyncio import CancelledError, Task, create_task
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from chatbox50.backend import StorageBackend
+from chatbox50.codec import CompactCodec
+from chatbox50.connection import Connection
+from chatbox50.message import Message, SentBy
+
+logger = logging.getLogger("chatbox.retention")
+logger.addHandler(logging.NullHandler())
+
+# (history id, uid, created_at, content, sent_by)
+HistoryRow = tuple[int, UUID, datetime, str, int]
+
+
+class RetentionPolicy:
+    def __init__(self, days: float, archive_dir: str, interval: float = 3600, batch_size: int = 10000):
+        """
+
+        Args:
+            days: messages older than this are moved from the database to the archive.
+            archive_dir: directory of the archive files. One gzip NDJSON file is written per month.
+            interval: seconds between two runs.
+            batch_size: the maximum number of messages moved in one transaction.
+        """
+        if days <= 0:
+            raise ValueError(f"days must be positive, not {days}")
+        self.days = days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = batch_size
+
+
+class HistoryArchive:
+    """
+    Archived history, stored as `<archive_dir>/<name>-history-YYYY-MM.ndjson.gz`.
+    Each line is `{"id", "uid", "created_at" (epoch microseconds), "content", "sent_by"}`.
+    Files are only appended to, every append adds a gzip member.
+
+    The months and the id range of each archived uid are indexed in memory, so that only the files which have
+    records of a uid are read. The index is built by scanning every file on the first read.
+    """
+
+    def __init__(self, archive_dir: str, name: str):
+        """
+
+        Args:
+            archive_dir: directory of the archive files.
+            name: the name of the ChatBox. If it is a path, only its last component is used.
+        """
+        self._dir = archive_dir
+        self._name = os.path.basename(name)
+        self.__pattern = re.compile(re.escape(self._name) + r"-history-(\d{4})-(\d{2})\.ndjson\.gz$")
+        # uid -> (year, month) -> (the smallest id, the largest id) of its records in that file
+        self.__index: dict[str, dict[tuple[int, int], tuple[int, int]]] | None = None
+        # `append` and `read` run on worker threads
+        self.__lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def __path(self, year: int, month: int) -> str:
+        return os.path.join(self._dir, f"{self._name}-history-{year:04d}-{month:02d}.ndjson.gz")
+
+    def __add_to_index(self, str_uid: str, year: int, month: int, history_id: int):
+        months = self.__index.setdefault(str_uid, dict())
+        low, high = months.get((year, month), (history_id, history_id))
+        months[(year, month)] = (min(low, history_id), max(high, history_id))
+
+    def __build_index(self):
+        start = time.perf_counter()
+        self.__index = dict()
+        count = 0
+        for year, month in self.months():
+            with gzip.open(self.__path(year, month), "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.__add_to_index(record["uid"], year, month, record["id"])
+                    count += 1
+        logger.info({"place": "archive_index", "action": "build", "status": "success", "records": count,
+                     "uids": len(self.__index), "sec": round(time.perf_counter() - start, 3)})
+
+    def months(self) -> list[tuple[int, int]]:
+        """
+        Returns: (year, month) of every archive file, the newest first.
+        """
+        found = []
+        for file_name in os.listdir(self._dir):
+            match = self.__pattern.match(file_name)
+            if match:
+                found.append((int(match[1]), int(match[2])))
+        return sorted(found, reverse=True)
+
+    def append(self, rows: list[HistoryRow]) -> None:
+        by_month: dict[tuple[int, int], list[str]] = dict()
+        for history_id, uid, created_at, content, sent_by in rows:
+            by_month.setdefault((created_at.year, created_at.month), []).append(
+                json.dumps({"id": history_id, "uid": str(uid), "created_at": CompactCodec.encode_time(created_at),
+                            "content": content, "sent_by": int(sent_by)}, ensure_ascii=False) + "\n")
+        with self.__lock:
+            for (year, month), lines in by_month.items():
+                member = gzip.compress("".join(lines).encode("utf-8"))
+                with open(self.__path(year, month), "ab") as f:
+                    f.write(member)
+                    f.flush()
+                    os.fsync(f.fileno())
+            if self.__index is not None:
+                for history_id, uid, created_at, _, _ in rows:
+                    self.__add_to_index(str(uid), created_at.year, created_at.month, history_id)
+
+    def read(self, uid: UUID, limit: int, before_id: int | None = None) -> list[dict]:
+        """
+        Returns: up to `limit` records of `uid` whose id is smaller than `before_id`, in ascending id order.
+        """
+        if limit <= 0:
+            return []
+        str_uid = str(uid)
+        found: dict[int, dict] = dict()
+        with self.__lock:
+            if self.__index is None:
+                self.__build_index()
+            months = self.__index.get(str_uid)
+            if not months:
+                return []
+            # only the files which have a record of `uid` older than `before_id`, the newest first
+            candidates = sorted((key for key, (low, _) in months.items() if before_id is None or low < before_id),
+                                reverse=True)
+            for year, month in candidates:
+                with gzip.open(self.__path(year, month), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record["uid"] == str_uid and (before_id is None or record["id"] < before_id):
+                            # A record is written twice if the process stopped before it was deleted from the database.
+                            found[record["id"]] = record
+                # ids grow with time, so older months can't have newer messages.
+                if len(found) >= limit:
+                    break
+        return [found[i] for i in sorted(found)[-limit:]]
+
+
+class HistoryRetention:
+    """
+    Moves old messages from the backend to a `HistoryArchive` in the background,
+    and reads history from both so that archived messages are still available.
+    The backend must have `get_history_before(cutoff, limit)` and `delete_history(ids)`.
+    """
+
+    def __init__(self, policy: RetentionPolicy, backend: StorageBackend, name: str, _logger: logging.Logger = None):
+        for method in ("get_history_before", "delete_history"):
+            if not callable(getattr(backend, method, None)):
+                raise TypeError(f"{type(backend).__name__} doesn't support retention, `{method}` is missing")
+        self._policy = policy
+        self.__backend = backend
+        self.archive = HistoryArchive(policy.archive_dir, name)
+        self.task: Task | None = None
+        global logger
+        if _logger is not None:
+            logger = _logger.getChild("retention")
+
+    def run(self) -> Task:
+        logger.info({"place": "retention_run", "action": "task_start", "object": "retention"})
+        self.task = create_task(self.__retention_task(), name="retention")
+        return self.task
+
+    async def __retention_task(self):
+        try:
+            while True:
+                try:
+                    await self.archive_once()
+                except Exception as e:
+                    logger.error({"place": "retention", "action": "archive", "status": "error", "msg": repr(e)})
+                await asyncio.sleep(self._policy.interval)
+        except CancelledError:
+            return
+
+    async def archive_once(self, now: datetime | None = None) -> int:
+        """
+        Move every message older than the policy to the archive.
+        Returns:
+            int: the number of archived messages.
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self._policy.days)
+        archived = 0
+        while True:
+            rows: list[HistoryRow] = await self.__backend.get_history_before(cutoff, self._policy.batch_size)
+            if not rows:
+                break
+            # The archive is written before the rows are deleted. If the process stops in between,
+            # the rows are archived again on the next run and `HistoryArchive.read` drops the duplicates.
+            await asyncio.to_thread(self.archive.append, rows)
+            await self.__backend.delete_history([row[0] for row in rows])
+            archived += len(rows)
+            if len(rows) < self._policy.batch_size:
+                break
+        logger.info({"place": "retention", "action": "archive", "status": "success", "archived": archived,
+                     "cutoff": str(cutoff)})
+        return archived
+
+    async def get_history(self, cc: Connection, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        """
+        The same as `StorageBackend.get_history`. When the backend has fewer than `limit` messages,
+        the rest are read from the archive.
+        """
+        page = await self.__backend.get_history(cc, limit, before_id)
+        if len(page) >= limit:
+            return page
+        archive_before = page[0].history_id if page else before_id
+        records = await asyncio.to_thread(self.archive.read, cc.uid, limit - len(page), archive_before)
+        return [Message(chat_client=cc,
+                        sent_by=SentBy(record["sent_by"]),
+                        content=record["content"],
+                        created_at=CompactCodec.decode_time(record["created_at"]),
+                        history_id=record["id"]) for record in records] + page
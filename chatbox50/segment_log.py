@@ -0,0 +1,335 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator
+from uuid import UUID
+
+from chatbox50._utils import Immutable, ImmutableType, str_converter
+from chatbox50.codec import CompactCodec
+from chatbox50.connection import Connection
+from chatbox50.message import Message, SentBy
+
+_logger = logging.getLogger("chatbox.segment_log")
+_logger.addHandler(logging.NullHandler())
+
+# content length, history id, uid, created_at (epoch microseconds), sent_by. The content follows as UTF-8.
+RECORD_HEADER = struct.Struct("<Iq16sqB")
+SEGMENT_FORMAT = "segment-{:06d}.log"
+CLIENTS_FILE = "clients.log"
+# a record position packs the index of the segment and the offset into one int64: segment << 40 | offset
+_OFFSET_BITS = 40
+
+
+class _Segment:
+    def __init__(self, number: int, path: str):
+        self.number = number
+        self.path = path
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.__map: mmap.mmap | None = None
+        self.__fd = None
+
+    def view(self, end: int) -> mmap.mmap:
+        """
+        mmap of the segment which covers at least `end` bytes. The active segment grows,
+        so it is mapped again when a record beyond the current map is read.
+        """
+        if self.__map is None or len(self.__map) < end:
+            self.close()
+            self.__fd = open(self.path, "rb")
+            self.__map = mmap.mmap(self.__fd.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.__map
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        if self.__fd is not None:
+            self.__fd.close()
+            self.__fd = None
+
+
+class SegmentLogBackend:
+    """
+    Append-only message log. Messages are appended to segment files in `<name>.log/` and history is read through
+    `mmap`. The uid -> record position index and the client table are kept in memory and rebuilt from the files
+    on startup. It implements `StorageBackend`.
+    Every write, flush, fsync and history read runs on one dedicated thread, which also updates the indexes after
+    the data is written, so the event loop is never blocked by the disk and no read sees a record which isn't
+    written yet or an index which is half updated.
+    """
+
+    def __init__(self, file_name: str, s1_id_type: ImmutableType, s2_id_type: ImmutableType,
+                 segment_size: int = 64 * 1024 * 1024, fsync: bool = False, logger: logging.Logger = None):
+        """
+
+        Args:
+            file_name: the directory `file_name + ".log"` is used.
+            segment_size: a new segment is started when the active one exceeds this size in bytes.
+            fsync: If True, each batch is fsynced before it is reported as persisted.
+        """
+        self._logger = _logger if logger is None else logger.getChild("segment_log")
+        self._s1_id_type = s1_id_type
+        self._s2_id_type = s2_id_type
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._directory = file_name + ".log"
+        os.makedirs(self._directory, exist_ok=True)
+        self.__clients: dict[UUID, tuple[Immutable, Immutable]] = dict()
+        # uid -> properties as JSON, only for connections which have any
+        self.__properties: dict[UUID, str] = dict()
+        self.__s1_index: dict[str, UUID] = dict()
+        self.__s2_index: dict[str, UUID] = dict()
+        # uid -> history ids and record positions, in ascending order.
+        self.__ids: dict[UUID, array] = dict()
+        self.__positions: dict[UUID, array] = dict()
+        self.__segments: list[_Segment] = []
+        self.__next_id = 1
+        self.__load_clients()
+        self.__load_segments()
+        self.__clients_file = open(os.path.join(self._directory, CLIENTS_FILE), "a", encoding="utf-8")
+        self.__active = open(self.__segments[-1].path, "ab")
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{file_name}-segment-log")
+        self.__closed = False
+
+    async def __run(self, func, *args):
+        if self.__closed:
+            raise RuntimeError("SegmentLogBackend is already closed")
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(func, *args))
+
+    def __load_clients(self):
+        path = os.path.join(self._directory, CLIENTS_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # torn write of the last line
+                    break
+                record = json.loads(line)
+                uid = UUID(record["uid"])
+                if "s1" in record:
+                    self.__index_client(uid, self._s1_id_type(record["s1"]), self._s2_id_type(record["s2"]))
+                # a later record of the same uid has the latest properties
+                if "properties" in record:
+                    self.__set_properties(uid, record["properties"])
+
+    def __set_properties(self, uid: UUID, properties: str):
+        if properties == "{}":
+            self.__properties.pop(uid, None)
+        else:
+            self.__properties[uid] = properties
+
+    def __index_client(self, uid: UUID, s1_id: Immutable, s2_id: Immutable):
+        self.__clients[uid] = (s1_id, s2_id)
+        self.__s1_index[str_converter(s1_id)] = uid
+        self.__s2_index[str_converter(s2_id)] = uid
+
+    def __load_segments(self):
+        numbers = sorted(int(f[8:14]) for f in os.listdir(self._directory)
+                         if f.startswith("segment-") and f.endswith(".log"))
+        for number in numbers or [1]:
+            segment = _Segment(number, os.path.join(self._directory, SEGMENT_FORMAT.format(number)))
+            self.__segments.append(segment)
+            self.__scan(len(self.__segments) - 1, segment)
+        if not os.path.exists(self.__segments[-1].path):
+            open(self.__segments[-1].path, "wb").close()
+
+    def __scan(self, index: int, segment: _Segment):
+        if segment.size == 0:
+            return
+        view = segment.view(segment.size)
+        offset = 0
+        while offset + RECORD_HEADER.size <= segment.size:
+            length, history_id, uid, _, _ = RECORD_HEADER.unpack_from(view, offset)
+            if offset + RECORD_HEADER.size + length > segment.size:
+                break
+            self.__index_message(UUID(bytes=uid), history_id, index, offset)
+            offset += RECORD_HEADER.size + length
+        if offset != segment.size:
+            self._logger.warning({"place": "segment_log_scan", "action": "truncate", "segment": segment.path,
+                                  "size": segment.size, "valid": offset})
+            segment.close()
+            os.truncate(segment.path, offset)
+            segment.size = offset
+
+    def __index_message(self, uid: UUID, history_id: int, segment: int, offset: int):
+        if uid not in self.__ids:
+            self.__ids[uid] = array("q")
+            self.__positions[uid] = array("q")
+        self.__ids[uid].append(history_id)
+        self.__positions[uid].append(segment << _OFFSET_BITS | offset)
+        self.__next_id = max(self.__next_id, history_id + 1)
+
+    def __roll(self):
+        self.__active.flush()
+        if self._fsync:
+            os.fsync(self.__active.fileno())
+        self.__active.close()
+        number = self.__segments[-1].number + 1
+        segment = _Segment(number, os.path.join(self._directory, SEGMENT_FORMAT.format(number)))
+        self.__segments.append(segment)
+        self.__active = open(segment.path, "ab")
+
+    async def get_connection(self, sent_by: SentBy, service_id: Immutable) -> None | Connection:
+        if sent_by == SentBy.s1:
+            uid = self.__s1_index.get(str_converter(service_id))
+        elif sent_by == SentBy.s2:
+            uid = self.__s2_index.get(str_converter(service_id))
+        else:
+            raise AttributeError()
+        if uid is None:
+            return None
+        s1_id, s2_id = self.__clients[uid]
+        properties = self.__properties.get(uid)
+        return Connection(uid=uid, s1_id=s1_id, s2_id=s2_id,
+                          properties=None if properties is None else json.loads(properties))
+
+    async def iter_client_ids(self, batch_size: int = 10000) -> AsyncIterator[list[tuple[UUID, str, str]]]:
+        """
+        The client table is already in memory, it is copied in batches.
+        """
+        batch = []
+        for uid, (s1_id, s2_id) in list(self.__clients.items()):
+            batch.append((uid, str_converter(s1_id), str_converter(s2_id)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __flush_clients(self):
+        self.__clients_file.flush()
+        if self._fsync:
+            os.fsync(self.__clients_file.fileno())
+
+    async def add_new_connection(self, cc: Connection) -> bool:
+        # serialized on the event loop, so that nothing changes them while they are written
+        return await self.__run(self.__add_new_connection, cc.uid, cc.s1_id, cc.s2_id, cc.dump_properties())
+
+    def __add_new_connection(self, uid: UUID, s1_id: Immutable, s2_id: Immutable, properties: str) -> bool:
+        str_s1, str_s2 = str_converter(s1_id), str_converter(s2_id)
+        if uid in self.__clients or str_s1 in self.__s1_index or str_s2 in self.__s2_index:
+            self._logger.error({"place": "segment_log_new_client", "action": "insert", "status": "error",
+                                "info": {"uid": str(uid), "s1_id": str_s1, "s2_id": str_s2},
+                                "msg": "the uid or a service id is already saved"})
+            return False
+        self.__clients_file.write(json.dumps({"uid": str(uid), "s1": str_s1, "s2": str_s2,
+                                              "properties": properties}) + "\n")
+        self.__flush_clients()
+        self.__index_client(uid, s1_id, s2_id)
+        self.__set_properties(uid, properties)
+        return True
+
+    async def update_properties(self, items: list[tuple[Connection, str]]) -> list[bool]:
+        """
+        Append a record with the new properties of each connection to the client file.
+        """
+        return await self.__run(self.__update_properties, items)
+
+    def __update_properties(self, items: list[tuple[Connection, str]]) -> list[bool]:
+        results = []
+        lines = []
+        for cc, properties in items:
+            found = cc.uid in self.__clients
+            results.append(found)
+            if found:
+                lines.append(json.dumps({"uid": str(cc.uid), "properties": properties}) + "\n")
+        self.__clients_file.write("".join(lines))
+        self.__flush_clients()
+        for (cc, properties), found in zip(items, results):
+            if found:
+                self.__set_properties(cc.uid, properties)
+        return results
+
+    async def commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        return await self.__run(self.__commit_message_batch, messages)
+
+    def __commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        results = []
+        # (uid, history id, segment, offset) of each record, indexed once the batch is on disk
+        written = []
+        for message in messages:
+            if message.uid not in self.__clients:
+                self._logger.error({"place": "segment_log_commit", "action": "commit", "status": "error",
+                                    "info": {"uid": str(message.uid)}, "msg": "unknown uid"})
+                results.append(False)
+                continue
+            segment = self.__segments[-1]
+            if segment.size >= self._segment_size:
+                self.__roll()
+                segment = self.__segments[-1]
+            content = message.content.encode("utf-8")
+            history_id = self.__next_id
+            self.__next_id += 1
+            self.__active.write(RECORD_HEADER.pack(len(content), history_id, message.uid.bytes,
+                                                   CompactCodec.encode_time(message.created_at), message.sent_by))
+            self.__active.write(content)
+            written.append((message.uid, history_id, len(self.__segments) - 1, segment.size))
+            segment.size += RECORD_HEADER.size + len(content)
+            results.append(True)
+        self.__active.flush()
+        if self._fsync:
+            os.fsync(self.__active.fileno())
+        for record in written:
+            self.__index_message(*record)
+        return results
+
+    async def get_history(self, cc: Connection, limit: int = 50, before_id: int | None = None) -> list[Message]:
+        # on the writer thread, which is the one that changes the index and maps the segments
+        return await self.__run(self.__get_history, cc, limit, before_id)
+
+    def __get_history(self, cc: Connection, limit: int, before_id: int | None) -> list[Message]:
+        ids = self.__ids.get(cc.uid)
+        if ids is None:
+            return []
+        end = len(ids)
+        if before_id is not None:
+            # ids are ascending, find the first id which is not smaller than before_id.
+            low, high = 0, end
+            while low < high:
+                middle = (low + high) // 2
+                if ids[middle] < before_id:
+                    low = middle + 1
+                else:
+                    high = middle
+            end = low
+        positions = self.__positions[cc.uid]
+        messages = []
+        for i in range(max(0, end - limit), end):
+            segment = self.__segments[positions[i] >> _OFFSET_BITS]
+            offset = positions[i] & ((1 << _OFFSET_BITS) - 1)
+            view = segment.view(offset + RECORD_HEADER.size)
+            length, history_id, _, created_at, sent_by = RECORD_HEADER.unpack_from(view, offset)
+            start = offset + RECORD_HEADER.size
+            view = segment.view(start + length)
+            messages.append(Message(chat_client=cc,
+                                    sent_by=SentBy(sent_by),
+                                    content=view[start:start + length].decode("utf-8"),
+                                    created_at=CompactCodec.decode_time(created_at),
+                                    history_id=history_id))
+        return messages
+
+    def cache_stats(self) -> list[dict]:
+        return []
+
+    def close(self):
+        """
+        Wait for the writes in progress, then close the files and stop the writer thread.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__executor.submit(self.__close_files).result()
+        self.__executor.shutdown(wait=True)
+
+    def __close_files(self):
+        self.__active.close()
+        self.__clients_file.close()
+        for segment in self.__segments:
+            segment.close()
@@ -1,10 +1,18 @@
+import asyncio
 import logging
+import time
 from asyncio import CancelledError, Queue, Task, create_task
+from functools import partial
 from uuid import UUID, uuid4
-from typing import Any, Callable, Coroutine
-from chatbox50._utils import Immutable, ImmutableType, run_as_await_func
+from typing import Any, Callable, Coroutine, Iterable
+from chatbox50._utils import Immutable, ImmutableType
+from chatbox50.callbacks import Callback, CallbackRunner
 from chatbox50.message import Message, SentBy
 from chatbox50.connection import Connection
+from chatbox50.metrics import MESSAGE_LATENCY, MESSAGES_IN, MESSAGES_OUT
+from chatbox50.queues import BoundedQueue, QueueLimits, QueueStats, drain_batch
+from chatbox50.timer_wheel import TimerWheel
+from chatbox50.tracing import tracer
 
 logger = logging.getLogger("chatbox.worker")
 
@@ -17,24 +25,71 @@ class ServiceWorker:
                  upload_que: Queue,
                  new_access_callback: Callable[[Immutable, ...], Coroutine[Any, Any, Connection]],
                  deactivate_callback: Callable[[Connection, SentBy], None],
-                 _logger: logging.Logger
+                 _logger: logging.Logger,
+                 client_queues: bool = True,
+                 queue_limits: QueueLimits | None = None,
+                 callback_threads: int = 4,
+                 callback_pending: int = 256,
+                 batch_limit: int = 256,
+                 idle_ttl: float | None = None,
+                 idle_tick: float = 1.0,
+                 hibernate_callback: Callable[[Connection, SentBy], None] | None = None
                  ):
+        """
+
+        Args:
+            client_queues: If False, messages are not put into per-client queues and `get_client_queue` returns None.
+                           For services which only use `set_received_message_callback`.
+            queue_limits: capacities and overflow policies of the queues. If None, the defaults of `QueueLimits`.
+            callback_threads: the size of the thread pool of sync callbacks.
+            callback_pending: the maximum number of sync callback calls waiting for or running in the pool.
+            batch_limit: the maximum number of messages taken from a queue per wakeup, and the size of one
+                         batch of `send_many`.
+            idle_ttl: seconds without messages or access after which a client is hibernated: its client queue is
+                      freed, but the service id keeps its connection. It is restored on its next message or access.
+                      If None, clients stay active until `deactivate_client`.
+            idle_tick: the resolution in seconds of `idle_ttl`.
+            hibernate_callback: called with the connection after a client is hibernated. The connection is shared
+                                with the other service, so the callback decides when its messages in memory are
+                                freed. If None, they are freed on every hibernation.
+        """
         self._name = name
         self._num = service_number
         self._id_type = set_id_type  # Noneが入る可能性があります．
         self.__upload_que = upload_que
+        self._batch_limit = batch_limit
         self.__new_access_callback_to_cb = new_access_callback
         self.__deactivate_callback = deactivate_callback
+        self.__hibernate_callback = hibernate_callback
         global logger
         logger = _logger.getChild(name)
-        self.rv_que: Queue[Message] = Queue()
-        self._sd_que: Queue[Message] = Queue()
-        self._receive_msg_que: Queue[Message] = Queue()
-        self._access_callback = None
-        self._create_callback = None
-        self._received_message_callback = None
+        if queue_limits is None:
+            queue_limits = QueueLimits()
+        self._queue_limits = queue_limits
+        self.rv_que: BoundedQueue[Message] = BoundedQueue(queue_limits.receive, f"{name}.receive")
+        self._sd_que: BoundedQueue[Message] = BoundedQueue(queue_limits.send, f"{name}.send")
+        self._receive_msg_que: BoundedQueue[Message] = BoundedQueue(queue_limits.receive_message,
+                                                                    f"{name}.receive_message")
+        # every per-client queue counts into one group
+        self.__client_queue_stats = QueueStats(f"{name}.client", queue_limits.client)
+        self.__callbacks = CallbackRunner(name, max_threads=callback_threads, max_pending=callback_pending)
+        self.__messages_in = MESSAGES_IN.labels(service=name)
+        self.__messages_out = MESSAGES_OUT.labels(service=name)
+        self.__client_queue_latency = MESSAGE_LATENCY.labels(stage="client_queue", service=name)
+        self.__sent_latency = MESSAGE_LATENCY.labels(stage="send", service=name)
+        self._access_callback: Callback | None = None
+        self._create_callback: Callback | None = None
+        self._received_message_callback: Callback | None = None
+        self._deactivated_callback: Callback | None = None
+        self.__callback_tasks: set[Task] = set()
         self._active_ids: dict[Immutable, Connection] = dict()
-        self._queue_dict: dict[Immutable, Queue] = dict()
+        self._queue_dict: dict[Immutable, BoundedQueue] = dict()
+        self._client_queues = client_queues
+        if idle_ttl is not None and idle_ttl <= 0:
+            raise ValueError(f"idle_ttl must be more than 0, not {idle_ttl}")
+        self._idle_ttl = idle_ttl
+        self.__idle: TimerWheel | None = None if idle_ttl is None else TimerWheel(idle_tick)
+        self._hibernated: dict[Immutable, Connection] = dict()
         self.tasks = None
 
     def __setitem__(self, key, value):
@@ -58,6 +113,7 @@ class ServiceWorker:
                 "message_callback": str(self._received_message_callback),
                 "active_num": str(len(self._active_ids)),
                 "queue_dict_num": str(len(self._queue_dict)),
+                "hibernated_num": str(len(self._hibernated)),
                 "upload_num": self.__upload_que.qsize(),
                 "rv_queue_num": self.rv_que.qsize(),
                 "sd_queue_num": self._sd_que.qsize()}.__str__()
@@ -67,6 +123,9 @@ class ServiceWorker:
         logger.info({"place": "sw_run", "action": "task_start", "object": ["send_task", "receive_task"]})
         self.tasks = [create_task(self.__send_task(), name="send_task"),
                       create_task(self.__receive_task(), name="receive_task")]
+        if self.__idle is not None:
+            logger.info({"place": "sw_run", "action": "task_start", "object": "idle_task"})
+            self.tasks.append(create_task(self.__idle_task(), name="idle_task"))
         return self.tasks
 
     def is_running(self) -> bool:
@@ -79,42 +138,73 @@ class ServiceWorker:
 
     async def __send_task(self):  # _sd_que -> ServiceWorker -> upload_que -> ChatBox
         try:
-            logger.debug({"place": self._name + "send_task", "action": "start", "info": vars(self)})
+            logger.debug({"place": self._name + "send_task", "action": "start"})
+            while True:
+                batch = drain_batch(await self._sd_que.get(), self._sd_que, self._batch_limit)
+                if tracer.enabled:
+                    for msg in batch:
+                        if msg.trace_id is not None:
+                            tracer.mark(msg, "send_queue", service=self._name)
+                self.__messages_in.inc(len(batch))
+                await self.__upload_que.put(batch)
+        except CancelledError:
+            return
+
+    async def __receive_task(self):  # _rv_queue -> ServiceWorker -> deliver
+        # ChatBox delivers with `deliver` directly. `rv_que` stays for messages put into it by other code.
+        try:
+            logger.debug({"place": self._name + "receive_task", "action": "start"})
             while True:
-                msg: Message = await self._sd_que.get()
-                logger.debug({"place": self._name, "action": "get_msg", "info": vars(msg)})
-                await self.__upload_que.put(msg)
-                logger.debug({"place": self._name, "action": "upload_msg", "info": vars(msg)})
+                for msg in drain_batch(await self.rv_que.get(), self.rv_que, self._batch_limit):
+                    await self.deliver(msg)
         except CancelledError:
             return
 
-    async def __receive_task(self):  # _rv_queue -> ServiceWorker -> _receive_msg_que
+    async def __idle_task(self):
         try:
-            logger.debug({"place": self._name + "receive_task", "action": "start", "info": vars(self)})
             while True:
-                msg: Message = await self.rv_que.get()
-                logger.debug({"place": self._name, "action": "receive_msg", "info": vars(msg)})
-                # ** it's not error TODO: 自分のメッセージも受け取るかを選択できるようにする
-                # if msg.sent_by == self._num:
-                #     raise TypeError(f"MessageSentByAutherError: This is service `{self._num.name}` \n"
-                #                     f"but the message is also sent by the same service.\n"
-                #                     f"content: {msg.content}\n created at: {msg.created_at}")
-                client: Connection = self._active_ids.get(msg.get_id(self._num))
-                if client is not None:
-                    # If the client is active.
-                    client.add_message(msg)
-                    await run_as_await_func(self._received_message_callback, msg)
-                    client_queue: Queue = self._queue_dict.get(msg.get_id(self._num))
-                    await client_queue.put(msg)
-                    await self._receive_msg_que.put(msg)
-                else:
-                    logger.error({"place": self._name, "action": "get_cc", "status": "error", "info": [vars(
-                        msg), self.__dict__()]})
-                    # TODO:If the client isn't active,
-                    pass
+                await asyncio.sleep(self.__idle._tick)
+                for service_id in self.__idle.expire():
+                    self.hibernate_client(service_id)
         except CancelledError:
             return
 
+    async def deliver(self, msg: Message) -> bool:
+        """
+        Deliver a message to the active client: the received message callback, its client queue and
+        `receive_queue`. ChatBox has added it to the messages of the connection.
+        Returns:
+            bool: False if the client isn't active.
+        """
+        # ** it's not error TODO: 自分のメッセージも受け取るかを選択できるようにする
+        service_id = msg.get_id(self._num)
+        client: Connection = self._active_ids.get(service_id)
+        if client is None:
+            client = self.__restore(service_id)
+            if client is None:
+                logger.error({"place": self._name, "action": "get_cc", "status": "error",
+                              "info": {"service_id": str(service_id), "uid": str(msg.uid)}})
+                # TODO:If the client isn't active,
+                return False
+        elif self.__idle is not None:
+            self.__idle.schedule(service_id, self._idle_ttl)
+        if self._received_message_callback is not None:
+            # the brokers deliver every connection's messages, one failing callback must not stop them
+            try:
+                await self._received_message_callback(msg)
+            except Exception as e:
+                logger.error({"place": self._name, "action": "received_message_callback", "status": "error",
+                              "info": {"service_id": str(service_id), "uid": str(msg.uid)}, "msg": repr(e)})
+        client_queue: Queue | None = self._queue_dict.get(service_id)
+        if client_queue is not None:
+            await client_queue.put(msg)
+            self.__client_queue_latency.observe((time.monotonic_ns() - msg.monotonic_ns) / 1e9)
+        await self._receive_msg_que.put(msg)
+        self.__messages_out.inc()
+        if msg.trace_id is not None:
+            tracer.mark(msg, "deliver", service=self._name)
+        return True
+
     @property
     def receive_queue(self) -> Queue[Message]:
         return self._receive_msg_que
@@ -124,14 +214,15 @@ class ServiceWorker:
         return self._sd_que
 
     @property
-    def create_callback_from_other_worker(self):
+    def create_callback_from_other_worker(self) -> Callback | None:
         return self._create_callback
 
     @property
     def access_callback_from_other_worker(self) -> Callable[[Connection], Coroutine[Any, Any, None]]:
         async def __access_func(cc: Connection):
             service_id = self.__active_client(cc)
-            await run_as_await_func(self._access_callback, service_id)
+            if self._access_callback is not None:
+                await self._access_callback(service_id)
 
         return __access_func
 
@@ -145,7 +236,7 @@ class ServiceWorker:
         Returns:
 
         """
-        self._access_callback = callback
+        self._access_callback = self.__callbacks.wrap(callback, "access")
 
     def set_create_callback(self, callback: Callable[[Immutable], Immutable] |
                                             Callable[[Immutable], Coroutine[Any, Any, Immutable]]):
@@ -154,12 +245,23 @@ class ServiceWorker:
         Args:
             callback: コールバックは，必ずservice_idと同じ型を返す必要があります．
         """
-        self._create_callback = callback
+        self._create_callback = self.__callbacks.wrap(callback, "create")
 
     def set_received_message_callback(self, callback: Callable[[Message], None]):
-        self._received_message_callback = callback
+        """
+        The callback is called with every message delivered to this service. If it raises, the error is logged
+        and the message is still put into the queues.
+        """
+        self._received_message_callback = self.__callbacks.wrap(callback, "received_message")
 
-    async def access_new_client(self, service_id: Immutable = None, create_client_if_no_exist=True) -> Immutable:
+    def set_deactivated_callback(self, callback: Callable[[Immutable], None]):
+        """
+        このコールバックは，他のServiceWorkerからクライアントが非アクティブにされた際に，そのservice_idで呼び出されます．
+        """
+        self._deactivated_callback = self.__callbacks.wrap(callback, "deactivated")
+
+    async def access_new_client(self, service_id: Immutable = None, create_client_if_no_exist=True,
+                                uid: UUID | None = None) -> Immutable:
         """
         New Access 1st steep
         Args:
@@ -168,6 +270,7 @@ class ServiceWorker:
             create_client_if_no_exist:
                 True: データベースに同じIDが見つからなかった場合，新規作成します．
                 False: エラーログを出力し，None を返します．
+            uid: 新規作成する場合の`Connection.uid`です．Noneの場合はランダムに生成されます．
 
         Returns:
 
@@ -178,53 +281,217 @@ class ServiceWorker:
             if not isinstance(service_id, self._id_type):
                 raise TypeError(f"{self._name}.access_new_client: service_id must be `{type(self._id_type)}` not `"
                                 f"{type(service_id)}`")
-        cc: Connection = await self.__new_access_callback_to_cb(service_id, create_client_if_no_exist)
+        cc: Connection | None = await self.__new_access_callback_to_cb(service_id, create_client_if_no_exist, uid=uid)
+        if cc is None:
+            logger.error({"place": self._name, "action": "access", "status": "not_found",
+                          "info": {"service_id": str(service_id)}})
+            return None
         self.__active_client(cc)
         return service_id
 
     def __active_client(self, cc: Connection) -> Immutable:
-        logger.debug({"place": self._name, "action": "activate", "status": "start", "info": vars(cc)})
+        start = tracer.begin() if tracer.enabled else None
         if self._num == SentBy.s1:
             service_id = cc.s1_id
         else:
             service_id = cc.s2_id
         self._active_ids[service_id] = cc
-        self._queue_dict[service_id] = Queue()
-        logger.debug({"place": self._name, "action": "activate", "status": "success"})
+        self._hibernated.pop(service_id, None)
+        if self.__idle is not None:
+            self.__idle.schedule(service_id, self._idle_ttl)
+        if self._client_queues and service_id not in self._queue_dict:
+            self._queue_dict[service_id] = BoundedQueue(self._queue_limits.client, f"{self._name}.client",
+                                                        self.__client_queue_stats,
+                                                        on_disconnect=partial(self.__on_client_overflow, service_id))
+        if start is not None:
+            tracer.end("activate", start, service=self._name)
         return service_id
 
     def deactivate_client(self, service_id: Immutable, called_by_chat_box=False):
-        logger.debug({"place": self._name, "action": "deactivate", "status": "start",
-                      "info": {"service_id": str(service_id),
-                               "called_by_chat_box": called_by_chat_box}})
-        cc = self._active_ids.pop(service_id)
-        self._queue_dict.pop(service_id)
+        start = tracer.begin() if tracer.enabled else None
+        cc = self._active_ids.pop(service_id, None)
+        if cc is None:
+            cc = self._hibernated.pop(service_id)
+        if self.__idle is not None:
+            self.__idle.cancel(service_id)
+        client_queue = self._queue_dict.pop(service_id, None)
+        if client_queue is not None:
+            client_queue.release()
         if not called_by_chat_box:
             self.__deactivate_callback(cc, self._num)
-        logger.debug({"place": self._name, "action": "deactivate", "status": "success", "info": vars(cc)})
+        elif self._deactivated_callback is not None:
+            task = create_task(self._deactivated_callback(service_id))
+            self.__callback_tasks.add(task)
+            task.add_done_callback(self.__callback_tasks.discard)
+        if start is not None:
+            tracer.end("deactivate", start, service=self._name, called_by_chat_box=called_by_chat_box)
+
+    def hibernate_client(self, service_id: Immutable) -> bool:
+        """
+        アイドル状態のクライアントを休止させます．クライアントキューは解放されますが，
+        service_idとConnectionの対応は保たれ，次のメッセージやアクセスで自動的に復元されます．
+        メモリ上のメッセージを解放するかは`hibernate_callback`が決めます．
+        `idle_ttl`が設定されている場合は自動的に呼び出されます．
+        Returns:
+            bool: False if the client isn't active, or a consumer is waiting on its client queue.
+        """
+        cc = self._active_ids.get(service_id)
+        if cc is None:
+            return False
+        client_queue = self._queue_dict.get(service_id)
+        if client_queue is not None and client_queue.waiting_getters:
+            # someone is still reading it, e.g. an open WebSocket
+            if self.__idle is not None:
+                self.__idle.schedule(service_id, self._idle_ttl)
+            return False
+        del self._active_ids[service_id]
+        if client_queue is not None:
+            del self._queue_dict[service_id]
+            client_queue.release()
+        self._hibernated[service_id] = cc
+        if self.__idle is not None:
+            self.__idle.cancel(service_id)
+        if self.__hibernate_callback is None:
+            cc.clear_messages()
+        else:
+            self.__hibernate_callback(cc, self._num)
+        logger.debug({"place": self._name, "action": "hibernate", "status": "success",
+                      "info": {"service_id": str(service_id)}})
+        return True
+
+    def __restore(self, service_id: Immutable) -> Connection | None:
+        cc = self._hibernated.get(service_id)
+        if cc is None:
+            return None
+        self.__active_client(cc)
+        logger.debug({"place": self._name, "action": "restore", "status": "success",
+                      "info": {"service_id": str(service_id)}})
+        return cc
+
+    def __keep_alive(self, service_id: Immutable) -> None:
+        # a message from the client. It may have been hibernated since its sender was made.
+        if service_id in self._active_ids:
+            self.__idle.schedule(service_id, self._idle_ttl)
+        else:
+            self.__restore(service_id)
+
+    def __on_client_overflow(self, service_id: Immutable):
+        # OverflowPolicy.disconnect: the consumer of the client queue is too slow.
+        logger.warning({"place": self._name, "action": "client_overflow", "status": "disconnect",
+                        "info": {"service_id": str(service_id)}})
+        if service_id in self._active_ids:
+            self.deactivate_client(service_id)
+
+    def observe_sent(self, msg: Message) -> None:
+        """
+        サービスがクライアントにメッセージを送信した後に呼び出してください．送信までの時間がメトリクスに記録されます．
+        """
+        self.__sent_latency.observe((time.monotonic_ns() - msg.monotonic_ns) / 1e9)
+
+    def callback_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: calls, errors, run time and time queued for a thread of each callback.
+        """
+        return self.__callbacks.stats()
+
+    def close(self) -> None:
+        """
+        Shut down the thread pool of sync callbacks.
+        """
+        self.__callbacks.shutdown()
+
+    def queue_stats(self) -> list[dict]:
+        """
+        Returns: list[dict]: capacity, policy, depth, high-water mark, puts, dropped messages and disconnects of each
+                 queue.
+                 The per-client queues are reported together as `<name>.client`.
+        """
+        return [self.rv_que.stats.stats(), self._sd_que.stats.stats(), self._receive_msg_que.stats.stats(),
+                self.__client_queue_stats.stats()]
 
     def get_msg_sender(self, service_id: Immutable) -> Callable[[str], Coroutine[Any, Any, None]]:
         """
         get message receiver function which is available to send str message to chatbox.
         Args:
-            service_id:
-
-        Returns:
+            service_id: an active service id. The connection is resolved once, here.
 
+        Raises:
+            KeyError: the service id isn't active.
         """
+        client = self.get_connection(service_id)
+        if client is None:
+            raise KeyError(f"{self._name}: service_id:{service_id} didn't find in active_ids.")
+        upload_que = self.__upload_que
+        messages_in = self.__messages_in
+        idle = self.__idle
 
         async def _msg_sender(content: str) -> None:
-            client = self._active_ids.get(service_id)
+            # straight to ChatBox, `send_queue` is skipped.
+            if idle is not None:
+                self.__keep_alive(service_id)
             msg = Message(client, self._num, content)
-            await self._sd_que.put(msg)
+            messages_in.inc()
+            if tracer.enabled:
+                tracer.start_trace(msg)
+            await upload_que.put(msg)
 
         return _msg_sender
 
+    async def send_many(self, service_id: Immutable, contents: Iterable[str]) -> int:
+        """
+        Send messages of one client. Every `batch_limit` messages go through the broker
+        and the database commit as one unit, in order.
+        Args:
+            service_id: an active service id.
+            contents: the message contents.
+
+        Returns:
+            int: the number of messages sent.
+        Raises:
+            KeyError: the service id isn't active.
+        """
+        client = self.get_connection(service_id)
+        if client is None:
+            raise KeyError(f"{self._name}: service_id:{service_id} didn't find in active_ids.")
+        sent = 0
+        batch: list[Message] = []
+        trace = tracer.enabled
+        for content in contents:
+            msg = Message(client, self._num, content)
+            if trace:
+                tracer.start_trace(msg)
+            batch.append(msg)
+            if len(batch) >= self._batch_limit:
+                await self.__upload_que.put(batch)
+                sent += len(batch)
+                batch = []
+        if batch:
+            await self.__upload_que.put(batch)
+            sent += len(batch)
+        self.__messages_in.inc(sent)
+        return sent
+
+    def get_connection(self, service_id: Immutable) -> Connection | None:
+        """
+        Returns: the active connection of `service_id`, or None if it isn't active. A hibernated one is restored.
+        """
+        cc = self._active_ids.get(service_id)
+        if cc is None:
+            return self.__restore(service_id)
+        return cc
+
     def get_uid_from_service_id(self, service_id: Immutable) -> UUID | None:
         cc = self._active_ids.get(service_id)
         if cc is None:
-            return None
+            cc = self._hibernated.get(service_id)
+            if cc is None:
+                return None
         return cc.uid
 
     def get_client_queue(self, service_id: Immutable) -> Queue | None:
+        """
+        A hibernated client is restored with a new queue.
+        """
+        if service_id in self._hibernated:
+            self.__restore(service_id)
         return self._queue_dict.get(service_id)
@@ -0,0 +1,107 @@
+import math
+import time
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TimerWheel(Generic[K]):
+    """
+    Hashed timing wheel of deadlines. `slots` buckets each cover `tick` seconds, and a key is kept in the bucket of
+    its deadline, so scheduling, postponing and cancelling are O(1) and `expire` only looks at the buckets which
+    passed.
+
+    Postponing is lazy: `schedule` of a key which is already in the wheel with an earlier deadline only stores the
+    new deadline. When its old bucket passes, the key is moved to the bucket of the new one. Idle timers, which are
+    postponed on every message, cost one dict store per message.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, clock: Callable[[], float] = time.monotonic):
+        """
+
+        Args:
+            tick: seconds covered by one bucket. Keys expire up to `tick` seconds late.
+            slots: the number of buckets. Deadlines further than `tick * slots` go round the wheel.
+            clock: returns seconds.
+        """
+        if tick <= 0:
+            raise ValueError(f"tick must be more than 0, not {tick}")
+        if slots < 1:
+            raise ValueError(f"slots must be 1 or more, not {slots}")
+        self._tick = tick
+        self.__clock = clock
+        self.__slots: list[set[K]] = [set() for _ in range(slots)]
+        self.__deadlines: dict[K, float] = dict()
+        # key -> the index of the bucket which holds it
+        self.__slot_of: dict[K, int] = dict()
+        # the next tick which `expire` has to look at
+        self.__current = self.__tick_of(clock())
+
+    def __len__(self):
+        return len(self.__deadlines)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.__deadlines
+
+    def __tick_of(self, at: float) -> int:
+        return math.floor(at / self._tick)
+
+    def __insert(self, key: K, deadline: float):
+        # a deadline which already passed goes into the next bucket to be looked at
+        index = max(self.__tick_of(deadline), self.__current) % len(self.__slots)
+        self.__slots[index].add(key)
+        self.__slot_of[key] = index
+
+    def schedule(self, key: K, delay: float) -> None:
+        """
+        Expire `key` after `delay` seconds. If it is already scheduled, its deadline is replaced.
+        """
+        deadline = self.__clock() + delay
+        previous = self.__deadlines.get(key)
+        self.__deadlines[key] = deadline
+        if previous is not None:
+            if deadline >= previous:
+                return
+            self.__slots[self.__slot_of[key]].discard(key)
+        self.__insert(key, deadline)
+
+    def cancel(self, key: K) -> bool:
+        """
+        Returns: bool: False if `key` wasn't scheduled.
+        """
+        if self.__deadlines.pop(key, None) is None:
+            return False
+        self.__slots[self.__slot_of.pop(key)].discard(key)
+        return True
+
+    def deadline(self, key: K) -> float | None:
+        return self.__deadlines.get(key)
+
+    def expire(self) -> list[K]:
+        """
+        Remove and return the keys whose deadline passed. Call it about every `tick` seconds.
+        Returns: list: in no particular order.
+        """
+        now = self.__clock()
+        last = self.__tick_of(now)
+        expired = []
+        # after a long pause every bucket is looked at once
+        first = max(self.__current, last - len(self.__slots) + 1)
+        for tick in range(first, last + 1):
+            index = tick % len(self.__slots)
+            bucket = self.__slots[index]
+            for key in list(bucket):
+                deadline = self.__deadlines[key]
+                if deadline <= now:
+                    bucket.discard(key)
+                    del self.__deadlines[key]
+                    del self.__slot_of[key]
+                    expired.append(key)
+                elif self.__tick_of(deadline) != tick:
+                    # postponed, or further than one round. The deadline is after `now`, so after `tick`.
+                    bucket.discard(key)
+                    self.__slot_of[key] = self.__tick_of(deadline) % len(self.__slots)
+                    self.__slots[self.__slot_of[key]].add(key)
+        # the bucket of `now` may still get keys which expire later in this tick
+        self.__current = last
+        return expired
@@ -0,0 +1,132 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import IO
+
+from chatbox50.message import Message
+
+logger = logging.getLogger("chatbox.tracing")
+logger.addHandler(logging.NullHandler())
+
+
+class Tracer:
+    """
+    Sampled spans of the message pipeline and of storage operations, with `time.monotonic_ns` timestamps.
+
+    A traced message carries `Message.trace_id`, and each step of the pipeline records a span from the end of
+    the previous step to its own end, so the spans of one message make a timeline without gaps.
+    Other operations record spans with no trace id.
+
+    It is disabled by default. Call sites check `tracer.enabled` (or `msg.trace_id is not None`) before they
+    compute anything, so a disabled tracer costs one attribute lookup.
+    Finished spans are kept in a bounded buffer until they are exported as JSON lines.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._sample_rate = 1.0
+        # (trace_id, name, start_ns, end_ns, attrs). deque.append is atomic, spans come from the database thread too.
+        self.__spans: deque[tuple] = deque(maxlen=100_000)
+        self.__lock = threading.Lock()
+        self.dropped = 0
+
+    def enable(self, sample_rate: float = 1.0, max_spans: int = 100_000) -> None:
+        """
+
+        Args:
+            sample_rate: the ratio of messages and operations which are traced, from 0 to 1.
+            max_spans: the size of the span buffer. The oldest spans are dropped when it is full.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, not {sample_rate}")
+        if max_spans < 1:
+            raise ValueError(f"max_spans must be 1 or more, not {max_spans}")
+        with self.__lock:
+            self._sample_rate = sample_rate
+            if self.__spans.maxlen != max_spans:
+                self.__spans = deque(self.__spans, maxlen=max_spans)
+        self.enabled = True
+        logger.info({"place": "tracer", "action": "enable", "sample_rate": sample_rate, "max_spans": max_spans})
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def __sampled(self) -> bool:
+        return self._sample_rate >= 1 or random.random() < self._sample_rate
+
+    def start_trace(self, msg: Message) -> None:
+        """
+        Give `msg` a trace id if it is sampled. Its first span starts now.
+        """
+        if self.enabled and self.__sampled():
+            msg.trace_id = random.getrandbits(64)
+            msg.trace_ns = time.monotonic_ns()
+
+    def mark(self, msg: Message, name: str, **attrs) -> None:
+        """
+        Record the span `name` of a traced message, from its previous mark until now.
+        """
+        now = time.monotonic_ns()
+        self.__record((msg.trace_id, name, msg.trace_ns, now, attrs))
+        msg.trace_ns = now
+
+    def begin(self) -> int | None:
+        """
+        Returns: the start of a span of an operation, or None if it isn't sampled.
+        """
+        if self.enabled and self.__sampled():
+            return time.monotonic_ns()
+        return None
+
+    def end(self, name: str, start_ns: int | None, **attrs) -> None:
+        """
+        Record the span `name` of an operation started with `begin`. Nothing is recorded if `start_ns` is None.
+        """
+        if start_ns is not None:
+            self.__record((None, name, start_ns, time.monotonic_ns(), attrs))
+
+    def __record(self, span: tuple) -> None:
+        spans = self.__spans
+        if len(spans) == spans.maxlen:
+            self.dropped += 1
+        spans.append(span)
+
+    def spans(self, clear: bool = False) -> list[dict]:
+        """
+        Returns: list[dict]: the buffered spans, oldest first.
+        """
+        with self.__lock:
+            spans = list(self.__spans)
+            if clear:
+                self.__spans.clear()
+        return [{"trace_id": None if trace_id is None else f"{trace_id:016x}",
+                 "name": name,
+                 "start_ns": start_ns,
+                 "end_ns": end_ns,
+                 "duration_ns": end_ns - start_ns,
+                 **attrs} for trace_id, name, start_ns, end_ns, attrs in spans]
+
+    def export(self, fp: IO[str]) -> int:
+        """
+        Write the buffered spans to `fp` as JSON lines and clear the buffer.
+        Returns: int: the number of spans written.
+        """
+        spans = self.spans(clear=True)
+        for span in spans:
+            fp.write(json.dumps(span, default=str))
+            fp.write("\n")
+        return len(spans)
+
+    def export_file(self, path: str) -> int:
+        """
+        Append the buffered spans to the JSON lines file `path` and clear the buffer.
+        """
+        with open(path, "a", encoding="utf-8") as fp:
+            return self.export(fp)
+
+
+# The tracer of the process. `tracer.enable()` starts tracing.
+tracer = Tracer()
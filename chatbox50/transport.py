@@ -0,0 +1,48 @@
+import asyncio
+from asyncio import AbstractServer, StreamReader, StreamWriter
+from typing import Any, Awaitable, Callable, Protocol, runtime_checkable
+
+ConnectedCallback = Callable[[StreamReader, StreamWriter], Awaitable[None]]
+
+
+@runtime_checkable
+class Transport(Protocol):
+    """
+    How `RemoteChatBox` and `ChatBoxServer` reach each other. The frames of `chatbox50.ipc` are sent over the
+    streams, so any reliable ordered byte stream can be used. `TcpTransport` and `UnixTransport` implement it.
+    """
+
+    async def connect(self, address: Any) -> tuple[StreamReader, StreamWriter]:
+        ...
+
+    async def serve(self, on_connect: ConnectedCallback, address: Any) -> AbstractServer:
+        ...
+
+
+class TcpTransport:
+    """
+    Addresses are `(host, port)`.
+    """
+
+    def __init__(self, connect_timeout: float = 10):
+        self._connect_timeout = connect_timeout
+
+    async def connect(self, address: tuple[str, int]) -> tuple[StreamReader, StreamWriter]:
+        host, port = address
+        return await asyncio.wait_for(asyncio.open_connection(host, port), self._connect_timeout)
+
+    async def serve(self, on_connect: ConnectedCallback, address: tuple[str, int]) -> AbstractServer:
+        host, port = address
+        return await asyncio.start_server(on_connect, host, port)
+
+
+class UnixTransport:
+    """
+    Addresses are paths of Unix domain sockets.
+    """
+
+    async def connect(self, address: str) -> tuple[StreamReader, StreamWriter]:
+        return await asyncio.open_unix_connection(address)
+
+    async def serve(self, on_connect: ConnectedCallback, address: str) -> AbstractServer:
+        return await asyncio.start_unix_server(on_connect, address)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from asyncio import CancelledError, Event, Future, Task, create_task
+from typing import Awaitable, Callable
+
+from chatbox50.message import Message
+from chatbox50.tracing import tracer
+
+logger = logging.getLogger("chatbox.write_behind")
+logger.addHandler(logging.NullHandler())
+
+FlushFunc = Callable[[list[Message]], list[bool]] | Callable[[list[Message]], Awaitable[list[bool]]]
+
+
+class WriteBehindBuffer:
+    """
+    Buffers messages between the brokers and the database and commits them in groups.
+    A group is flushed with a single transaction when `max_batch` messages are pending,
+    or when the oldest pending message has waited `max_delay` seconds.
+    """
+
+    def __init__(self, flush_func: FlushFunc, max_batch: int = 256, max_delay: float = 0.05,
+                 _logger: logging.Logger = None):
+        """
+
+        Args:
+            flush_func: receives a list of messages and returns a list of bool, one per message,
+                        which tells whether the message was persisted. It can be `def` or `async def`.
+            max_batch: the size limit of one group.
+            max_delay: the latency limit in seconds of one group.
+        """
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be 1 or more, not {max_batch}")
+        self.__flush_func = flush_func
+        self.__is_coroutine = asyncio.iscoroutinefunction(flush_func)
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        # (messages, future, whether the future is resolved with one bool or a list)
+        self.__pending: list[tuple[list[Message], Future, bool]] = []
+        self.__size = 0
+        self.__wakeup = Event()
+        self.__full = Event()
+        self.task: Task | None = None
+        global logger
+        if _logger is not None:
+            logger = _logger.getChild("write_behind")
+
+    def __len__(self):
+        return self.__size
+
+    def submit(self, msg: Message) -> Future:
+        """
+        Add a message to the buffer.
+        Returns:
+            Future[bool]: resolved with True when the message is committed, False when it failed.
+        """
+        return self.__add([msg], True)
+
+    def submit_batch(self, messages: list[Message]) -> Future:
+        """
+        Add messages which are committed in the same group. The group may be larger than `max_batch`.
+        Returns:
+            Future[list[bool]]: resolved with the result of each message.
+        """
+        return self.__add(list(messages), False)
+
+    def __add(self, messages: list[Message], single: bool) -> Future:
+        future = asyncio.get_running_loop().create_future()
+        self.__pending.append((messages, future, single))
+        self.__size += len(messages)
+        self.__wakeup.set()
+        if self.__size >= self._max_batch:
+            self.__full.set()
+        return future
+
+    def run(self) -> Task:
+        logger.info({"place": "wb_run", "action": "task_start", "object": "write_behind"})
+        self.task = create_task(self.__flush_task(), name="write_behind")
+        return self.task
+
+    async def __flush_task(self):
+        try:
+            while True:
+                await self.__wakeup.wait()
+                if self.__size < self._max_batch:
+                    try:
+                        await asyncio.wait_for(self.__full.wait(), self._max_delay)
+                    except asyncio.TimeoutError:
+                        pass
+                await self.flush()
+        except CancelledError:
+            # Don't lose what is already accepted.
+            await self.flush()
+            return
+
+    async def flush(self) -> int:
+        """
+        Commit pending messages in groups of `max_batch` and resolve their futures.
+        A batch of `submit_batch` is never split.
+        Returns:
+            int: the number of messages committed successfully.
+        """
+        committed = 0
+        while self.__pending:
+            taken, size = 0, 0
+            while taken < len(self.__pending) and (taken == 0 or
+                                                   size + len(self.__pending[taken][0]) <= self._max_batch):
+                size += len(self.__pending[taken][0])
+                taken += 1
+            batch = self.__pending[:taken]
+            del self.__pending[:taken]
+            self.__size -= size
+            messages = [msg for entry, _, _ in batch for msg in entry]
+            flush_start = tracer.begin() if tracer.enabled else None
+            try:
+                if self.__is_coroutine:
+                    results = await self.__flush_func(messages)
+                else:
+                    results = self.__flush_func(messages)
+            except Exception as e:
+                logger.error({"place": "wb_flush", "action": "commit", "status": "error",
+                              "size": len(messages), "msg": repr(e)})
+                results = [False] * len(messages)
+            start = 0
+            for entry, future, single in batch:
+                entry_results = list(results[start:start + len(entry)])
+                start += len(entry)
+                if not future.done():
+                    future.set_result(entry_results[0] if single else entry_results)
+                committed += sum(map(bool, entry_results))
+            if flush_start is not None:
+                tracer.end("write_behind.flush", flush_start, size=len(messages))
+        self.__wakeup.clear()
+        self.__full.clear()
+        return committed
@@ -35,6 +35,9 @@ class DiscordServer(Client):
             return
         self.logger.debug(f"received: from:{message.author} content: {message.content}")
         if isinstance(message.channel, Thread) and message.channel.parent_id == self.channel.id:
+            if self._api.get_connection(message.channel.id) is None:
+                self.logger.debug(f"ignored: the client of thread {message.channel.id} isn't active")
+                return
             msg_sender = self._api.get_msg_sender(message.channel.id)
             await msg_sender(message.content)
 
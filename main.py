@@ -4,8 +4,9 @@ from contextlib import asynccontextmanager
 from uuid import UUID
 import logging
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import PlainTextResponse
 
-from chatbox50 import ChatBox, ServiceWorker
+from chatbox50 import ChatBox, ServiceWorker, metrics
 from discord_server import DiscordServer
 from websocket_router import ws_messenger
 from staticfiles_router import staticfiles_router
@@ -52,7 +53,7 @@ async def lifespan(app: FastAPI):
         })
         task.cancel()
     await ds.close()
-    await asyncio.sleep(2)
+    await asyncio.wait(tasks, timeout=2)
     for task in tasks:
         if not task.done():
             logger.error({"action": "shutdown",
@@ -60,11 +61,20 @@ async def lifespan(app: FastAPI):
                           "content": "task couldn't be canceled.the task was killed.",
                           "object": task.get_name()})
             del task
+    # the database writer thread and the callback thread pools
+    cb.close()
 
 
 app = FastAPI(title=NAME, lifespan=lifespan)
 app.include_router(staticfiles_router)
 
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus text format
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.websocket("/ws/{uid}")
 async def websocket_endpoint(ws: WebSocket, uid: UUID):
     await web_api.access_new_client(uid)
@@ -0,0 +1,257 @@
+"""
+Conformance tests of `StorageBackend`. Every test runs against each backend ChatBox ships.
+
+    python -m pytest tests
+"""
+import asyncio
+import json
+import os
+from datetime import timedelta
+
+import pytest
+
+from chatbox50 import AsyncSQLSession, Connection, Message, SegmentLogBackend, SentBy, StorageBackend
+
+BACKENDS = {
+    "sqlite": lambda path: AsyncSQLSession(path, int, str, init=True),
+    "sqlite_compact": lambda path: AsyncSQLSession(path, int, str, init=True, storage_format="compact"),
+    "segment_log": lambda path: SegmentLogBackend(path, int, str),
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def open_backend(request, tmp_path):
+    """
+    Returns a function which opens the backend on the same files each time, and closes every one it opened.
+    """
+    path = os.path.join(tmp_path, "chatbox")
+    opened = []
+
+    def _open() -> StorageBackend:
+        backend = BACKENDS[request.param](path)
+        opened.append(backend)
+        return backend
+
+    yield _open
+    for backend in opened:
+        backend.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def _add_with_messages(backend: StorageBackend, s1_id: int, count: int) -> Connection:
+    cc = Connection(s1_id=s1_id, s2_id=f"s2-{s1_id}")
+    assert await backend.add_new_connection(cc)
+    messages = [Message(cc, SentBy(i % 2), f"message {i}") for i in range(count)]
+    assert await backend.commit_message_batch(messages) == [True] * count
+    return cc
+
+
+def test_implements_protocol(open_backend):
+    assert isinstance(open_backend(), StorageBackend)
+
+
+def test_add_and_get(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        assert await backend.add_new_connection(cc)
+        for sent_by, service_id in ((SentBy.s1, 1), (SentBy.s2, "a")):
+            found = await backend.get_connection(sent_by, service_id)
+            assert (found.uid, found.s1_id, found.s2_id) == (cc.uid, 1, "a")
+        assert await backend.get_connection(SentBy.s1, 2) is None
+        assert await backend.get_connection(SentBy.s2, "b") is None
+
+    run(main())
+
+
+@pytest.mark.parametrize("duplicate", ["uid", "s1_id", "s2_id"])
+def test_duplicate_is_rejected(open_backend, duplicate):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        assert await backend.add_new_connection(cc)
+        other = {"uid": Connection(s1_id=2, s2_id="b", uid=cc.uid),
+                 "s1_id": Connection(s1_id=1, s2_id="b"),
+                 "s2_id": Connection(s1_id=2, s2_id="a")}[duplicate]
+        assert not await backend.add_new_connection(other)
+        assert (await backend.get_connection(SentBy.s1, 1)).uid == cc.uid
+        assert (await backend.get_connection(SentBy.s2, "a")).uid == cc.uid
+        assert await backend.get_connection(SentBy.s1, 2) is None
+        assert await backend.get_connection(SentBy.s2, "b") is None
+
+    run(main())
+
+
+def test_commit_to_unknown_uid(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        assert await backend.add_new_connection(cc)
+        unknown = Connection(s1_id=2, s2_id="b")
+        results = await backend.commit_message_batch([Message(cc, SentBy.s1, "saved"),
+                                                      Message(unknown, SentBy.s1, "lost")])
+        assert results == [True, False]
+        assert [m.content for m in await backend.get_history(cc)] == ["saved"]
+        assert await backend.get_history(unknown) == []
+
+    run(main())
+
+
+def test_history_pages(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = await _add_with_messages(backend, 1, 25)
+        other = await _add_with_messages(backend, 2, 3)
+        latest = await backend.get_history(cc, 10)
+        assert [m.content for m in latest] == [f"message {i}" for i in range(15, 25)]
+        assert [m.sent_by for m in latest] == [SentBy(i % 2) for i in range(15, 25)]
+        ids = [m.history_id for m in latest]
+        assert ids == sorted(ids)
+        assert all(m.uid == cc.uid for m in latest)
+
+        contents = []
+        before_id = None
+        while True:
+            page = await backend.get_history(cc, 10, before_id)
+            contents[:0] = [m.content for m in page]
+            if len(page) < 10:
+                break
+            before_id = page[0].history_id
+        assert contents == [f"message {i}" for i in range(25)]
+        assert [m.content for m in await backend.get_history(other, 50)] == ["message 0", "message 1", "message 2"]
+
+    run(main())
+
+
+def test_before_id(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = await _add_with_messages(backend, 1, 10)
+        history = await backend.get_history(cc, 50)
+        middle = history[5].history_id
+        assert [m.history_id for m in await backend.get_history(cc, 50, middle)] == \
+               [m.history_id for m in history[:5]]
+        assert [m.history_id for m in await backend.get_history(cc, 2, middle)] == \
+               [m.history_id for m in history[3:5]]
+        assert await backend.get_history(cc, 50, history[0].history_id) == []
+        # an id which isn't in the history of the connection
+        assert len(await backend.get_history(cc, 50, history[-1].history_id + 1000)) == 10
+
+    run(main())
+
+
+def test_created_at(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        assert await backend.add_new_connection(cc)
+        message = Message(cc, SentBy.s1, "now")
+        await backend.commit_message_batch([message])
+        saved, = await backend.get_history(cc)
+        # the text format keeps seconds
+        assert abs(saved.created_at - message.created_at) < timedelta(seconds=1)
+
+    run(main())
+
+
+def test_properties(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        cc["name"] = "first"
+        assert await backend.add_new_connection(cc)
+        assert (await backend.get_connection(SentBy.s1, 1))["name"] == "first"
+
+        cc["name"] = "second"
+        cc["tags"] = ["a", "b"]
+        unknown = Connection(s1_id=2, s2_id="b")
+        assert await backend.update_properties([(cc, cc.dump_properties()),
+                                                (unknown, json.dumps({"x": 1}))]) == [True, False]
+        found = await backend.get_connection(SentBy.s2, "a")
+        assert (found["name"], found["tags"]) == ("second", ["a", "b"])
+
+    run(main())
+
+
+def test_iter_client_ids(open_backend):
+    backend = open_backend()
+
+    async def main():
+        ccs = [Connection(s1_id=i, s2_id=f"s2-{i}") for i in range(5)]
+        for cc in ccs:
+            assert await backend.add_new_connection(cc)
+        rows = [row async for batch in backend.iter_client_ids(2) for row in batch]
+        assert sorted(rows) == sorted((cc.uid, str(cc.s1_id), cc.s2_id) for cc in ccs)
+
+    run(main())
+
+
+def test_reopen(open_backend):
+    backend = open_backend()
+
+    async def write():
+        cc = await _add_with_messages(backend, 1, 5)
+        cc["name"] = "kept"
+        assert await backend.update_properties([(cc, cc.dump_properties())]) == [True]
+        return cc, [m.history_id for m in await backend.get_history(cc)]
+
+    cc, ids = run(write())
+    backend.close()
+    reopened = open_backend()
+
+    async def read():
+        found = await reopened.get_connection(SentBy.s1, 1)
+        assert (found.uid, found.s2_id, found["name"]) == (cc.uid, "s2-1", "kept")
+        history = await reopened.get_history(found)
+        assert [m.content for m in history] == [f"message {i}" for i in range(5)]
+        assert [m.history_id for m in history] == ids
+        # new ids continue after the saved ones
+        await reopened.commit_message_batch([Message(found, SentBy.s2, "after reopen")])
+        last = (await reopened.get_history(found, 1))[0]
+        assert last.content == "after reopen" and last.history_id > ids[-1]
+        assert not await reopened.add_new_connection(Connection(s1_id=1, s2_id="other"))
+
+    run(read())
+
+
+def test_closed(open_backend):
+    backend = open_backend()
+    backend.close()
+    # closing twice is allowed
+    backend.close()
+    with pytest.raises(RuntimeError):
+        run(backend.commit_message_batch([]))
+
+
+def test_history_during_writes(open_backend):
+    backend = open_backend()
+
+    async def main():
+        cc = Connection(s1_id=1, s2_id="a")
+        assert await backend.add_new_connection(cc)
+
+        async def write():
+            for batch in range(50):
+                messages = [Message(cc, SentBy.s1, f"message {batch * 20 + i}") for i in range(20)]
+                assert await backend.commit_message_batch(messages) == [True] * 20
+
+        writer = asyncio.create_task(write())
+        while not writer.done():
+            history = await backend.get_history(cc, 1000)
+            # whole batches only, in order
+            assert len(history) % 20 == 0
+            assert [m.content for m in history] == [f"message {i}" for i in range(len(history))]
+        await writer
+        assert len(await backend.get_history(cc, 1000)) == 1000
+
+    run(main())
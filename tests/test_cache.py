@@ -0,0 +1,144 @@
+"""
+Tests of `LRUCache` and of the lookup caches of `SQLSession` which use it.
+
+    python -m pytest tests
+"""
+import threading
+
+import pytest
+
+from chatbox50 import Connection, SentBy
+from chatbox50 import cache as cache_module
+from chatbox50.cache import LRUCache
+from chatbox50.db_session import SQLSession
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(3)
+    for key in "abc":
+        cache.put(key, key.upper())
+    # "a" becomes the most recently used
+    assert cache.get("a") == "A"
+    cache.put("d", "D")
+    assert len(cache) == 3
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    stats = cache.stats()
+    assert (stats["size"], stats["maxsize"], stats["evictions"]) == (3, 3, 1)
+    assert (stats["hits"], stats["misses"]) == (4, 1)
+
+
+def test_put_replaces_and_refreshes():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 3)
+    cache.put("c", 4)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (3, None, 4)
+
+
+def test_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(10, ttl=5)
+    cache.put("a", 1)
+    clock.now += 4
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a", "missing") == "missing"
+    assert "a" not in cache
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate_and_clear():
+    cache = LRUCache(10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.invalidate("a")
+    assert not cache.invalidate("a")
+    assert "a" not in cache and "b" in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_invalid_maxsize():
+    with pytest.raises(ValueError):
+        LRUCache(0)
+
+
+def test_threads_keep_the_bound():
+    cache = LRUCache(100)
+
+    def fill(offset: int):
+        for i in range(2000):
+            cache.put(offset + i, i)
+            cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=fill, args=(n * 10000,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats["size"] == 100
+    assert stats["evictions"] == 4 * 2000 - 100
+    assert stats["hits"] + stats["misses"] == 4 * 2000
+
+
+@pytest.fixture
+def session():
+    session = SQLSession("cache", int, str, init=True, debug=True, lookup_cache_size=2)
+    yield session
+    session.close()
+
+
+def _stats(session: SQLSession, name: str) -> dict:
+    return next(stats for stats in session.cache_stats() if stats["name"] == name)
+
+
+def test_session_caches_lookups(session):
+    cc = Connection(s1_id=1, s2_id="a")
+    assert session.add_new_connection(cc)
+    for _ in range(3):
+        assert session.get_connection(SentBy.s1, 1).uid == cc.uid
+    assert (_stats(session, "client")["hits"], _stats(session, "client")["misses"]) == (2, 1)
+    # the uid -> client id entry is put when the connection is added
+    assert session._get_client_id_from_uid(cc.uid) is not None
+    assert _stats(session, "client_id")["hits"] == 1
+
+
+def test_session_cache_is_bounded(session):
+    for i in range(5):
+        assert session.add_new_connection(Connection(s1_id=i, s2_id=f"s2-{i}"))
+        session.get_connection(SentBy.s1, i)
+    stats = _stats(session, "client")
+    assert (stats["size"], stats["evictions"]) == (2, 3)
+
+
+def test_misses_are_not_cached(session):
+    assert session.get_connection(SentBy.s1, 1) is None
+    assert session.get_connection(SentBy.s2, "a") is None
+    cc = Connection(s1_id=1, s2_id="a")
+    assert session.add_new_connection(cc)
+    assert session.get_connection(SentBy.s1, 1).uid == cc.uid
+    assert session.get_connection(SentBy.s2, "a").uid == cc.uid
+
+
+def test_properties_update_invalidates(session):
+    cc = Connection(s1_id=1, s2_id="a")
+    cc["name"] = "first"
+    assert session.add_new_connection(cc)
+    assert session.get_connection(SentBy.s1, 1)["name"] == "first"
+    assert session.get_connection(SentBy.s2, "a")["name"] == "first"
+    cc["name"] = "second"
+    assert session.update_properties([(cc, cc.dump_properties())]) == [True]
+    assert session.get_connection(SentBy.s1, 1)["name"] == "second"
+    assert session.get_connection(SentBy.s2, "a")["name"] == "second"
@@ -0,0 +1,137 @@
+"""
+Tests of the message path of `ChatBox`: ServiceWorker -> broker -> storage and the other ServiceWorker.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+
+import pytest
+
+from chatbox50 import ChatBox, SentBy
+from chatbox50.db_session import SQLSession
+
+
+async def _stop(cb: ChatBox, tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.wait(tasks)
+    cb.close()
+
+
+def _new_chatbox(path: str, **kwargs) -> ChatBox:
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, write_delay=0.01, **kwargs)
+    cb.get_worker2.set_create_callback(lambda s1_id: f"s2-{s1_id}")
+    return cb
+
+
+def test_raising_callback_does_not_stop_the_broker(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    cb = _new_chatbox(path)
+    w1, w2 = cb.get_worker1, cb.get_worker2
+    received = []
+
+    def on_message(msg):
+        if msg.content == "bad":
+            raise RuntimeError("user bug")
+        received.append(msg.content)
+
+    w2.set_received_message_callback(on_message)
+
+    async def main():
+        tasks = cb.run()
+        try:
+            await w1.access_new_client(1)
+            await w1.access_new_client(2)
+            await w1.get_msg_sender(1)("bad")
+            await w1.get_msg_sender(2)("good")
+            await w1.get_msg_sender(1)("after")
+            for _ in range(3):
+                await asyncio.wait_for(w2.receive_queue.get(), 5)
+            assert received == ["good", "after"]
+            assert not any(task.done() for task in tasks if task.get_name().startswith("broker"))
+            client_queue = w2.get_client_queue("s2-1")
+            assert [client_queue.get_nowait().content for _ in range(2)] == ["bad", "after"]
+            # wait for the group commit
+            await asyncio.sleep(0.1)
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
+    stats = next(s for s in cb.callback_stats() if s["name"].endswith("received_message"))
+    assert (stats["calls"], stats["errors"]) == (3, 1)
+    session = SQLSession(path, int, str)
+    assert sorted(row[0] for row in session("SELECT content FROM history")) == ["after", "bad", "good"]
+    session.close()
+
+
+async def _wait_for_id_index(cb: ChatBox):
+    while not cb.id_index_stats()["ready"]:
+        await asyncio.sleep(0.01)
+
+
+def test_concurrent_accesses_share_the_saved_connection(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    cb = _new_chatbox(path)
+    w1, w2 = cb.get_worker1, cb.get_worker2
+
+    async def main():
+        tasks = cb.run()
+        try:
+            await _wait_for_id_index(cb)
+            # both miss the index, and the second one to be saved is rejected by the storage
+            assert await asyncio.gather(w1.access_new_client(1), w1.access_new_client(1)) == [1, 1]
+            saved = await cb.find_connection(SentBy.s1, 1)
+            assert w1.get_connection(1).uid == w2.get_connection("s2-1").uid == saved.uid
+            await w1.get_msg_sender(1)("hello")
+            await asyncio.wait_for(w2.receive_queue.get(), 5)
+            await asyncio.sleep(0.1)
+            assert [m.content for m in await w1.get_connection(1).history()] == ["hello"]
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
+
+
+def test_used_service_id_of_the_other_side_is_rejected(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    cb = _new_chatbox(path)
+    w1 = cb.get_worker1
+    cb.get_worker2.set_create_callback(lambda s1_id: "same")
+
+    async def main():
+        tasks = cb.run()
+        try:
+            await _wait_for_id_index(cb)
+            await w1.access_new_client(1)
+            with pytest.raises(ValueError):
+                await w1.access_new_client(2)
+            assert w1.get_connection(2) is None
+            assert await cb.find_connection(SentBy.s1, 2) is None
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
+
+
+def test_hibernating_one_side_keeps_the_messages_of_the_other(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    cb = _new_chatbox(path)
+    w1, w2 = cb.get_worker1, cb.get_worker2
+
+    async def main():
+        tasks = cb.run()
+        try:
+            await w1.access_new_client(1)
+            await w1.get_msg_sender(1)("hello")
+            await asyncio.wait_for(w2.receive_queue.get(), 5)
+            cc = w1.get_connection(1)
+            assert w1.hibernate_client(1)
+            # service 2 still serves the connection
+            assert [m.content for m in cc.messages] == ["hello"]
+            assert w2.hibernate_client("s2-1")
+            assert list(cc.messages) == []
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
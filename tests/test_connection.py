@@ -0,0 +1,102 @@
+"""
+Tests of the properties of `Connection` and of `PropertyFlusher`, which saves them.
+
+    python -m pytest tests
+"""
+import asyncio
+import json
+
+import pytest
+
+from chatbox50 import Connection
+from chatbox50.property_flusher import PropertyFlusher
+
+
+@pytest.mark.parametrize("key", [1, None, ("a",), b"a"])
+def test_key_must_be_str(key):
+    cc = Connection(s1_id=1, s2_id="a")
+    with pytest.raises(TypeError, match="property key must be `str`"):
+        cc[key] = "value"
+    assert not cc.properties_dirty
+
+
+@pytest.mark.parametrize("value", [{1, 2}, object(), b"bytes"])
+def test_value_must_be_serializable(value):
+    cc = Connection(s1_id=1, s2_id="a")
+    with pytest.raises(TypeError):
+        cc["key"] = value
+    assert not cc.properties_dirty
+    with pytest.raises(KeyError):
+        cc["key"]
+
+
+def test_dirty_until_dumped():
+    marked = []
+    cc = Connection(s1_id=1, s2_id="a")
+    cc.set_properties_listener(marked.append)
+    cc["name"] = "first"
+    cc["tags"] = ["a"]
+    # told once until it is saved
+    assert marked == [cc]
+    assert json.loads(cc.dump_properties()) == {"name": "first", "tags": ["a"]}
+    assert not cc.properties_dirty
+    del cc["name"]
+    assert marked == [cc, cc]
+    assert json.loads(cc.dump_properties()) == {"tags": ["a"]}
+
+
+def test_value_changed_in_place_stays_dirty():
+    cc = Connection(s1_id=1, s2_id="a")
+    cc["tags"] = []
+    cc["tags"].append({1, 2})
+    with pytest.raises(TypeError):
+        cc.dump_properties()
+    assert cc.properties_dirty
+
+
+def test_flusher_retries_what_wasnt_saved():
+    calls = []
+    results = [[False, True], [True]]
+
+    async def update(items):
+        calls.append([(cc.s1_id, json.loads(properties)) for cc, properties in items])
+        return results.pop(0)
+
+    flusher = PropertyFlusher(update, interval=1)
+    first, second = Connection(s1_id=1, s2_id="a"), Connection(s1_id=2, s2_id="b")
+    for cc in (first, second):
+        cc.set_properties_listener(flusher.mark)
+        cc["n"] = cc.s1_id
+
+    async def main():
+        assert await flusher.flush() == 1
+        assert (first.properties_dirty, second.properties_dirty) == (True, False)
+        assert await flusher.flush() == 1
+        assert await flusher.flush() == 0
+
+    asyncio.run(main())
+    assert calls == [[(1, {"n": 1}), (2, {"n": 2})], [(1, {"n": 1})]]
+
+
+def test_flusher_retries_what_can_not_be_dumped():
+    saved = []
+
+    async def update(items):
+        saved.extend(cc.s1_id for cc, _ in items)
+        return [True] * len(items)
+
+    flusher = PropertyFlusher(update, interval=1)
+    cc = Connection(s1_id=1, s2_id="a")
+    cc.set_properties_listener(flusher.mark)
+    cc["tags"] = []
+    cc["tags"].append({1})
+
+    async def main():
+        assert await flusher.flush() == 0
+        assert len(flusher) == 1
+        cc["tags"] = [1]
+        assert await flusher.flush() == 1
+        assert len(flusher) == 0
+
+    asyncio.run(main())
+    assert saved == [1]
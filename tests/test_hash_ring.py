@@ -0,0 +1,63 @@
+"""
+Tests of the consistent hashing of `HashRing`.
+
+    python -m pytest tests
+"""
+from uuid import UUID, uuid4
+
+import pytest
+
+from chatbox50.hash_ring import HashRing
+
+UIDS = [UUID(int=i * 7919 + 1) for i in range(3000)]
+
+
+def _placement(ring: HashRing) -> dict[UUID, str]:
+    return {uid: ring.get(uid) for uid in UIDS}
+
+
+def test_placement_depends_only_on_the_nodes():
+    nodes = ["a", "b", "c"]
+    # the order in which the nodes are added doesn't matter
+    assert _placement(HashRing(nodes)) == _placement(HashRing(list(reversed(nodes))))
+
+
+def test_uids_are_spread():
+    placement = _placement(HashRing(["a", "b", "c", "d"]))
+    counts = [list(placement.values()).count(node) for node in "abcd"]
+    assert all(len(UIDS) / 4 * 0.6 < count < len(UIDS) / 4 * 1.4 for count in counts)
+
+
+def test_adding_moves_only_to_the_new_node():
+    ring = HashRing(["a", "b", "c"])
+    before = _placement(ring)
+    ring.add("d")
+    after = _placement(ring)
+    moved = [uid for uid in UIDS if before[uid] != after[uid]]
+    assert moved and all(after[uid] == "d" for uid in moved)
+    assert len(moved) < len(UIDS) / 2
+
+
+def test_removing_moves_only_from_the_removed_node():
+    ring = HashRing(["a", "b", "c"])
+    before = _placement(ring)
+    ring.remove("b")
+    after = _placement(ring)
+    assert all(before[uid] == after[uid] for uid in UIDS if before[uid] != "b")
+    assert "b" not in after.values()
+    # adding it back restores the placement
+    ring.add("b")
+    assert _placement(ring) == before
+
+
+def test_nodes():
+    ring = HashRing(["a"], vnodes=4)
+    ring.add("a")
+    ring.remove("missing")
+    assert len(ring) == 1 and "a" in ring and ring.nodes == {"a"}
+    assert ring.get(uuid4()) == "a"
+    ring.remove("a")
+    with pytest.raises(LookupError):
+        ring.get(uuid4())
+    with pytest.raises(ValueError):
+        HashRing(vnodes=0)
@@ -0,0 +1,155 @@
+"""
+Tests of `IdIndex` and of the lookups of `ChatBox` which it answers.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+
+from chatbox50 import AsyncSQLSession, ChatBox, Connection, SentBy
+from chatbox50.db_session import SQLSession
+from chatbox50.id_index import BloomFilter, IdIndex
+
+
+def _save_clients(path: str, count: int):
+    session = SQLSession(path, int, str, init=True, wal=True)
+    for i in range(count):
+        assert session.add_new_connection(Connection(s1_id=i, s2_id=f"s2-{i}"))
+    session.close()
+
+
+async def _stop(cb: ChatBox, tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.wait(tasks)
+    cb.close()
+
+
+def test_load_leaves_readers_free(tmp_path):
+    # more clients than one batch of the load, and a single read connection which the load must give back
+    path = os.path.join(tmp_path, "chatbox")
+    _save_clients(path, 5000)
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, wal=True, db_readers=1)
+
+    async def main():
+        tasks = cb.run()
+        try:
+            while cb.id_index_stats()["ids"] == 0:
+                await asyncio.sleep(0)
+            found = await asyncio.wait_for(cb.find_connection(SentBy.s1, 4999), 5)
+            assert found.s2_id == "s2-4999"
+            while not cb.id_index_stats()["ready"]:
+                await asyncio.wait_for(cb.find_connection(SentBy.s2, "s2-0"), 5)
+            assert cb.id_index_stats()["ids"] == 5000
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f"key-{i}".encode() for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert bloom.count == 1000
+    false_positives = sum(f"other-{i}".encode() in bloom for i in range(10000))
+    # 1% at capacity, with room for chance
+    assert false_positives < 300
+
+
+@pytest.mark.parametrize("capacity, error_rate", [(0, 0.01), (10, 0), (10, 1)])
+def test_bloom_filter_invalid_arguments(capacity, error_rate):
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, error_rate)
+
+
+@pytest.mark.parametrize("keep_uids", [True, False])
+def test_id_index(keep_uids):
+    # a small capacity, so that the filters are chained
+    index = IdIndex(capacity=16, keep_uids=keep_uids)
+    loaded = [(uuid4(), str(i), f"s2-{i}") for i in range(100)]
+    assert index.load(loaded) == 100
+    # every id may exist until the load is finished
+    assert index.might_exist(SentBy.s1, 1000)
+    index.ready = True
+    added = uuid4()
+    index.add(added, 1000, "s2-1000")
+    for uid, s1_key, s2_key in loaded + [(added, "1000", "s2-1000")]:
+        assert index.might_exist(SentBy.s1, int(s1_key))
+        assert index.might_exist(SentBy.s2, s2_key)
+        assert index.get_uid(SentBy.s1, int(s1_key)) == (uid if keep_uids else None)
+    stats = index.stats()
+    assert (stats["ids"], stats["uids"]) == (101, 101 if keep_uids else 0)
+    assert (stats["filters"] > 1) == (not keep_uids)
+    assert (stats["maybe_saved"], stats["definitely_new"]) == (202, 0)
+    new = sum(not index.might_exist(SentBy.s1, i) for i in range(5000, 6000))
+    if keep_uids:
+        assert new == 1000
+    else:
+        # the filters answer "maybe" for their false positives
+        assert new > 900
+    assert index.definitely_new == new
+
+
+class CountingSQLSession(AsyncSQLSession):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = 0
+
+    async def get_connection(self, sent_by: SentBy, service_id):
+        self.lookups += 1
+        return await super().get_connection(sent_by, service_id)
+
+
+@pytest.mark.parametrize("keep_uids", [True, False])
+def test_find_connection_skips_storage_for_new_ids(tmp_path, keep_uids):
+    path = os.path.join(tmp_path, "chatbox")
+    _save_clients(path, 10)
+    backend = CountingSQLSession(path, int, str)
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, backend=backend, id_index_uids=keep_uids)
+    cb.get_worker2.set_create_callback(lambda s1_id: f"s2-{s1_id}")
+
+    async def main():
+        tasks = cb.run()
+        try:
+            while not cb.id_index_stats()["ready"]:
+                await asyncio.sleep(0.01)
+            assert await cb.find_connection(SentBy.s1, 100) is None
+            assert await cb.find_connection(SentBy.s2, "s2-100") is None
+            assert backend.lookups == 0
+            assert cb.id_index_stats()["definitely_new"] == 2
+            # saved ones are still looked up
+            assert (await cb.find_connection(SentBy.s1, 3)).s2_id == "s2-3"
+            assert backend.lookups == 1
+            # a connection created after the load is added to the index
+            await cb.get_worker1.access_new_client(100)
+            assert (await cb.find_connection(SentBy.s1, 100)).s2_id == "s2-100"
+            assert cb.id_index_stats()["ids"] == 11
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
+
+
+def test_find_connection_without_index(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    _save_clients(path, 1)
+    backend = CountingSQLSession(path, int, str)
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, backend=backend, id_index=False)
+
+    async def main():
+        tasks = cb.run()
+        try:
+            assert cb.id_index_stats() is None
+            assert await cb.find_connection(SentBy.s1, 100) is None
+            assert (await cb.find_connection(SentBy.s1, 0)).s2_id == "s2-0"
+            assert backend.lookups == 2
+        finally:
+            await _stop(cb, tasks)
+
+    asyncio.run(main())
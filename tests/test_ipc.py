@@ -0,0 +1,200 @@
+"""
+Tests of the framing of `chatbox50.ipc` and of `IpcPeer` requests and notifications.
+
+    python -m pytest tests
+"""
+import asyncio
+import socket
+from datetime import datetime
+
+import pytest
+
+from chatbox50 import Connection, Message, SentBy
+from chatbox50.ipc import FRAME_HEADER, MAX_FRAME_SIZE, IpcError, IpcPeer, decode_connection, decode_message, \
+    encode_connection, encode_frame, encode_message, read_frame
+
+
+def _reader(data: bytes, eof: bool = True) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def test_frames_round_trip():
+    frames = [{"req": 1, "method": "send", "params": {"content": "こんにちは ✓"}}, {"reply": 1, "result": None}, {}]
+
+    async def main():
+        reader = _reader(b"".join(encode_frame(frame) for frame in frames))
+        assert [await read_frame(reader) for _ in frames] == frames
+        assert await read_frame(reader) is None
+
+    asyncio.run(main())
+
+
+def test_frame_header():
+    data = encode_frame({"content": "é"})
+    (size,) = FRAME_HEADER.unpack(data[:FRAME_HEADER.size])
+    assert size == len(data) - FRAME_HEADER.size
+    # the payload is UTF-8, not escaped
+    assert "é".encode("utf-8") in data
+
+
+def test_incomplete_frames():
+    async def main():
+        data = encode_frame({"content": "cut"})
+        # a stream which ends in the header is the end of the stream
+        assert await read_frame(_reader(data[:2])) is None
+        # but a stream which ends in the payload is an error
+        with pytest.raises(asyncio.IncompleteReadError):
+            await read_frame(_reader(data[:-1]))
+
+    asyncio.run(main())
+
+
+def test_frame_split_between_reads():
+    async def main():
+        data = encode_frame({"content": "split"})
+        reader = _reader(data[:3], eof=False)
+        pending = asyncio.create_task(read_frame(reader))
+        await asyncio.sleep(0)
+        assert not pending.done()
+        reader.feed_data(data[3:])
+        assert await pending == {"content": "split"}
+
+    asyncio.run(main())
+
+
+def test_too_large_frame():
+    async def main():
+        with pytest.raises(IpcError):
+            await read_frame(_reader(FRAME_HEADER.pack(MAX_FRAME_SIZE + 1)))
+
+    asyncio.run(main())
+
+
+def test_connection_and_message_round_trip():
+    cc = Connection(s1_id=1, s2_id="s2-1")
+    msg = Message(cc, SentBy.s2, "hello", created_at=datetime(2024, 5, 1, 12, 30, 15, 123456), history_id=7,
+                  trace_id="trace", seq=3)
+    decoded_cc = decode_connection(encode_connection(cc), int, str)
+    assert (decoded_cc.uid, decoded_cc.s1_id, decoded_cc.s2_id) == (cc.uid, 1, "s2-1")
+    decoded = decode_message(encode_message(msg), decoded_cc)
+    assert (decoded.uid, decoded.sent_by, decoded.content, decoded.created_at, decoded.history_id, decoded.seq,
+            decoded.trace_id) == (cc.uid, SentBy.s2, "hello", msg.created_at, 7, 3, "trace")
+
+
+async def _pair(**handlers) -> tuple[IpcPeer, IpcPeer]:
+    left_sock, right_sock = socket.socketpair()
+    left = IpcPeer(*await asyncio.open_connection(sock=left_sock), "left")
+    right = IpcPeer(*await asyncio.open_connection(sock=right_sock), "right", **handlers)
+    left.run()
+    right.run()
+    return left, right
+
+
+async def _close(*peers: IpcPeer):
+    for peer in peers:
+        peer.close()
+    await asyncio.gather(*(peer.task for peer in peers), return_exceptions=True)
+
+
+def test_requests():
+    async def handle(method, params):
+        if method == "fail":
+            raise KeyError(params["key"])
+        if method == "slow":
+            await asyncio.sleep(params["delay"])
+        return {"method": method, "params": params}
+
+    async def main():
+        left, right = await _pair(request_handler=handle)
+        try:
+            assert await left.request("echo", value=[1, "two"]) == {"method": "echo", "params": {"value": [1, "two"]}}
+            with pytest.raises(IpcError, match="missing"):
+                await left.request("fail", key="missing")
+            # requests are handled concurrently, the fast one is answered first
+            slow = asyncio.create_task(left.request("slow", delay=0.1))
+            assert (await left.request("slow", delay=0))["params"] == {"delay": 0}
+            assert not slow.done()
+            assert (await slow)["params"] == {"delay": 0.1}
+            # left has no request handler
+            with pytest.raises(IpcError):
+                await right.request("echo")
+        finally:
+            await _close(left, right)
+
+    asyncio.run(main())
+
+
+def test_handler_can_request_the_other_end():
+    async def main():
+        left, right = await _pair()
+
+        async def on_left(method, params):
+            return params["value"] * 2
+
+        async def on_right(method, params):
+            return await right.request("double", value=params["value"]) + 1
+
+        left.request_handler = on_left
+        right.request_handler = on_right
+        try:
+            assert await left.request("double_plus_one", value=5) == 11
+        finally:
+            await _close(left, right)
+
+    asyncio.run(main())
+
+
+def test_notifications_in_order():
+    received = []
+
+    async def handle(method, params):
+        if params["i"] == 3:
+            raise ValueError("logged and skipped")
+        # a slow handler doesn't let the next notification overtake it
+        await asyncio.sleep(0.001 * (10 - params["i"]))
+        received.append(params["i"])
+
+    async def main():
+        left, right = await _pair(notification_handler=handle)
+        try:
+            for i in range(10):
+                left.notify("count", i=i)
+            await left.drain()
+            # right has no request handler, its error reply is sent after the notifications are handled
+            with pytest.raises(IpcError):
+                await left.request("after")
+            assert received == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+            assert not right.closed
+        finally:
+            await _close(left, right)
+
+    asyncio.run(main())
+
+
+def test_lost_connection_fails_pending_requests():
+    async def main():
+        entered = asyncio.Event()
+
+        async def handle(method, params):
+            entered.set()
+            await asyncio.sleep(10)
+
+        left, right = await _pair(request_handler=handle)
+        pending = asyncio.create_task(left.request("never"))
+        await entered.wait()
+        right.close()
+        with pytest.raises(IpcError, match="lost"):
+            await asyncio.wait_for(pending, 1)
+        await asyncio.wait_for(left.task, 1)
+        assert left.closed
+        with pytest.raises(IpcError):
+            await left.request("closed")
+        with pytest.raises(IpcError):
+            left.notify("closed")
+        await _close(left, right)
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Tests of `ShardSupervisor`: connections are placed on the shard processes by uid, and calls are routed to the shard
+which has the connection.
+
+    python -m pytest tests
+"""
+import asyncio
+import itertools
+import os
+from uuid import uuid4
+
+import pytest
+
+from chatbox50.multiprocess import ShardSupervisor
+
+
+def test_invalid_arguments(tmp_path):
+    with pytest.raises(ValueError):
+        ShardSupervisor(name=os.path.join(tmp_path, "box"), shards=0)
+    with pytest.raises(TypeError):
+        ShardSupervisor(name=os.path.join(tmp_path, "box"), shards=1, backend=object())
+
+
+async def _wait_for(condition, timeout: float = 10):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+def test_routing(tmp_path):
+    name = os.path.join(tmp_path, "box")
+    supervisor = ShardSupervisor(name=name, shards=2, s2_id_type=int)
+    w1, w2 = supervisor.get_worker1, supervisor.get_worker2
+    ids = itertools.count(1)
+    w2.set_create_callback(lambda s1_id: next(ids))
+    received = []
+    w2.set_received_message_callback(lambda msg: received.append((msg.chat_client.s2_id, msg.content)))
+
+    async def main():
+        tasks = await supervisor.start()
+        try:
+            s1_ids = [await w1.access_new_client() for _ in range(20)]
+            routes = [w1._routes[s1_id] for s1_id in s1_ids]
+            # every connection is on the shard of its uid, and the uids are spread over both shards
+            assert routes == [supervisor.place(w1.get_connection(s1_id).uid) for s1_id in s1_ids]
+            assert set(routes) == {0, 1}
+            for s1_id in s1_ids:
+                s2_id = w1.get_connection(s1_id).s2_id
+                # the shard told the other worker about the new connection
+                assert w2._routes[s2_id] == w1._routes[s1_id]
+                await w1.get_msg_sender(s1_id)(f"hello {s2_id}")
+            await _wait_for(lambda: len(received) == 20)
+            assert sorted(received) == [(s2_id, f"hello {s2_id}") for s2_id in range(1, 21)]
+
+            # a reply goes back through the same shard to the client queue of service1, after the own message
+            first = s1_ids[0]
+            s2_id = w1.get_connection(first).s2_id
+            await w2.send_many(s2_id, ["pong", "again"])
+            client_queue = w1.get_client_queue(first)
+            assert [(await asyncio.wait_for(client_queue.get(), 5)).content for _ in range(3)] == \
+                   [f"hello {s2_id}", "pong", "again"]
+
+            # deactivate and access the saved connection again: it is found on the same shard
+            w1.deactivate_client(first)
+            await _wait_for(lambda: w2.get_connection(s2_id) is None)
+            assert await w1.access_new_client(first, create_client_if_no_exist=False) == first
+            assert w1._routes[first] == routes[0]
+            assert await w1.access_new_client(uuid4(), create_client_if_no_exist=False) is None
+
+            shard_stats = [s["name"] for s in await supervisor.queue_stats()]
+            assert any(s.startswith(f"{name}-shard0.") for s in shard_stats)
+            assert any(s.startswith(f"{name}-shard1.") for s in shard_stats)
+        finally:
+            await supervisor.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    # each shard has its own database
+    assert {file_name for file_name in os.listdir(tmp_path) if file_name.endswith(".db")} == \
+           {"box-shard0.db", "box-shard1.db"}
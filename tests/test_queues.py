@@ -0,0 +1,154 @@
+"""
+Tests of `BoundedQueue`, its overflow policies and counters, and of the default limits of the pipeline.
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from chatbox50 import OverflowPolicy, QueueConfig, QueueDisconnected, QueueLimits
+from chatbox50.queues import BoundedQueue, QueueStats, drain_batch
+
+
+def _filled(policy: OverflowPolicy, maxsize: int = 3, **kwargs) -> BoundedQueue:
+    que = BoundedQueue(QueueConfig(maxsize, policy), "test", **kwargs)
+    for i in range(maxsize):
+        que.put_nowait(i)
+    return que
+
+
+def _items(que: BoundedQueue) -> list:
+    return [que.get_nowait() for _ in range(que.qsize())]
+
+
+def test_block_waits_for_space():
+    async def main():
+        que = _filled(OverflowPolicy.block)
+        put = asyncio.create_task(que.put(3))
+        await asyncio.sleep(0)
+        assert not put.done()
+        assert que.get_nowait() == 0
+        await asyncio.wait_for(put, 1)
+        assert _items(que) == [1, 2, 3]
+        assert que.stats.dropped == 0
+
+    asyncio.run(main())
+
+
+def test_block_put_nowait_raises():
+    que = _filled(OverflowPolicy.block)
+    with pytest.raises(asyncio.QueueFull):
+        que.put_nowait(3)
+
+
+def test_drop_oldest():
+    async def main():
+        que = _filled(OverflowPolicy.drop_oldest)
+        await que.put(3)
+        que.put_nowait(4)
+        assert _items(que) == [2, 3, 4]
+        assert que.stats.dropped == 2
+
+    asyncio.run(main())
+
+
+def test_drop_newest():
+    async def main():
+        que = _filled(OverflowPolicy.drop_newest)
+        await que.put(3)
+        que.put_nowait(4)
+        assert _items(que) == [0, 1, 2]
+        assert que.stats.dropped == 2
+
+    asyncio.run(main())
+
+
+def test_disconnect():
+    disconnected = []
+
+    async def main():
+        que = _filled(OverflowPolicy.disconnect, on_disconnect=lambda: disconnected.append(True))
+        await que.put(3)
+        assert que.disconnected and disconnected == [True]
+        # the 3 items and the one which didn't fit
+        assert que.stats.dropped == 4
+        assert (que.stats.disconnects, que.depth) == (1, 0)
+        with pytest.raises(QueueDisconnected):
+            await que.get()
+        with pytest.raises(QueueDisconnected):
+            que.get_nowait()
+        que.put_nowait(5)
+        assert que.stats.dropped == 5
+        # disconnected once
+        que.disconnect()
+        assert que.stats.disconnects == 1
+
+    asyncio.run(main())
+
+
+def test_disconnect_wakes_the_consumer():
+    async def main():
+        que = BoundedQueue(QueueConfig(1, OverflowPolicy.disconnect), "test")
+        consumer = asyncio.create_task(que.get())
+        await asyncio.sleep(0)
+        assert que.waiting_getters == 1
+        que.disconnect()
+        with pytest.raises(QueueDisconnected):
+            await asyncio.wait_for(consumer, 1)
+
+    asyncio.run(main())
+
+
+def test_high_water_and_puts():
+    que = BoundedQueue(QueueConfig(10), "test")
+    for i in range(4):
+        que.put_nowait(i)
+    _items(que)
+    que.put_nowait(4)
+    stats = que.stats.stats()
+    assert (stats["high_water"], stats["puts"], stats["depth"], stats["dropped"]) == (4, 5, 1, 0)
+    assert (stats["name"], stats["maxsize"], stats["policy"]) == ("test", 10, "block")
+
+
+def test_unbounded_never_drops():
+    que = BoundedQueue(QueueConfig(0, OverflowPolicy.drop_newest), "test")
+    for i in range(1000):
+        que.put_nowait(i)
+    assert que.stats.dropped == 0 and que.qsize() == 1000
+
+
+def test_shared_stats():
+    stats = QueueStats("group", QueueConfig(2, OverflowPolicy.drop_oldest))
+    queues = [BoundedQueue(stats.config, "member", stats) for _ in range(3)]
+    for que in queues:
+        for i in range(3):
+            que.put_nowait(i)
+    assert (stats.queues, stats.depth, stats.dropped, stats.high_water) == (3, 6, 3, 2)
+    queues[0].release()
+    assert (stats.queues, stats.depth) == (2, 4)
+
+
+def test_drain_batch():
+    que = BoundedQueue(QueueConfig(), "test")
+    for item in (1, [2, 3], 4, 5):
+        que.put_nowait(item)
+    assert drain_batch(0, que, 4) == [0, 1, 2, 3]
+    assert drain_batch([-1], que, 10) == [-1, 4, 5]
+    assert que.empty()
+
+
+def test_default_limits():
+    limits = QueueLimits()
+    # the queues of the clients and of every received message drop the oldest messages when nobody reads them
+    assert (limits.client.maxsize, limits.client.policy) == (1024, OverflowPolicy.drop_oldest)
+    assert (limits.receive_message.maxsize, limits.receive_message.policy) == (10000, OverflowPolicy.drop_oldest)
+    for config in (limits.upload, limits.send, limits.receive):
+        assert config.policy == OverflowPolicy.block
+
+
+def test_shared_queues_can_not_disconnect():
+    with pytest.raises(ValueError):
+        QueueLimits(upload=QueueConfig(10, OverflowPolicy.disconnect))
+    with pytest.raises(ValueError):
+        QueueConfig(-1)
@@ -0,0 +1,179 @@
+"""
+Tests of `ChatBoxServer` and `RemoteChatBox` over TCP on localhost: placement of connections on the nodes, and the
+shared token which every peer must give.
+
+    python -m pytest tests
+"""
+import asyncio
+import itertools
+import os
+
+import pytest
+
+from chatbox50 import ChatBox, ChatBoxServer, RemoteChatBox, SentBy
+from chatbox50.ipc import IpcError, IpcPeer
+
+TOKEN = "secret"
+
+
+class Nodes:
+    """
+    ChatBoxes served by ChatBoxServers on free ports of localhost.
+    """
+
+    def __init__(self, tmp_path, count: int):
+        self.boxes = [ChatBox(name=os.path.join(tmp_path, f"node{i}"), s1_id_type=int, s2_id_type=int,
+                              client_queues=False) for i in range(count)]
+        self.servers = [ChatBoxServer(cb, TOKEN) for cb in self.boxes]
+        self.addresses: list[tuple[str, int]] = []
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        for cb, server in zip(self.boxes, self.servers):
+            self.tasks += cb.run()
+            listening = await server.start(("127.0.0.1", 0))
+            self.addresses.append(listening.sockets[0].getsockname()[:2])
+
+    async def stop(self, *clusters: RemoteChatBox):
+        for cluster in clusters:
+            await cluster.close()
+        for server in self.servers:
+            await server.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for cb in self.boxes:
+            cb.close()
+
+
+async def _wait_for(condition, timeout: float = 5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+def test_token_is_required(tmp_path):
+    cb = ChatBox(name=os.path.join(tmp_path, "chatbox"))
+    try:
+        with pytest.raises(ValueError):
+            ChatBoxServer(cb, "")
+    finally:
+        cb.close()
+
+
+def test_placement_and_routing(tmp_path):
+    nodes = Nodes(tmp_path, 3)
+
+    async def main():
+        await nodes.start()
+        web = RemoteChatBox(nodes.addresses, TOKEN, s1_id_type=int, s2_id_type=int, services=[SentBy.s1])
+        bot = RemoteChatBox(nodes.addresses, TOKEN, s1_id_type=int, s2_id_type=int, services=[SentBy.s2])
+        w1, w2 = web.get_worker1, bot.get_worker2
+        ids = itertools.count(1000)
+        w2.set_create_callback(lambda s1_id: next(ids))
+        received = []
+        w2.set_received_message_callback(lambda msg: received.append(msg.content))
+        try:
+            await web.start()
+            await bot.start()
+            for s1_id in range(30):
+                assert await w1.access_new_client(s1_id) == s1_id
+                uid = w1.get_connection(s1_id).uid
+                node = w1._routes[s1_id]
+                # both processes place the uid on the same node, and only that node has the connection
+                assert node == web.place(uid) == bot.place(uid)
+                assert [cb.get_worker1.get_connection(s1_id) is not None for cb in nodes.boxes] == \
+                       [i == node for i in range(3)]
+                await w1.get_msg_sender(s1_id)(f"hello {s1_id}")
+            assert set(w1._routes.values()) == {0, 1, 2}
+            await _wait_for(lambda: len(received) == 30)
+            assert sorted(received) == sorted(f"hello {s1_id}" for s1_id in range(30))
+
+            s2_id = w1.get_connection(0).s2_id
+            assert w2._routes[s2_id] == w1._routes[0]
+            await w2.send_many(s2_id, ["pong"])
+            await _wait_for(lambda: len(w1.get_connection(0).messages) == 2)
+            # the history is read from the node once it has committed the messages
+            for _ in range(100):
+                history = [m.content for m in await w2.get_connection(s2_id).history(10)]
+                if len(history) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert history == ["hello 0", "pong"]
+
+            # a saved connection is found on its node again after it was deactivated
+            w1.deactivate_client(0)
+            await _wait_for(lambda: w2.get_connection(s2_id) is None)
+            assert await w1.access_new_client(0, create_client_if_no_exist=False) == 0
+            assert w1._routes[0] == web.place(w1.get_connection(0).uid)
+        finally:
+            await nodes.stop(web, bot)
+
+    asyncio.run(main())
+
+
+def test_wrong_token_is_rejected(tmp_path):
+    nodes = Nodes(tmp_path, 1)
+
+    async def main():
+        await nodes.start()
+        wrong = RemoteChatBox(nodes.addresses, "wrong", s1_id_type=int, s2_id_type=int, services=[SentBy.s1])
+        try:
+            with pytest.raises(IpcError, match="PermissionError"):
+                await wrong.start()
+            # the server didn't attach it
+            assert nodes.boxes[0].get_worker1._create_callback is None
+        finally:
+            await nodes.stop(wrong)
+
+    asyncio.run(main())
+
+
+def test_requests_before_auth_are_rejected(tmp_path):
+    nodes = Nodes(tmp_path, 1)
+
+    async def main():
+        await nodes.start()
+        host, port = nodes.addresses[0]
+        peer = IpcPeer(*await asyncio.open_connection(host, port), "unauthenticated")
+        peer.run()
+        try:
+            with pytest.raises(IpcError, match="PermissionError"):
+                await peer.request("attach", service=SentBy.s1)
+            # the server disconnects it
+            await asyncio.wait_for(peer.task, 5)
+            assert nodes.boxes[0].get_worker1._create_callback is None
+        finally:
+            peer.close()
+            await nodes.stop()
+
+    asyncio.run(main())
+
+
+def test_one_peer_per_service(tmp_path):
+    nodes = Nodes(tmp_path, 1)
+
+    async def main():
+        await nodes.start()
+
+        def new_cluster(service: SentBy) -> RemoteChatBox:
+            return RemoteChatBox(nodes.addresses, TOKEN, s1_id_type=int, s2_id_type=int, services=[service])
+
+        first, second, other = new_cluster(SentBy.s1), new_cluster(SentBy.s1), new_cluster(SentBy.s2)
+        third = new_cluster(SentBy.s1)
+        try:
+            await first.start()
+            with pytest.raises(IpcError, match="already attached"):
+                await second.start()
+            # the other service can be attached by another peer
+            await other.start()
+            # after the first peer is gone, the service can be attached again
+            await first.close()
+            await _wait_for(lambda: nodes.boxes[0].get_worker1._create_callback is None)
+            await third.start()
+        finally:
+            await nodes.stop(first, second, other, third)
+
+    asyncio.run(main())
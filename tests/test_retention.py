@@ -0,0 +1,174 @@
+"""
+Tests of `HistoryArchive` and `HistoryRetention`: where archives are written, their gzip NDJSON format, and reading
+history across the database and the archive.
+
+    python -m pytest tests
+"""
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+
+from chatbox50 import AsyncSQLSession, ChatBox, Connection, Message, RetentionPolicy, SentBy
+from chatbox50 import retention as retention_module
+from chatbox50.retention import HistoryArchive, HistoryRetention
+
+
+def _rows(uid, start_id: int, count: int, created_at: datetime) -> list[tuple]:
+    return [(start_id + i, uid, created_at + timedelta(minutes=i), f"message {start_id + i} ✓", i % 2)
+            for i in range(count)]
+
+
+def test_archives_stay_inside_archive_dir(tmp_path):
+    archive_dir = os.path.join(tmp_path, "archive")
+    name = os.path.join(tmp_path, "data", "chatbox")
+    archive = HistoryArchive(archive_dir, name)
+    archive.append(_rows(uuid4(), 1, 3, datetime(2024, 1, 31, 23, 58)))
+    assert sorted(os.listdir(archive_dir)) == ["chatbox-history-2024-01.ndjson.gz", "chatbox-history-2024-02.ndjson.gz"]
+    assert sorted(os.listdir(tmp_path)) == ["archive"]
+    assert archive.months() == [(2024, 2), (2024, 1)]
+
+
+def test_files_are_gzip_ndjson(tmp_path):
+    archive = HistoryArchive(str(tmp_path), "chatbox")
+    uid = uuid4()
+    created_at = datetime(2024, 3, 1, 12, 0, 0, 123456)
+    archive.append(_rows(uid, 1, 2, created_at))
+    # every append adds a gzip member
+    archive.append(_rows(uid, 3, 1, created_at))
+    with gzip.open(os.path.join(tmp_path, "chatbox-history-2024-03.ndjson.gz"), "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["id"] for record in records] == [1, 2, 3]
+    assert set(records[0]) == {"id", "uid", "created_at", "content", "sent_by"}
+    assert (records[0]["uid"], records[0]["content"], records[1]["sent_by"]) == (str(uid), "message 1 ✓", 1)
+
+
+def test_round_trip(tmp_path):
+    archive = HistoryArchive(str(tmp_path), "chatbox")
+    uid, other = uuid4(), uuid4()
+    rows = _rows(uid, 1, 5, datetime(2024, 1, 31, 23, 57)) + _rows(other, 6, 2, datetime(2024, 1, 1))
+    archive.append(rows)
+    records = archive.read(uid, 50)
+    assert [(r["id"], r["content"], r["sent_by"]) for r in records] == [(row[0], row[3], row[4]) for row in rows[:5]]
+    decoded = [retention_module.CompactCodec.decode_time(r["created_at"]) for r in records]
+    assert decoded == [row[2] for row in rows[:5]]
+    assert [r["id"] for r in archive.read(uid, 2)] == [4, 5]
+    assert [r["id"] for r in archive.read(uid, 2, before_id=4)] == [2, 3]
+    assert archive.read(uid, 0) == []
+    assert [r["id"] for r in archive.read(other, 50)] == [6, 7]
+
+
+def test_duplicates_are_read_once(tmp_path):
+    archive = HistoryArchive(str(tmp_path), "chatbox")
+    uid = uuid4()
+    rows = _rows(uid, 1, 3, datetime(2024, 1, 1))
+    archive.append(rows)
+    # the process stopped before the rows were deleted from the database, and they were archived again
+    archive.append(rows)
+    assert [r["id"] for r in archive.read(uid, 50)] == [1, 2, 3]
+
+
+def test_index_is_rebuilt_from_the_files(tmp_path, monkeypatch):
+    uid = uuid4()
+    HistoryArchive(str(tmp_path), "chatbox").append(_rows(uid, 1, 2, datetime(2024, 1, 1)) +
+                                                    _rows(uid, 3, 2, datetime(2024, 5, 1)))
+    archive = HistoryArchive(str(tmp_path), "chatbox")
+    opened = []
+    real_open = gzip.open
+    monkeypatch.setattr(retention_module.gzip, "open", lambda path, *args, **kwargs: (
+        opened.append(os.path.basename(path)), real_open(path, *args, **kwargs))[1])
+    assert [r["id"] for r in archive.read(uid, 50)] == [1, 2, 3, 4]
+    # the first read scans every file to build the index
+    assert len(opened) == 4
+    opened.clear()
+    assert archive.read(uuid4(), 50) == []
+    assert opened == []
+    # only the newest month is needed for the newest messages
+    assert [r["id"] for r in archive.read(uid, 2)] == [3, 4]
+    assert opened == ["chatbox-history-2024-05.ndjson.gz"]
+    opened.clear()
+    assert [r["id"] for r in archive.read(uid, 50, before_id=3)] == [1, 2]
+    assert opened == ["chatbox-history-2024-01.ndjson.gz"]
+
+
+def test_invalid_policy(tmp_path):
+    with pytest.raises(ValueError):
+        RetentionPolicy(days=0, archive_dir=str(tmp_path))
+
+
+async def _add_old_and_new(backend: AsyncSQLSession, now: datetime) -> Connection:
+    cc = Connection(s1_id=1, s2_id="s2-1")
+    assert await backend.add_new_connection(cc)
+    old = [Message(cc, SentBy.s1, f"old {i}", created_at=now - timedelta(days=40, minutes=-i)) for i in range(3)]
+    new = [Message(cc, SentBy.s2, f"new {i}", created_at=now - timedelta(minutes=10 - i)) for i in range(2)]
+    await backend.commit_message_batch(old + new)
+    return cc
+
+
+def test_retention_reads_across_the_database_and_the_archive(tmp_path):
+    backend = AsyncSQLSession(os.path.join(tmp_path, "chatbox"), int, str, init=True)
+    retention = HistoryRetention(RetentionPolicy(days=30, archive_dir=os.path.join(tmp_path, "archive"),
+                                                 batch_size=2), backend, "chatbox")
+    now = datetime.utcnow()
+
+    async def main():
+        cc = await _add_old_and_new(backend, now)
+        assert await retention.archive_once(now) == 3
+        assert await retention.archive_once(now) == 0
+        assert [m.content for m in await backend.get_history(cc)] == ["new 0", "new 1"]
+        history = await retention.get_history(cc, 50)
+        assert [m.content for m in history] == ["old 0", "old 1", "old 2", "new 0", "new 1"]
+        assert [m.history_id for m in history] == sorted(m.history_id for m in history)
+        assert [m.content for m in await retention.get_history(cc, 3)] == ["old 2", "new 0", "new 1"]
+        assert [m.content for m in await retention.get_history(cc, 2, history[2].history_id)] == ["old 0", "old 1"]
+
+    try:
+        asyncio.run(main())
+    finally:
+        backend.close()
+
+
+def test_backend_without_retention_support(tmp_path):
+    class NoRetention:
+        pass
+
+    with pytest.raises(TypeError):
+        HistoryRetention(RetentionPolicy(days=1, archive_dir=str(tmp_path)), NoRetention(), "chatbox")
+
+
+def test_chatbox_archives_in_the_background(tmp_path):
+    path = os.path.join(tmp_path, "data", "chatbox")
+    os.makedirs(os.path.dirname(path))
+    archive_dir = os.path.join(tmp_path, "archive")
+    backend = AsyncSQLSession(path, int, str, init=True)
+    now = datetime.utcnow()
+    asyncio.run(_add_old_and_new(backend, now))
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, backend=backend,
+                 retention=RetentionPolicy(days=30, archive_dir=archive_dir))
+    cb.get_worker2.set_create_callback(lambda s1_id: f"s2-{s1_id}")
+
+    async def main():
+        tasks = cb.run()
+        try:
+            while not os.listdir(archive_dir):
+                await asyncio.sleep(0.01)
+            await cb.get_worker1.access_new_client(1)
+            cc = cb.get_worker1.get_connection(1)
+            for _ in range(100):
+                if len(await backend.get_history(cc)) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert [m.content for m in await cc.history()] == ["old 0", "old 1", "old 2", "new 0", "new 1"]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            cb.close()
+
+    asyncio.run(main())
+    assert all(file_name.startswith("chatbox-history-") for file_name in os.listdir(archive_dir))
+    assert sorted(os.listdir(tmp_path)) == ["archive", "data"]
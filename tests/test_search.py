@@ -0,0 +1,149 @@
+"""
+Tests of the FTS5 full-text search over history, and of the migration which creates its index.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import pickle
+import sqlite3
+from uuid import uuid4
+
+import pytest
+
+from chatbox50 import AsyncSQLSession, ChatBox, Connection, Message, SegmentLogBackend, SentBy
+from chatbox50.migrations import LATEST_VERSION, get_schema_version, migrate
+
+CONTENTS = ["hello world", "hello there", "goodbye world", "help wanted", "world hello world"]
+
+
+@pytest.fixture(params=["text", "compact"])
+def session(request, tmp_path):
+    session = AsyncSQLSession(os.path.join(tmp_path, "chatbox"), int, str, init=True, storage_format=request.param)
+    yield session
+    session.close()
+
+
+async def _add(session: AsyncSQLSession, s1_id: int, contents: list[str]) -> Connection:
+    cc = Connection(s1_id=s1_id, s2_id=f"s2-{s1_id}")
+    assert await session.add_new_connection(cc)
+    await session.commit_message_batch([Message(cc, SentBy.s1, content) for content in contents])
+    return cc
+
+
+def test_search(session):
+    async def main():
+        cc = await _add(session, 1, CONTENTS)
+        assert sorted(m.content for m in await session.search("hello")) == \
+               ["hello there", "hello world", "world hello world"]
+        assert sorted(m.content for m in await session.search('"hello world"')) == \
+               ["hello world", "world hello world"]
+        assert sorted(m.content for m in await session.search("hel*")) == \
+               ["hello there", "hello world", "help wanted", "world hello world"]
+        assert [m.content for m in await session.search("hello AND goodbye")] == []
+        found = (await session.search("goodbye"))[0]
+        assert (found.uid, found.chat_client.s1_id, found.chat_client.s2_id, found.sent_by) == \
+               (cc.uid, 1, "s2-1", SentBy.s1)
+        assert found.history_id is not None and found.seq == 0
+
+    asyncio.run(main())
+
+
+def test_best_match_first(session):
+    async def main():
+        await _add(session, 1, ["world", "a b c d e f g h world", "world world world"])
+        assert [m.content for m in await session.search("world")][0] == "world world world"
+
+    asyncio.run(main())
+
+
+def test_pages_and_uid(session):
+    async def main():
+        first = await _add(session, 1, [f"common {i}" for i in range(5)])
+        second = await _add(session, 2, [f"common {i}" for i in range(5, 8)])
+        pages = [await session.search("common", 3, offset) for offset in (0, 3, 6)]
+        assert [len(page) for page in pages] == [3, 3, 2]
+        assert len({m.history_id for page in pages for m in page}) == 8
+        assert sorted(m.content for m in await session.search("common", uid=second.uid)) == \
+               ["common 5", "common 6", "common 7"]
+        assert all(m.uid == first.uid for m in await session.search("common", uid=first.uid))
+
+    asyncio.run(main())
+
+
+def test_deleted_messages_are_not_found(session):
+    async def main():
+        await _add(session, 1, CONTENTS)
+        found = await session.search("goodbye")
+        assert await session.delete_history([m.history_id for m in found]) == 1
+        assert await session.search("goodbye") == []
+        assert len(await session.search("hello")) == 3
+
+    asyncio.run(main())
+
+
+def test_invalid_query(session):
+    async def main():
+        with pytest.raises(ValueError):
+            await session.search('"unterminated')
+
+    asyncio.run(main())
+
+
+def test_migration_indexes_existing_history(tmp_path):
+    # a database of the first version, before schema_version existed, with pickled properties
+    path = os.path.join(tmp_path, "legacy")
+    conn = sqlite3.connect(path + ".db")
+    conn.execute("CREATE TABLE client(id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT DEFAULT CURRENT_TIMESTAMP,"
+                 "uid VARCHAR(127) NOT NULL, service1_id VARCHAR(127) NOT NULL, service2_id VARCHAR(127) NOT NULL,"
+                 "properties BLOB NOT NULL)")
+    conn.execute("CREATE TABLE history(id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT,"
+                 "client_id INTEGER NOT NULL, content TEXT NOT NULL, sent_by INTEGER NOT NULL,"
+                 "FOREIGN KEY (client_id) REFERENCES client(id))")
+    uid = uuid4()
+    conn.execute("INSERT INTO client (uid, service1_id, service2_id, properties) VALUES (?, '1', 's2-1', ?)",
+                 (str(uid), pickle.dumps({"name": "old"})))
+    conn.executemany("INSERT INTO history (created_at, client_id, content, sent_by) "
+                     "VALUES ('2024-01-01 00:00:00', 1, ?, 0)", [(content,) for content in CONTENTS])
+    conn.commit()
+    assert get_schema_version(conn) == 0
+    conn.close()
+
+    session = AsyncSQLSession(path, int, str, init=True)
+
+    async def main():
+        assert sorted(m.content for m in await session.search("goodbye OR help")) == ["goodbye world", "help wanted"]
+        assert all(m.uid == uid for m in await session.search("world"))
+        # new messages are indexed by the triggers
+        cc = await session.get_connection(SentBy.s1, 1)
+        assert cc["name"] == "old"
+        await session.commit_message_batch([Message(cc, SentBy.s2, "goodbye again")])
+        assert len(await session.search("goodbye")) == 2
+
+    try:
+        asyncio.run(main())
+    finally:
+        session.close()
+    conn = sqlite3.connect(path + ".db")
+    assert get_schema_version(conn) == LATEST_VERSION
+    # nothing left to apply
+    assert migrate(conn) == LATEST_VERSION
+    conn.close()
+
+
+def test_chatbox_search(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str)
+    segment_log = ChatBox(name=path + "-log", s1_id_type=int, s2_id_type=str,
+                          backend=SegmentLogBackend(path + "-log", int, str))
+
+    async def main():
+        assert await cb.search("anything") == []
+        with pytest.raises(NotImplementedError):
+            await segment_log.search("anything")
+
+    try:
+        asyncio.run(main())
+    finally:
+        cb.close()
+        segment_log.close()
@@ -0,0 +1,137 @@
+"""
+Tests of `ServiceWorker` on its own. ChatBox is replaced by an access callback which creates connections.
+
+    python -m pytest tests
+"""
+import asyncio
+import logging
+
+from chatbox50 import Connection, Message, SentBy, ServiceWorker
+from chatbox50.queues import BoundedQueue, QueueConfig
+
+
+def _new_worker(**kwargs) -> ServiceWorker:
+    connections: dict[int, Connection] = dict()
+
+    async def access(service_id, create_client_if_no_exist=True, uid=None):
+        if service_id not in connections:
+            connections[service_id] = Connection(s1_id=service_id, s2_id=f"s2-{service_id}", uid=uid)
+        return connections[service_id]
+
+    return ServiceWorker(name="s1", service_number=SentBy.s1, set_id_type=int,
+                         upload_que=BoundedQueue(QueueConfig()), new_access_callback=access,
+                         deactivate_callback=lambda cc, sent_by: None, _logger=logging.getLogger("test"), **kwargs)
+
+
+def _client_queues(worker: ServiceWorker) -> int:
+    return next(s for s in worker.queue_stats() if s["name"] == "s1.client")["queues"]
+
+
+def test_hibernate_and_restore():
+    worker = _new_worker()
+
+    async def main():
+        await worker.access_new_client(1)
+        cc = worker.get_connection(1)
+        cc.add_message(Message(cc, SentBy.s2, "kept in memory"), saved=True)
+        assert _client_queues(worker) == 1
+
+        assert worker.hibernate_client(1)
+        assert not worker.hibernate_client(1)
+        assert 1 not in worker._active_ids and 1 in worker._hibernated
+        assert _client_queues(worker) == 0
+        # without a hibernate callback, the messages are freed
+        assert list(cc.messages) == []
+        assert worker.get_uid_from_service_id(1) == cc.uid
+
+        # a message restores it with a new client queue
+        assert await worker.deliver(Message(cc, SentBy.s2, "wake up"))
+        assert 1 in worker._active_ids and 1 not in worker._hibernated
+        assert worker.get_client_queue(1).get_nowait().content == "wake up"
+
+    asyncio.run(main())
+
+
+def test_get_connection_restores():
+    worker = _new_worker()
+
+    async def main():
+        await worker.access_new_client(1)
+        cc = worker.get_connection(1)
+        worker.hibernate_client(1)
+        assert worker.get_connection(1) is cc
+        assert _client_queues(worker) == 1
+
+    asyncio.run(main())
+
+
+def test_client_being_read_is_not_hibernated():
+    worker = _new_worker()
+
+    async def main():
+        await worker.access_new_client(1)
+        reader = asyncio.create_task(worker.get_client_queue(1).get())
+        await asyncio.sleep(0)
+        assert not worker.hibernate_client(1)
+        assert 1 in worker._active_ids
+        reader.cancel()
+
+    asyncio.run(main())
+
+
+def test_hibernate_callback_decides_about_the_messages():
+    hibernated = []
+    worker = _new_worker(hibernate_callback=lambda cc, sent_by: hibernated.append((cc.s1_id, sent_by)))
+
+    async def main():
+        await worker.access_new_client(1)
+        cc = worker.get_connection(1)
+        cc.add_message(Message(cc, SentBy.s2, "kept in memory"), saved=True)
+        worker.hibernate_client(1)
+        assert hibernated == [(1, SentBy.s1)]
+        assert [m.content for m in cc.messages] == ["kept in memory"]
+
+    asyncio.run(main())
+
+
+def test_idle_clients_are_hibernated():
+    worker = _new_worker(idle_ttl=0.05, idle_tick=0.01)
+
+    async def main():
+        tasks = worker.run()
+        try:
+            await worker.access_new_client(1)
+            await worker.access_new_client(2)
+            send = worker.get_msg_sender(2)
+            # client 2 keeps sending, client 1 is idle
+            for _ in range(15):
+                await send("still here")
+                await asyncio.sleep(0.01)
+            assert 1 in worker._hibernated
+            assert 2 in worker._active_ids
+            await asyncio.sleep(0.15)
+            assert 2 in worker._hibernated
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            worker.close()
+
+    asyncio.run(main())
+
+
+def test_default_client_queue_drops_the_oldest():
+    worker = _new_worker()
+
+    async def main():
+        await worker.access_new_client(1)
+        cc = worker.get_connection(1)
+        for i in range(1100):
+            assert await worker.deliver(Message(cc, SentBy.s2, str(i)))
+        client_queue = worker.get_client_queue(1)
+        assert client_queue.qsize() == 1024
+        assert client_queue.get_nowait().content == "76"
+        stats = next(s for s in worker.queue_stats() if s["name"] == "s1.client")
+        assert (stats["dropped"], stats["high_water"], stats["policy"]) == (76, 1024, "drop_oldest")
+
+    asyncio.run(main())
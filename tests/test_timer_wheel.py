@@ -0,0 +1,101 @@
+"""
+Tests of `TimerWheel` with a clock which only moves when the test moves it.
+
+    python -m pytest tests
+"""
+import pytest
+
+from chatbox50.timer_wheel import TimerWheel
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _wheel(tick: float = 1.0, slots: int = 8) -> tuple[TimerWheel, FakeClock]:
+    clock = FakeClock()
+    return TimerWheel(tick, slots, clock=clock), clock
+
+
+def test_expires_after_the_deadline():
+    wheel, clock = _wheel()
+    wheel.schedule("a", 2)
+    wheel.schedule("b", 5)
+    assert ("a" in wheel, len(wheel)) == (True, 2)
+    clock.now += 1.5
+    assert wheel.expire() == []
+    clock.now += 0.5
+    assert wheel.expire() == ["a"]
+    assert "a" not in wheel and wheel.deadline("a") is None
+    clock.now += 3
+    assert wheel.expire() == ["b"]
+    assert len(wheel) == 0
+
+
+def test_postpone():
+    wheel, clock = _wheel()
+    wheel.schedule("a", 2)
+    clock.now += 1
+    wheel.schedule("a", 2)
+    assert wheel.deadline("a") == clock.now + 2
+    clock.now += 1
+    # the old deadline passed, the key is moved to the bucket of the new one
+    assert wheel.expire() == []
+    clock.now += 1
+    assert wheel.expire() == ["a"]
+
+
+def test_bring_forward():
+    wheel, clock = _wheel()
+    wheel.schedule("a", 5)
+    wheel.schedule("a", 1)
+    clock.now += 1
+    assert wheel.expire() == ["a"]
+    clock.now += 5
+    assert wheel.expire() == []
+
+
+def test_cancel():
+    wheel, clock = _wheel()
+    wheel.schedule("a", 1)
+    assert wheel.cancel("a")
+    assert not wheel.cancel("a")
+    clock.now += 2
+    assert wheel.expire() == []
+
+
+def test_deadline_further_than_one_round():
+    wheel, clock = _wheel(slots=4)
+    wheel.schedule("a", 10)
+    for _ in range(9):
+        clock.now += 1
+        assert wheel.expire() == []
+    clock.now += 1
+    assert wheel.expire() == ["a"]
+
+
+def test_long_pause_expires_everything_once():
+    wheel, clock = _wheel(slots=4)
+    for i in range(10):
+        wheel.schedule(i, i + 1)
+    clock.now += 100
+    assert sorted(wheel.expire()) == list(range(10))
+    assert wheel.expire() == []
+
+
+def test_deadline_which_already_passed():
+    wheel, clock = _wheel()
+    clock.now += 3
+    wheel.expire()
+    wheel.schedule("a", -10)
+    assert wheel.expire() == ["a"]
+
+
+@pytest.mark.parametrize("tick, slots", [(0, 8), (-1, 8), (1, 0)])
+def test_invalid_arguments(tick, slots):
+    with pytest.raises(ValueError):
+        TimerWheel(tick, slots)
@@ -0,0 +1,182 @@
+"""
+Tests of the group commit of `WriteBehindBuffer`, and of how ChatBox marks the committed messages.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+
+import pytest
+
+from chatbox50 import AsyncSQLSession, ChatBox, Connection, Message, SentBy
+from chatbox50.write_behind import WriteBehindBuffer
+
+CC = Connection(s1_id=1, s2_id="a")
+
+
+def _messages(count: int, prefix: str = "message") -> list[Message]:
+    return [Message(CC, SentBy.s1, f"{prefix} {i}") for i in range(count)]
+
+
+class Recorder:
+    """
+    `flush` records each group, and fails the messages whose content is "fail".
+    """
+
+    def __init__(self):
+        self.groups: list[list[str]] = []
+
+    async def flush(self, messages: list[Message]) -> list[bool]:
+        self.groups.append([m.content for m in messages])
+        return [m.content != "fail" for m in messages]
+
+
+async def _stop(task: asyncio.Task):
+    task.cancel()
+    await asyncio.wait([task])
+
+
+def test_flushed_when_full():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder.flush, max_batch=3, max_delay=10)
+
+    async def main():
+        task = buffer.run()
+        futures = [buffer.submit(m) for m in _messages(3)]
+        assert len(buffer) == 3
+        assert await asyncio.wait_for(asyncio.gather(*futures), 1) == [True] * 3
+        assert recorder.groups == [["message 0", "message 1", "message 2"]]
+        assert len(buffer) == 0
+        await _stop(task)
+
+    asyncio.run(main())
+
+
+def test_flushed_after_max_delay():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder.flush, max_batch=100, max_delay=0.05)
+
+    async def main():
+        task = buffer.run()
+        future = buffer.submit(_messages(1)[0])
+        await asyncio.sleep(0.01)
+        assert not future.done()
+        assert await asyncio.wait_for(future, 1)
+        assert recorder.groups == [["message 0"]]
+        await _stop(task)
+
+    asyncio.run(main())
+
+
+def test_groups_of_max_batch():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder.flush, max_batch=4)
+
+    async def main():
+        singles = [buffer.submit(m) for m in _messages(3, "single")]
+        batch = buffer.submit_batch(_messages(3, "batch"))
+        large = buffer.submit_batch(_messages(6, "large"))
+        assert await buffer.flush() == 12
+        # a batch is never split, even when it is larger than max_batch
+        assert [len(group) for group in recorder.groups] == [3, 3, 6]
+        assert [f.result() for f in singles] == [True] * 3
+        assert (batch.result(), large.result()) == ([True] * 3, [True] * 6)
+
+    asyncio.run(main())
+
+
+def test_failed_messages():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder.flush, max_batch=10)
+
+    async def main():
+        ok, failed = buffer.submit(_messages(1)[0]), buffer.submit(Message(CC, SentBy.s1, "fail"))
+        batch = buffer.submit_batch([Message(CC, SentBy.s1, "fail")] + _messages(1))
+        assert await buffer.flush() == 2
+        assert (ok.result(), failed.result(), batch.result()) == (True, False, [False, True])
+
+    asyncio.run(main())
+
+
+def test_raising_flush_func_fails_the_group_and_keeps_running():
+    calls = []
+
+    def flush_func(messages):
+        calls.append(len(messages))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return [True] * len(messages)
+
+    buffer = WriteBehindBuffer(flush_func, max_batch=2, max_delay=10)
+
+    async def main():
+        task = buffer.run()
+        first = buffer.submit_batch(_messages(2))
+        assert await asyncio.wait_for(first, 1) == [False, False]
+        # failed messages aren't retried, the next group is committed
+        second = buffer.submit_batch(_messages(2))
+        assert await asyncio.wait_for(second, 1) == [True, True]
+        assert calls == [2, 2]
+        assert not task.done()
+        await _stop(task)
+
+    asyncio.run(main())
+
+
+def test_flushed_on_cancel():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder.flush, max_batch=100, max_delay=10)
+
+    async def main():
+        task = buffer.run()
+        futures = [buffer.submit(m) for m in _messages(5)]
+        await asyncio.sleep(0)
+        await _stop(task)
+        assert [f.result() for f in futures] == [True] * 5
+        assert recorder.groups == [[f"message {i}" for i in range(5)]]
+
+    asyncio.run(main())
+
+
+def test_invalid_max_batch():
+    with pytest.raises(ValueError):
+        WriteBehindBuffer(Recorder().flush, max_batch=0)
+
+
+class FailingSQLSession(AsyncSQLSession):
+    async def commit_message_batch(self, messages: list[Message]) -> list[bool]:
+        saved = iter(await super().commit_message_batch([m for m in messages if m.content != "fail"]))
+        return [False if m.content == "fail" else next(saved) for m in messages]
+
+
+def test_chatbox_marks_committed_and_failed_messages_saved(tmp_path):
+    path = os.path.join(tmp_path, "chatbox")
+    backend = FailingSQLSession(path, int, str, init=True)
+    cb = ChatBox(name=path, s1_id_type=int, s2_id_type=str, backend=backend, write_delay=0.2)
+    w1, w2 = cb.get_worker1, cb.get_worker2
+    w2.set_create_callback(lambda s1_id: f"s2-{s1_id}")
+
+    async def main():
+        tasks = cb.run()
+        try:
+            await w1.access_new_client(1)
+            cc = w1.get_connection(1)
+            await w1.send_many(1, ["first", "fail", "last"])
+            for _ in range(3):
+                await asyncio.wait_for(w2.receive_queue.get(), 5)
+            assert [m.content for m in cc.unsaved_messages] == ["first", "fail", "last"]
+            for _ in range(100):
+                if not cc.unsaved_messages:
+                    break
+                await asyncio.sleep(0.01)
+            # a failed message is logged and not retried, so it leaves the unsaved ones too
+            assert list(cc.unsaved_messages) == []
+            assert cc.number_of_saved_messages == 3
+            assert [m.content for m in await backend.get_history(cc)] == ["first", "last"]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            cb.close()
+
+    asyncio.run(main())
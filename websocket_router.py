@@ -4,14 +4,14 @@ from uuid import UUID
 from fastapi import WebSocket, WebSocketDisconnect
 import logging
 
-from chatbox50 import Message, SentBy, ServiceWorker
+from chatbox50 import Message, QueueDisconnected, SentBy, ServiceWorker
 
 logger = logging.getLogger(__name__)
 NAME = "ChatBox"
 
 
 async def ws_messenger(ws: WebSocket, send_queue: asyncio.Queue, uid: UUID, web_api: ServiceWorker):
-    send_task = asyncio.create_task(_ws_sender(ws, send_queue), name="websocket_sender")
+    send_task = asyncio.create_task(_ws_sender(ws, send_queue, web_api), name="websocket_sender")
 
     def __callback():
         return web_api.deactivate_client(uid)
@@ -26,13 +26,14 @@ async def ws_messenger(ws: WebSocket, send_queue: asyncio.Queue, uid: UUID, web_
     logger.debug({"place": "ws_endpoint", "action": "task_done", "object": "ws_receiver"})
 
 
-async def _ws_sender(ws: WebSocket, queue: asyncio.Queue):
+async def _ws_sender(ws: WebSocket, queue: asyncio.Queue, web_api: ServiceWorker):
     """ ** This function is completed **
     Notes:
         Queueから受け取ったメッセージをクライアントに送信します．
     Args:
         ws: WebSocket
         queue: Discordからクライアントへ送るためのQueueです．
+        web_api: 送信までの時間をメトリクスに記録します．
 
     Returns:
 
@@ -46,10 +47,16 @@ async def _ws_sender(ws: WebSocket, queue: asyncio.Queue):
             auther = "you" if msg.sent_by == SentBy.s1 else NAME + "Service"
             send_data = {"auther": auther, "content": msg.content}
             await ws.send_json(send_data)
+            web_api.observe_sent(msg)
             logger.debug({"place": "ws_sender", "action": "send", "status": "success", "content": send_data})
     except WebSocketDisconnect:
         logger.debug({"action": "send", "status": "disconnect"})
         return
+    except QueueDisconnected:
+        # The client couldn't keep up with its messages and was disconnected by the queue policy.
+        logger.warning({"place": "ws_sender", "action": "send", "status": "overflow"})
+        await ws.close(code=1008)
+        return
 
 
 async def _ws_receiver(ws: WebSocket, uid: UUID, web_api: ServiceWorker):